@@ -108,6 +108,14 @@ Journal in human readable form.
 
 Journal in XML format, requires python. This dependency can be avoided if the test is run with variable BEAKERLIB_JOURNAL set to 0 in which case journal.xml is not created.
 
+=head3 Metafile
+
+Journal is created from journal.meta which is written as the test runs. Setting BEAKERLIB_METAFILE_FORMAT variable to 'binary' makes beakerlib write it in a binary format which does not need to run base64 for every logged value. The variable has to keep its value for the whole test run, including after reboot.
+
+=head3 Journal server
+
+Setting BEAKERLIB_JOURNAL_SERVER variable to '1' makes rlJournalStart start a server which keeps the journal parsed in memory and writes it out on request, so that functions updating journal.xml do not need to parse the metafile again every time. The server listens on journal.socket in BEAKERLIB_DIR and exits at rlJournalEnd or after an hour of inactivity. Whenever the server is not available, journal.xml is created without it.
+
 =head3 XSLT
 
 XML journal can be transformed through XSLT template. Which template is used is configurable by setting BEAKERLIB_JOURNAL variable. Value can be either filename in which case beakerlib will try to use $INSTALL_DIR/xslt-template/$filename (e.g.: /usr/share/beakerlib/xstl-templates/xunit.xsl) or it can be path to a template anywhere on the system.
@@ -45,10 +45,17 @@ printing journal contents.
 =cut
 
 __INTERNAL_JOURNALIST=beakerlib-journalling
+__INTERNAL_JOURNAL_CLIENT=beakerlib-journalclient
+__INTERNAL_DAEMONIZE=beakerlib-daemonize
 __INTERNAL_TIMEFORMAT_TIME="%H:%M:%S"
 __INTERNAL_TIMEFORMAT_DATE_TIME="%Y-%m-%d %H:%M:%S %Z"
 __INTERNAL_TIMEFORMAT_SHORT="$__INTERNAL_TIMEFORMAT_TIME"
 __INTERNAL_TIMEFORMAT_LONG="$__INTERNAL_TIMEFORMAT_DATE_TIME"
+# Space reserved for "Test finished" and "Test duration" in text journals,
+# see __INTERNAL_update_journal_txt
+__INTERNAL_JOURNAL_TXT_FINISHED_WIDTH=48
+__INTERNAL_JOURNAL_TXT_DURATION_WIDTH=24
+__INTERNAL_JOURNAL_TXT_HEADER_SIZE=16384
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -95,8 +102,16 @@ rlJournalStart(){
     # set global internal BeakerLib journal and metafile variables
     export __INTERNAL_BEAKERLIB_JOURNAL="$BEAKERLIB_DIR/journal.xml"
     export __INTERNAL_BEAKERLIB_METAFILE="$BEAKERLIB_DIR/journal.meta"
+    export __INTERNAL_BEAKERLIB_CHECKPOINT="$BEAKERLIB_DIR/journal.checkpoint"
+    export __INTERNAL_BEAKERLIB_JOURNAL_SOCKET="$BEAKERLIB_DIR/journal.socket"
     export __INTERNAL_BEAKERLIB_JOURNAL_TXT="$BEAKERLIB_DIR/journal.txt"
     export __INTERNAL_BEAKERLIB_JOURNAL_COLORED="$BEAKERLIB_DIR/journal_colored.txt"
+    # binary metafile is cheaper to write, see python/metafile.py
+    if [[ "$BEAKERLIB_METAFILE_FORMAT" == "binary" ]]; then
+        export __INTERNAL_METAFILE_FORMAT="binary"
+    else
+        export __INTERNAL_METAFILE_FORMAT="text"
+    fi
 
     # make sure the directory is ready, otherwise we cannot continue
     if [ ! -d "$BEAKERLIB_DIR" ] ; then
@@ -106,7 +121,7 @@ rlJournalStart(){
     fi
 
     # creating queue file
-    touch $__INTERNAL_BEAKERLIB_METAFILE || {
+    touch "$__INTERNAL_BEAKERLIB_METAFILE" || {
       __INTERNAL_LogText "could not write to BEAKERLIB_DIR $BEAKERLIB_DIR" FATAL
       exit 1
     }
@@ -168,6 +183,9 @@ rlJournalStart(){
     else
         rlLogError "rlJournalStart: Failed to set up cleanup infrastructure"
     fi
+    if [[ "$BEAKERLIB_JOURNAL_SERVER" == "1" && "$BEAKERLIB_JOURNAL" != "0" ]]; then
+        __INTERNAL_JournalServerStart
+    fi
     __INTERNAL_PersistentDataSave
 }
 
@@ -241,15 +259,16 @@ rlJournalEnd(){
 
     if [ -n "$TESTID" ] ; then
         __INTERNAL_JournalXMLCreate
-        $BEAKERLIB_COMMAND_SUBMIT_LOG -T $TESTID -l $__INTERNAL_BEAKERLIB_JOURNAL \
+        $BEAKERLIB_COMMAND_SUBMIT_LOG -T $TESTID -l "$__INTERNAL_BEAKERLIB_JOURNAL" \
         || rlLogError "rlJournalEnd: Submit wasn't successful"
     else
         [[ "$BEAKERLIB_JOURNAL" == "0" ]] || rlLog "JOURNAL XML: $__INTERNAL_BEAKERLIB_JOURNAL"
         rlLog "JOURNAL TXT: $__INTERNAL_BEAKERLIB_JOURNAL_TXT"
     fi
 
-    echo "#End of metafile" >> $__INTERNAL_BEAKERLIB_METAFILE
+    __INTERNAL_MetafileComment "End of metafile"
     __INTERNAL_JournalXMLCreate
+    __INTERNAL_JournalServerStop
     __INTERNAL_TestResultsSave
 }
 
@@ -269,8 +288,36 @@ rlJournalEnd(){
 #=cut
 
 __INTERNAL_JournalXMLCreate() {
-    [[ "$BEAKERLIB_JOURNAL" == "0" ]] || $__INTERNAL_JOURNALIST $__INTERNAL_XSLT --metafile \
-    "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$__INTERNAL_BEAKERLIB_JOURNAL"
+    [[ "$BEAKERLIB_JOURNAL" == "0" ]] && return 0
+    if [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]]; then
+        $__INTERNAL_JOURNAL_CLIENT "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" $__INTERNAL_XSLT \
+        --journal "$__INTERNAL_BEAKERLIB_JOURNAL"
+        local res=$?
+        # 69 means the server is not running, the journal is created directly then
+        [[ $res -eq 69 ]] || return $res
+    fi
+    $__INTERNAL_JOURNALIST $__INTERNAL_XSLT \
+    --checkpoint "$__INTERNAL_BEAKERLIB_CHECKPOINT" --format "$__INTERNAL_METAFILE_FORMAT" \
+    --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$__INTERNAL_BEAKERLIB_JOURNAL"
+}
+
+
+# Starts server keeping the journal parsed in memory, so that
+# __INTERNAL_JournalXMLCreate does not need to run journalling.py every time
+__INTERNAL_JournalServerStart() {
+    # daemonize splits the command as shell would, paths are quoted
+    local command
+    printf -v command '%q ' "$__INTERNAL_JOURNALIST" --server "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" \
+        --checkpoint "$__INTERNAL_BEAKERLIB_CHECKPOINT" --format "$__INTERNAL_METAFILE_FORMAT" \
+        --metafile "$__INTERNAL_BEAKERLIB_METAFILE"
+    $__INTERNAL_DAEMONIZE "$command" \
+    || rlLogWarning "rlJournalStart: Failed to start journal server"
+}
+
+__INTERNAL_JournalServerStop() {
+    [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]] || return 0
+    $__INTERNAL_JOURNAL_CLIENT "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" --stop
+    true
 }
 
 
@@ -333,9 +380,9 @@ Example:
 rlJournalPrint(){
   __INTERNAL_JournalXMLCreate
   if [[ "$1" == "raw" ]]; then
-    cat $__INTERNAL_BEAKERLIB_JOURNAL
+    cat "$__INTERNAL_BEAKERLIB_JOURNAL"
   else
-    cat $__INTERNAL_BEAKERLIB_JOURNAL | xmllint --format -
+    cat "$__INTERNAL_BEAKERLIB_JOURNAL" | xmllint --format -
   fi
 }
 
@@ -354,11 +401,42 @@ __INTERNAL_update_journal_txt() {
   [[ -n "$__INTERNAL_ENDTIME" ]] && printf -v endtime "%($__INTERNAL_TIMEFORMAT_LONG)T" $__INTERNAL_ENDTIME
   local sed_patterns="0,/    Test finished : /s/^(    Test finished : ).*\$/\1$endtime/;0,/    Test duration : /s/^(    Test duration : ).*\$/\1$__INTERNAL_DURATION seconds/"
   for textfile in "$__INTERNAL_BEAKERLIB_JOURNAL_COLORED" "$__INTERNAL_BEAKERLIB_JOURNAL_TXT"; do
-    sed -r -i "$sed_patterns" "$textfile"
+    __INTERNAL_update_journal_txt_header "$textfile" "$endtime" "$__INTERNAL_DURATION seconds" \
+    || sed -r -i "$sed_patterns" "$textfile"
   done
 
 }
 
+# Overwrites "Test finished" and "Test duration" values in the header of
+# text journal. Header is created with the values padded to a fixed width,
+# so only the beginning of the file is read and written instead of rewriting
+# the whole file. Fails if there is no space reserved for the values.
+__INTERNAL_update_journal_txt_header() {
+  local textfile="$1" finished="$2" duration="$3"
+  local finished_label="    Test finished : " duration_label="    Test duration : "
+  local finished_width=$__INTERNAL_JOURNAL_TXT_FINISHED_WIDTH
+  local duration_width=$__INTERNAL_JOURNAL_TXT_DURATION_WIDTH
+  # offsets are counted in bytes
+  local LC_ALL=C IFS=''
+  local head before finished_at duration_at fd
+
+  read -r -N $__INTERNAL_JOURNAL_TXT_HEADER_SIZE head < "$textfile"
+  [[ "$head" == *"$finished_label"*"$duration_label"* ]] || return 1
+  before="${head%%"$finished_label"*}"
+  finished_at=$(( ${#before} + ${#finished_label} ))
+  before="${head%%"$duration_label"*}"
+  duration_at=$(( ${#before} + ${#duration_label} ))
+  [[ "${head:finished_at:finished_width+1}" =~ ^[^$'\n']*$'\n'$ && \
+     "${head:duration_at:duration_width+1}" =~ ^[^$'\n']*$'\n'$ ]] || return 1
+
+  exec {fd}<>"$textfile" || return 1
+  read -r -N $finished_at -u $fd before
+  printf '%-*.*s' $finished_width $finished_width "$finished" >&$fd
+  read -r -N $(( duration_at - finished_at - finished_width )) -u $fd before
+  printf '%-*.*s' $duration_width $duration_width "$duration" >&$fd
+  exec {fd}>&-
+}
+
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # rlJournalPrintText
@@ -531,7 +609,7 @@ rlGetPhaseState(){
 rljAddPhase(){
     __INTERNAL_PersistentDataLoad
     local MSG=${2:-"Phase of $1 type"}
-    local TXTLOG_START=$(cat $__INTERNAL_BEAKERLIB_JOURNAL_TXT | wc -l)
+    local TXTLOG_START=$(cat "$__INTERNAL_BEAKERLIB_JOURNAL_TXT" | wc -l)
     rlLogDebug "$FUNCNAME(): $(set | grep ^__INTERNAL_BEAKERLIB_JOURNAL_TXT=)"
     rlLogDebug "$FUNCNAME(): $(set | grep ^TXTLOG_START=)"
     rlLogDebug "rljAddPhase: Phase $MSG started"
@@ -607,7 +685,7 @@ rljClosePhase(){
     __INTERNAL_LogText "RESULT: $name" $result
     __INTERNAL_LogText ''
     local logfile="$(mktemp)"
-    tail -n +$((__INTERNAL_PHASE_TXTLOG_START+1)) $__INTERNAL_BEAKERLIB_JOURNAL_TXT > $logfile
+    tail -n +$((__INTERNAL_PHASE_TXTLOG_START+1)) "$__INTERNAL_BEAKERLIB_JOURNAL_TXT" > $logfile
     rlReport "$(echo "$name" | sed 's/[^[:alnum:]]\+/-/g')" "$result" "$score" "$logfile"
     rm -f $logfile
 
@@ -775,8 +853,12 @@ __INTERNAL_CreateHeader(){
     __INTERNAL_WriteToMetafile starttime
     __INTERNAL_WriteToMetafile endtime
     __INTERNAL_LogText "    Test started  : $(printf "%($__INTERNAL_TIMEFORMAT_LONG)T" $__INTERNAL_STARTTIME)" 2> /dev/null
-    __INTERNAL_LogText "    Test finished : " 2> /dev/null
-    __INTERNAL_LogText "    Test duration : " 2> /dev/null
+    # values are filled in place by __INTERNAL_update_journal_txt
+    local reserved
+    printf -v reserved '%*s' $__INTERNAL_JOURNAL_TXT_FINISHED_WIDTH ''
+    __INTERNAL_LogText "    Test finished : $reserved" 2> /dev/null
+    printf -v reserved '%*s' $__INTERNAL_JOURNAL_TXT_DURATION_WIDTH ''
+    __INTERNAL_LogText "    Test duration : $reserved" 2> /dev/null
 
     # Test name
     __INTERNAL_TEST_NAME="${TEST:-unknown}"
@@ -878,6 +960,7 @@ __INTERNAL_SET_TIMESTAMP() {
 # Adds --timestamp argument and indent
 # writes it into metafile
 # takes [element] --attribute1 value1 --attribute2 value2 .. [-- "content"]
+# In binary format values are written as they are, prefixed by their length
 __INTERNAL_WriteToMetafile(){
     __INTERNAL_SET_TIMESTAMP
     local indent
@@ -885,7 +968,13 @@ __INTERNAL_WriteToMetafile(){
     local lineraw=''
     local ARGS=("$@")
     local element=''
+    local binary=''
 
+    [[ "$__INTERNAL_METAFILE_FORMAT" == "binary" ]] && {
+      binary=1
+      # lengths are in bytes
+      local LC_ALL=C
+    }
     [[ "${1:0:2}" != "--" ]] && {
       local element="$1"
       shift
@@ -894,13 +983,22 @@ __INTERNAL_WriteToMetafile(){
     while [[ $# -gt 0 ]]; do
       case $1 in
       --)
-        line+=" -- \"$(echo -n "$2" | base64 -w 0)\""
+        if [[ -n "$binary" ]]; then
+          line+="0:${#2}:$2"
+        else
+          line+=" -- \"$(echo -n "$2" | base64 -w 0)\""
+        fi
         printf -v lineraw "%s -- %q" "$lineraw" "$2"
         shift 2
         break
         ;;
       --*)
-        line+=" $1=\"$(echo -n "$2" | base64 -w 0)\""
+        if [[ -n "$binary" ]]; then
+          arg="${1:2}"
+          line+="${#arg}:$arg${#2}:$2"
+        else
+          line+=" $1=\"$(echo -n "$2" | base64 -w 0)\""
+        fi
         printf -v lineraw "%s %s=%q" "$lineraw" "$1" "$2"
         shift
         ;;
@@ -920,10 +1018,25 @@ __INTERNAL_WriteToMetafile(){
 
     printf -v indent '%*s' $__INTERNAL_METAFILE_INDENT_LEVEL
 
-    line="$indent${element:+$element }--timestamp=\"${__INTERNAL_TIMESTAMP}\"$line"
     lineraw="$indent${element:+$element }--timestamp=\"${__INTERNAL_TIMESTAMP}\"$lineraw"
-    [[ -n "$DEBUG" ]] && echo "#${lineraw:1}" >> $__INTERNAL_BEAKERLIB_METAFILE
-    echo "$line" >> $__INTERNAL_BEAKERLIB_METAFILE
+    [[ -n "$DEBUG" ]] && __INTERNAL_MetafileComment "${lineraw:1}"
+    if [[ -n "$binary" ]]; then
+      line="${#__INTERNAL_METAFILE_INDENT_LEVEL}:$__INTERNAL_METAFILE_INDENT_LEVEL${#element}:${element}9:timestamp${#__INTERNAL_TIMESTAMP}:$__INTERNAL_TIMESTAMP$line"
+      printf '%d:%s\n' ${#line} "$line" >> "$__INTERNAL_BEAKERLIB_METAFILE"
+    else
+      line="$indent${element:+$element }--timestamp=\"${__INTERNAL_TIMESTAMP}\"$line"
+      echo "$line" >> "$__INTERNAL_BEAKERLIB_METAFILE"
+    fi
+}
+
+# Writes comment into metafile, it is not part of the journal
+__INTERNAL_MetafileComment(){
+    if [[ "$__INTERNAL_METAFILE_FORMAT" == "binary" ]]; then
+      local LC_ALL=C
+      printf '%d:#%s\n' $(( ${#1} + 1 )) "$1" >> "$__INTERNAL_BEAKERLIB_METAFILE"
+    else
+      echo "#$1" >> "$__INTERNAL_BEAKERLIB_METAFILE"
+    fi
 }
 
 __INTERNAL_PrintHeadLog() {
@@ -947,11 +1060,11 @@ __INTERNAL_PHASES_SKIPPED=$__INTERNAL_PHASES_SKIPPED
 __INTERNAL_JOURNAL_OPEN=$__INTERNAL_JOURNAL_OPEN
 __INTERNAL_PHASES_WORST_RESULT=$__INTERNAL_PHASES_WORST_RESULT
 EOF
-declare -p __INTERNAL_PHASE_FAILED >> $__INTERNAL_PERSISTENT_DATA
-declare -p __INTERNAL_PHASE_PASSED >> $__INTERNAL_PERSISTENT_DATA
-declare -p __INTERNAL_PHASE_STARTTIME >> $__INTERNAL_PERSISTENT_DATA
-declare -p __INTERNAL_PHASE_TXTLOG_START >> $__INTERNAL_PERSISTENT_DATA
-declare -p __INTERNAL_PHASE_METRICS >> $__INTERNAL_PERSISTENT_DATA
+declare -p __INTERNAL_PHASE_FAILED >> "$__INTERNAL_PERSISTENT_DATA"
+declare -p __INTERNAL_PHASE_PASSED >> "$__INTERNAL_PERSISTENT_DATA"
+declare -p __INTERNAL_PHASE_STARTTIME >> "$__INTERNAL_PERSISTENT_DATA"
+declare -p __INTERNAL_PHASE_TXTLOG_START >> "$__INTERNAL_PERSISTENT_DATA"
+declare -p __INTERNAL_PHASE_METRICS >> "$__INTERNAL_PERSISTENT_DATA"
 }
 
 __INTERNAL_PersistentDataLoad() {
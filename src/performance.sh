@@ -43,6 +43,9 @@ and memory performance of programs.
 
 =cut
 
+__INTERNAL_PERF_TIME=beakerlib-perftime
+__INTERNAL_RESOURCE_PROFILER=beakerlib-resourceprofile
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # rlPerfTime_RunsInTime
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -59,6 +62,12 @@ where averaging few runs is not precise. This is done several times, and
 the final result is the average of all runs. It prints the number on stdout,
 so it has to be captured.
 
+The command is evaluated by the shell running the test, so shell syntax,
+variables and functions can be used in it, and the time is kept by a timer
+running outside of it. A run still in progress when the time is up is
+finished, but not counted. When any of the counted runs fails, nothing is
+printed and 1 is returned.
+
     rlPerfTime_RunsInTime command [time] [runs]
 
 =over
@@ -83,31 +92,41 @@ rlPerfTime_RunsInTime(){
     local command=$1
     local time=${2:-"30"}
     local runs=${3:-"3"}
-    local RES=$((0))
-    local TOTAL=$((0))
-    local DONE_RUNS=$((1))
-    local PID=$$
     rlLog "Measuring how much runs we'll make in $time seconds"
     rlLog "Command: '$command'"
     rlLog "The result is an average of $runs rounds"
-    trap '  TOTAL=$((TOTAL+RES));\
-            rlLog "Round $DONE_RUNS finished, made $RES runs in it";\
-            if [ "$DONE_RUNS" == "$runs" ];\
-            then\
-                rlLog "Done, the average ($TOTAL/$DONE_RUNS) is $((TOTAL/DONE_RUNS)) runs";\
-                echo $((TOTAL/DONE_RUNS));\
-                return 0;\
-            else\
-                RES=$((0));\
-                DONE_RUNS=$((DONE_RUNS+1));\
-                eval "sleep $time; kill -USR1 $PID" &
-            fi' SIGUSR1
-
-    eval "sleep $time; kill -USR1 $$" &
-    while true ; do
-        eval "$1"
-        RES=$((RES+1))
+
+    # The timer signals the shell running the function, which can be
+    # a subshell capturing the output
+    local __INTERNAL_PID=$BASHPID
+    local __INTERNAL_TIMEOUT
+    local round count status timer
+    local total=0
+    local failed=0
+    trap '__INTERNAL_TIMEOUT=1' SIGUSR1
+    for ((round = 1; round <= runs; round++)); do
+        count=0
+        __INTERNAL_TIMEOUT=0
+        { sleep $time; kill -USR1 $__INTERNAL_PID; } &
+        timer=$!
+        while true; do
+            eval "$command"
+            status=$?
+            [ $__INTERNAL_TIMEOUT -eq 1 ] && break
+            count=$((count+1))
+            [ $status -ne 0 ] && failed=$((failed+1))
+        done
+        wait $timer
+        rlLog "Round $round finished, made $count runs in it"
+        total=$((total+count))
     done
+    trap - SIGUSR1
+    if [ $failed -ne 0 ]; then
+        rlLogError "rlPerfTime_RunsInTime: $failed of the runs of '$command' failed"
+        return 1
+    fi
+    rlLog "Done, the average ($total/$runs) is $((total/runs)) runs"
+    echo $((total/runs))
 }
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -118,24 +137,41 @@ rlPerfTime_RunsInTime(){
 
 =head3 rlPerfTime_AvgFromRuns
 
-Measures the average time of running some task. This approach is suitable
-for long-time running tasks (tens of seconds and more), where it is
-precise enough. Measured runs can be preceded by dry run, which is not
-measured and it's purpose is to warm up various caches.
+Measures the average time of running some task. Measured runs can be
+preceded by dry run, which is not measured and it's purpose is to warm up
+various caches. Runs far slower or faster than the rest (outside 1.5 times
+the interquartile range from the quartiles) are left out of the average.
+Minimum, median and 95th percentile of the runs are logged.
 It prints the number on stdout, so it has to be captured.
 Or, result is then stored in special rl_retval variable.
 
-    rlPerfTime_AvgFromRuns command [count] [warmup]
+The command is split to words and executed directly, without shell, so
+that only the command itself is measured, with microsecond resolution.
+When any of the measured runs fails, nothing is printed and 1 is returned.
+
+    rlPerfTime_AvgFromRuns [-p precision] [-m metric] command [count] [warmup]
 
 =over
 
+=item -p precision
+
+Keep running the command, up to 1000 runs, until the 95% confidence
+interval of the average is within the given fraction of it, e.g. 0.01
+(optional).
+
+=item -m metric
+
+Measured time: C<cpu> (user and system CPU time, default), C<wall>,
+C<user> or C<system>.
+
 =item command
 
 Command to run.
 
 =item count
 
-Times to run (optional, default=3).
+Times to run (optional, default=3), the minimal number of runs with
+precision.
 
 =item warmup
 
@@ -146,30 +182,123 @@ Warm-up run, run if this option is not "warmup" (optional, default="warmup")
 =cut
 
 rlPerfTime_AvgFromRuns(){
+    local options=()
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            -p|--precision) options+=(--precision "$2"); shift 2 ;;
+            -m|--metric) options+=(--metric "$2"); shift 2 ;;
+            --) shift; break ;;
+            *) break ;;
+        esac
+    done
     local command="$1"
     local runs=${2:-"3"}
     local warmup=${3:-"warmup"}
-    local total=0
     rlLog "Measuring the average time of runnning command '$command'"
     rlLog "The result will be an average of $runs runs"
 
     if [ "$warmup" == "warmup" ]; then
         rlLog "Doing non-measured warmup run"
-        eval "$command"
+        options+=(--warmup 1)
+    fi
+    local __INTERNAL_SUMMARY=$(mktemp) # no-reboot
+    $__INTERNAL_PERF_TIME --runs "$runs" --summary $__INTERNAL_SUMMARY "${options[@]}" $command
+    local ret=$?
+    local name value result failed
+    while read name value; do
+        rlLog "  $name: $value"
+        [ "$name" == "mean" ] && result=$(LC_ALL=C printf "%.5f" "$value")
+        [ "$name" == "failed" ] && failed=$value
+    done < $__INTERNAL_SUMMARY
+    rm -f $__INTERNAL_SUMMARY
+    if [ $ret -ne 0 ]; then
+        rlLogError "rlPerfTime_AvgFromRuns: ${failed:-some} of the runs of '$command' failed"
+        return 1
     fi
-    local __INTERNAL_TIMER=$(mktemp) # no-reboot
-
-    local cnt
-    for cnt in $(seq $runs); do
-        /usr/bin/time -o $__INTERNAL_TIMER -f "bt=\"%U + %S\"" $command
-        . $__INTERNAL_TIMER
-        rlLog "Run $cnt took $bt seconds"
-        total="$(echo "scale=5; $total + $bt" | bc)"
+    rlLog "The average of the runs was $result seconds"
+    echo "$result"
+    export rl_retval="$result"
+}
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# rlResourceProfile
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+: <<'=cut'
+=pod
+
+=head2 Resource Profile
+
+=head3 rlResourceProfile
+
+Runs a command and records its resource usage over time: CPU time, resident
+memory, threads, bytes read and written and context switches, summed over
+the whole process tree of the command. Summary of the run (duration, CPU
+time, peak and average RSS, peak CPU and I/O rates, ...) is logged and can
+be stored in the journal as metrics. Returns the exit status of the command.
+
+    rlResourceProfile [-o file] [-f csv|binary] [-i interval] [-m prefix] command
+
+=over
+
+=item -o file
+
+Write the time series of samples to the file, one row per sample.
+
+=item -f csv|binary
+
+Format of the time series (optional, default=csv). Binary file starts with
+a text line naming the columns, followed by rows of little endian doubles.
+
+=item -i interval
+
+Seconds between samples (optional, default=0.1).
+
+=item -m prefix
+
+Log every summary value as a metric named C<prefix.name>, e.g.
+C<build.rss_peak>, using rlLogMetricLow.
+
+=item command
+
+Command to run.
+
+=back
+
+=cut
+
+rlResourceProfile(){
+    local output=""
+    local format="csv"
+    local interval="0.1"
+    local prefix=""
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            -o|--output) output="$2"; shift 2 ;;
+            -f|--format) format="$2"; shift 2 ;;
+            -i|--interval) interval="$2"; shift 2 ;;
+            -m|--metrics) prefix="$2"; shift 2 ;;
+            --) shift; break ;;
+            *) break ;;
+        esac
     done
-    rlLog "The average of $runs runs was $(echo "scale=5; $total / $runs" | bc) seconds"
-    echo "$(echo "scale=5; $total / $runs" | bc)"
-    export rl_retval="$(echo "scale=5; $total / $runs" | bc)"
-    rm -f $__INTERNAL_TIMER
+    local command="$*"
+    local summary=$(mktemp) # no-reboot
+    local options=(-i "$interval" -f "$format" -s "$summary")
+    [ -n "$output" ] && options+=(-o "$output")
+
+    rlLog "Profiling resource usage of command '$command'"
+    $__INTERNAL_RESOURCE_PROFILER "${options[@]}" bash -c "$command"
+    local ret=$?
+
+    local name value
+    while read name value; do
+        rlLog "  $name: $value"
+        if [ -n "$prefix" ] && [ "$name" != "samples" ] && [ "$name" != "exit_status" ]; then
+            rlLogMetricLow "$prefix.$name" "$value"
+        fi
+    done < "$summary"
+    rm -f "$summary"
+    return $ret
 }
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
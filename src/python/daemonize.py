@@ -24,24 +24,65 @@ from pwd import getpwnam
 from grp import getgrnam
 
 from optparse import OptionParser
-from shlex import shlex
+from shlex import split
 
 def file_write(filename, content):
     fd = open(filename, 'w')
     fd.write(content + '\n')
     fd.close()
 
+# close_range system call in the table shared by most architectures, alpha
+# (skipped below) uses the number for another call, on ia64 and mips it is
+# out of their range and fails with ENOSYS, fds are closed other way then
+CLOSE_RANGE = 436
+
+# closes all fds at once when the kernel provides close_range, returns
+# False when it does not
+def close_range():
+    try:
+        import ctypes
+    except ImportError:
+        return False
+    if os.uname()[4] == 'alpha':
+        return False
+    try:
+        syscall = ctypes.CDLL(None).syscall
+    except (OSError, AttributeError):
+        return False
+    return syscall(CLOSE_RANGE, 0, ctypes.c_uint(0xffffffff), 0) == 0
+
+# closes fds which are open, not every possible one up to SC_OPEN_MAX,
+# which can be over a million
 def close_all_fds():
+    if close_range():
+        return
+
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = None
+    if fds is not None:
+        # includes the fd listdir used, closed already
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        return
+
     try:
         maxfd = os.sysconf('SC_OPEN_MAX')  # same as _SC_OPEN_MAX in C
     except:
         maxfd = 1024
+    os.closerange(0, maxfd)
 
-    for fd in range(0, maxfd):
-        try:
-            os.close(fd)
-        except OSError:
-            pass
+# executes command in a child, never returns
+def execute(command, alias):
+    try:
+        os.execvp(command[0],[alias]+command[1:])
+    except OSError, e:
+        print >> sys.stderr, "error: cannot execute %s: %s" % (command[0], e.strerror)
+    os._exit(127)
 
 # daemonize `command' (list) with arguments,
 # optionally change argv[0] to `alias',
@@ -50,6 +91,8 @@ def close_all_fds():
 #            change effective+real user/group to `su' (list, user and group)
 #            (when true_daemon=True) redirect stdin/out/err to filenames
 #              specified in ioredir vector (list),
+# returns once the daemon is started and its pidfile written, so that
+# more daemons can be started by the same process
 def daemonize(command, alias=None, pidfile=None, true_daemon=True, su=None, ioredir=None):
     if not alias:
         alias = command[0]
@@ -57,61 +100,72 @@ def daemonize(command, alias=None, pidfile=None, true_daemon=True, su=None, iore
     if not true_daemon:
         pid = os.fork()
         if (pid != 0):
-            # parent, write pidfile and _exit,
-            # avoiding possible double cleanups/flushes
+            # parent, write pidfile and return
             if pidfile:
                 file_write(pidfile, str(pid))
-            os._exit(0)
         else:
            # child, simply execute
-           os.execvp(command[0],[alias]+command[1:])
+           execute(command, alias)
 
     else:
         pid = os.fork()
         if (pid != 0):
-            # parent, just exit, since final pid depends on the second fork
-            os._exit(0)
+            # parent, final pid depends on the second fork, just wait
+            # for the first child to write it
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
         else:
-            os.setsid()
-            pid = os.fork()
-            if (pid != 0):
-                # parent of the second child
-                if pidfile:
-                    file_write(pidfile, str(pid))
-                os._exit(0)
-            else:
-                # second child, real daemon!
-
-                os.chdir('/')
-
-                # change real and effective uid/gid of a process
-                if su:
-                    uid = getpwnam(su[0]).pw_uid
-                    gid = getgrnam(su[1]).gr_gid
-                    os.setgroups([])
-                    os.setregid(gid, gid)
-                    os.setreuid(uid, uid)
-
-                # pre-create possible in/out files with default umask,
-                # with original stderr (in case of errors), but with new uid/gid
-                if ioredir:
-                    os.open(ioredir[0], os.O_RDWR)
-                    os.open(ioredir[1], os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0666)
-                    os.open(ioredir[2], os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0666)
-
-                os.umask(0)
-
-                close_all_fds()
-                if ioredir:
-                    for ioport in ioredir:
-                        os.open(ioport, os.O_RDWR)
-                else:
-                    os.open(os.devnull, os.O_RDWR)
-                    os.dup2(0,1)
-                    os.dup2(0,2)
-
-                # execute
-                os.execvp(command[0],[alias]+command[1:])
+            # children never return to the caller, _exit avoids possible
+            # double cleanups/flushes
+            try:
+                daemonize_child(command, alias, pidfile, su, ioredir)
+            except Exception, e:
+                print >> sys.stderr, "error: " + str(e)
+            os._exit(1)
+
+def daemonize_child(command, alias, pidfile, su, ioredir):
+    os.setsid()
+    pid = os.fork()
+    if (pid != 0):
+        # parent of the second child
+        if pidfile:
+            file_write(pidfile, str(pid))
+        os._exit(0)
+
+    # second child, real daemon!
+
+    os.chdir('/')
+
+    # change real and effective uid/gid of a process
+    if su:
+        uid = getpwnam(su[0]).pw_uid
+        gid = getgrnam(su[1]).gr_gid
+        os.setgroups([])
+        os.setregid(gid, gid)
+        os.setreuid(uid, uid)
+
+    # pre-create possible in/out files with default umask,
+    # with original stderr (in case of errors), but with new uid/gid
+    if ioredir:
+        os.open(ioredir[0], os.O_RDWR)
+        os.open(ioredir[1], os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0666)
+        os.open(ioredir[2], os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0666)
+
+    os.umask(0)
+
+    close_all_fds()
+    if ioredir:
+        for ioport in ioredir:
+            os.open(ioport, os.O_RDWR)
+    else:
+        os.open(os.devnull, os.O_RDWR)
+        os.dup2(0,1)
+        os.dup2(0,2)
+
+    # execute
+    execute(command, alias)
 
 
 # argument parsing
@@ -119,7 +173,12 @@ def error(msg):
     print >> sys.stderr, "error: " + str(msg)
     sys.exit(1)
 
-parser = OptionParser(usage='%prog [options] COMMAND')
+parser = OptionParser(usage="""%prog [options] COMMAND
+       %prog --batch FILE
+
+With --batch, every line of FILE is '[options] COMMAND' as given on
+the command line, quoted as in shell, a daemon is started for each
+of them. Empty lines and lines starting with # are skipped.""")
 parser.add_option('--alias', action='store', type='string', metavar='NAME',
                   dest='alias', help='specify custom argv[0]')
 parser.add_option('--background', action='store_true',
@@ -130,42 +189,81 @@ parser.add_option('--ioredir', action='store', type='string', metavar='IN,OUT,ER
                   dest='ioredir', help='redirect std{in,out,err} of the daemon to files')
 parser.add_option('--pidfile', action='store', type='string', metavar='FILE',
                   dest='pidfile', help='write daemon pid to a file')
+parser.add_option('--batch', action='store', type='string', metavar='FILE',
+                  dest='batch', help='start daemons specified in a file, - for stdin')
+
+# returns keyword arguments of daemonize, errors are prefixed by `where'
+def parse_daemon(opts, args, where=''):
+    # additional parsing
+    if opts.su:
+        su = opts.su.split(':')
+    else:
+        su = None
+    if opts.ioredir:
+        ioredir = opts.ioredir.split(',')
+    else:
+        ioredir = None
+
+    # sanity checks
+    if not args:
+        error(where + "no COMMAND specified")
+    if len(args) > 1:
+        error(where + "COMMAND can be only one argument, quote it")
+    if opts.su:
+        if len(su) != 2:
+            error(where + "wrong --su argument specification")
+        for i in su:
+            if not i:
+                error(where + "wrong --su argument specification")
+    if opts.ioredir:
+        if len(ioredir) != 3:
+            error(where + "wrong --ioredir argument specification")
+        for i in ioredir:
+            if not i:
+                error(where + "wrong --ioredir argument specification")
+
+    # split the COMMAND into list as shell would, honouring quotes and
+    # backslashes, so that paths with spaces can be passed quoted
+    command = split(args[0])
+
+    return dict(command=command, alias=opts.alias, pidfile=opts.pidfile,
+                true_daemon=(not opts.background), su=su, ioredir=ioredir)
+
+# returns keyword arguments of daemonize for every line of the file
+def parse_batch(filename):
+    if filename == '-':
+        fd = sys.stdin
+    else:
+        try:
+            fd = open(filename)
+        except IOError, e:
+            error("cannot read %s: %s" % (filename, e.strerror))
+    daemons = []
+    for lineno, line in enumerate(fd):
+        where = "%s:%d: " % (filename, lineno + 1)
+        try:
+            argv = split(line, comments=True)
+        except ValueError, e:
+            error(where + str(e))
+        if not argv:
+            continue
+        (opts, args) = parser.parse_args(argv)
+        if opts.batch:
+            error(where + "--batch cannot be nested")
+        daemons.append(parse_daemon(opts, args, where))
+    fd.close()
+    return daemons
 
 (opts, args) = parser.parse_args()
 
-# additional parsing
-if opts.su:
-    su = opts.su.split(':')
-else:
-    su = None
-if opts.ioredir:
-    ioredir = opts.ioredir.split(',')
+if opts.batch:
+    if args:
+        error("COMMAND cannot be used with --batch")
+    # every line is checked before any daemon is started
+    daemons = parse_batch(opts.batch)
 else:
-    ioredir = None
-
-# sanity checks
-if not args:
-    error("no COMMAND specified")
-if len(args) > 1:
-    error("COMMAND can be only one argument, quote it")
-if opts.su:
-    if len(su) != 2:
-        error("wrong --su argument specification")
-    for i in su:
-        if not i:
-            error("wrong --su argument specification")
-if opts.ioredir:
-    if len(ioredir) != 3:
-        error("wrong --ioredir argument specification")
-    for i in ioredir:
-        if not i:
-            error("wrong --ioredir argument specification")
-
-# shell-expand the COMMAND into list
-lex = shlex(args[0])
-lex.whitespace_split = True
-args = list(lex)
+    daemons = [parse_daemon(opts, args)]
 
 # input parsing finished
-daemonize(args, alias=opts.alias, pidfile=opts.pidfile,
-          true_daemon=(not opts.background), su=su, ioredir=ioredir)
+for daemon in daemons:
+    daemonize(**daemon)
@@ -0,0 +1,63 @@
+#!/usr/bin/python -S
+
+# Description: Sends request to journal server started by journalling.py --server
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Kept free of lxml and site imports, it runs on every rlJournal* call
+
+import os
+import sys
+import socket
+
+# Exit code telling the server is not available, caller falls back
+# to running journalling.py itself
+UNAVAILABLE = 69
+# Seconds to wait for the answer
+TIMEOUT = 300
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write("usage: %s SOCKET [--journal=JOURNAL] [--xslt=XSLT] [--stop]\n" % sys.argv[0])
+        return 2
+
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(TIMEOUT)
+        client.connect(sys.argv[1])
+        # Server resolves relative paths against the working directory
+        client.sendall("\0".join([os.getcwd()] + sys.argv[2:]))
+        client.shutdown(socket.SHUT_WR)
+        answer = ""
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            answer += data
+        client.close()
+    except socket.error:
+        return UNAVAILABLE
+
+    # Server exited before answering
+    if "\n" not in answer:
+        return UNAVAILABLE
+    result, errors = answer.split("\n", 1)
+    sys.stderr.write(errors)
+    return int(result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
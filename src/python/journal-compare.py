@@ -15,14 +15,39 @@
 #
 # Author: Petr Muller <pmuller@redhat.com>
 
-import xml.dom.minidom
+import os
 import sys
+import math
+import json
+import difflib
+import traceback
+import multiprocessing
+from cStringIO import StringIO
+from xml.sax.saxutils import escape, quoteattr
+from optparse import OptionParser
+try:
+	from lxml.etree import iterparse
+except ImportError:
+	from xml.etree.cElementTree import iterparse
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import metricstore
+from perfstats import mean, stddev, median, confidenceInterval
+
+# Results from the best to the worst, exit code is index of the worst one
+RESULTS = ["PASS", "WARN", "FAIL", "ERROR"]
+
+def worst(results):
+	return RESULTS[max([0] + [RESULTS.index(result) for result in results])]
 
 class Result:
 	def __init__(self):
 		self.name = ""
 		self.result = ""
 		self.messages = []
+		# Set when there is nothing to compare with in the new journal
+		self.missing = False
 
 	def addMessage(self, message):
 		self.messages.append(message)
@@ -36,22 +61,85 @@ class Result:
 	def isFail(self):
 		self.result = "FAIL"
 
+# Returns number of orderings of `first` and `second` values, all different
+def orderings(first, second):
+	count = 1
+	for i in range(1, second + 1):
+		count = count * (first + i) / i
+	return count
+
+# Returns counts where counts[u] is the number of orderings of
+# `first` and `second` values, all different, in which first values exceed
+# second ones in exactly u pairs
+uCountsCache = {}
+def uCounts(first, second):
+	if first == 0 or second == 0:
+		return [1]
+	if (first, second) not in uCountsCache:
+		# The greatest value is either one of first, exceeding all the second
+		# values, or one of second
+		counts = [0] * (first * second + 1)
+		for u, count in enumerate(uCounts(first - 1, second)):
+			counts[u + second] += count
+		for u, count in enumerate(uCounts(first, second - 1)):
+			counts[u] += count
+		uCountsCache[(first, second)] = counts
+	return uCountsCache[(first, second)]
+
+# One-sided Mann-Whitney U test, returns probability of candidate values
+# being that much greater than baseline ones just by chance. Exact
+# distribution is used for small samples without ties, normal approximation
+# with tie correction otherwise.
+def mannWhitney(baseline, candidate):
+	values = sorted([(value, 0) for value in baseline] + [(value, 1) for value in candidate])
+	ranks = {}
+	ties = 0
+	start = 0
+	while start < len(values):
+		end = start
+		while end < len(values) and values[end][0] == values[start][0]:
+			end += 1
+		ranks[values[start][0]] = (start + end + 1) / 2.0
+		ties += (end - start) ** 3 - (end - start)
+		start = end
+
+	first, second = len(candidate), len(baseline)
+	u = sum([ranks[value] for value in candidate]) - first * (first + 1) / 2.0
+	if ties == 0 and first + second <= 40:
+		counts = uCounts(first, second)
+		return sum(counts[int(u):]) / float(sum(counts))
+
+	total = first + second
+	variance = first * second / 12.0 * ((total + 1) - ties / float(total * (total - 1)))
+	if variance <= 0:
+		return 1.0
+	z = (u - first * second / 2.0 - 0.5) / math.sqrt(variance)
+	return 0.5 * math.erfc(z / math.sqrt(2))
+
+def describe(values):
+	low, high = confidenceInterval(values)
+	return "mean %g, stddev %g, median %g, 95%% CI [%g, %g], %d runs" % (mean(values), stddev(values), median(values), low, high, len(values))
+
 class Metric:
 	def __init__(self, name, value, type, tolerance):
 		self.value = value
+		self.values = [value]
 		self.type  = type
 		self.tolerance = tolerance
 		self.name = name
 
-	def compare(self, other):
+	def compare(self, other, alpha=0.05):
+		if len(self.values) > 1 or len(other.values) > 1:
+			return self.compareRuns(other, alpha)
+
 		if self.type == "low":
 			first = self.value
 			second = other.value
-			message = "First %s, second %s, toleranced first %s" % (first, second, first+first*tolerance)
+			message = "First %s, second %s, toleranced first %s" % (first, second, first+first*self.tolerance)
 		else:
 			first = other.value
 			second = self.value
-			message = "First %s, second %s, toleranced first %s" % (second, first, second+second*tolerance)
+			message = "First %s, second %s, toleranced first %s" % (second, first, second+second*self.tolerance)
 
 		result = Result()
 		result.name = self.name
@@ -59,7 +147,45 @@ class Metric:
 
 		if first >= second:
 			result.result = "PASS"
-		elif first+first*tolerance >= second:
+		elif first+first*self.tolerance >= second:
+			result.result = "WARN"
+		else:
+			result.result = "FAIL"
+		return result
+
+	# Compares series of values of several runs: regression has to be
+	# statistically significant, it fails when medians also differ by more
+	# than tolerance
+	def compareRuns(self, other, alpha):
+		result = Result()
+		result.name = self.name
+		result.addMessage("Old %s" % describe(self.values))
+		result.addMessage("New %s" % describe(other.values))
+
+		old_median, new_median = median(self.values), median(other.values)
+		if self.type == "low":
+			p = mannWhitney(self.values, other.values)
+			toleranced = old_median + abs(old_median) * self.tolerance
+			within = new_median <= toleranced
+			worse = new_median > old_median
+		else:
+			p = mannWhitney([-value for value in self.values], [-value for value in other.values])
+			toleranced = old_median - abs(old_median) * self.tolerance
+			within = new_median >= toleranced
+			worse = new_median < old_median
+		result.addMessage("Regression p-value %.4f (Mann-Whitney), toleranced old median %g" % (p, toleranced))
+
+		# Even the most extreme ordering of this few values is not significant,
+		# so medians are compared the way single values are
+		if 1.0 / orderings(len(self.values), len(other.values)) >= alpha:
+			result.addMessage("Too few runs for significance level %g, medians compared" % alpha)
+			significant = worse
+		else:
+			significant = p < alpha
+
+		if not significant:
+			result.result = "PASS"
+		elif within:
 			result.result = "WARN"
 		else:
 			result.result = "FAIL"
@@ -120,6 +246,14 @@ class Test:
 
 		return result
 
+def missingResult(name, kind):
+	result = Result()
+	result.name = name
+	result.result = "WARN"
+	result.missing = True
+	result.addMessage("Could not find corresponding %s" % kind)
+	return result
+
 class TestSet:
 	def __init__(self):
 		self.results = {}
@@ -135,64 +269,441 @@ class TestSet:
 			try:
 				result_list.append(self.results[key].compare(other.results[key]))
 			except KeyError:
-				print "[WARN] Could not find corresponding test for: %s" % key
+				result_list.append(missingResult(key, "test"))
 		return result_list
 
-try:
-  old = sys.argv[1]
-  new = sys.argv[2]
-except IndexError:
-  old = "old/rcw-journal"
-  new = "new/rcw-journal"
-
-journal_old = xml.dom.minidom.parse(old)
-journal_new = xml.dom.minidom.parse(new)
-
-old_log = journal_old.getElementsByTagName("log")[0]
-new_log = journal_new.getElementsByTagName("log")[0]
-
-old_phases = old_log.getElementsByTagName("phase")
-new_phases = new_log.getElementsByTagName("phase")
-
-walk_through = range(len(new_phases))
-
-for i in walk_through:
-	old_type, old_name = old_phases[i].getAttribute("type"), old_phases[i].getAttribute("name")
-	new_type, new_name = new_phases[i].getAttribute("type"), new_phases[i].getAttribute("name")
-
-	if old_type == new_type and old_name == new_name:
-		print "Types match, so we are comparing phase %s of type %s" % (old_type, new_type)
-		old_tests = TestSet()
-		new_tests = TestSet()
-		old_metrics = {}
-		new_metrics = {}
-
-		for phases, results, metrics in ((old_phases, old_tests, old_metrics), (new_phases, new_tests, new_metrics)):
-			for test in phases[i].getElementsByTagName("test"):
-				key = test.getAttribute("message")
-				result = test.childNodes[0].data.strip()
-				results.addTestResult(key, result)
-
-			for metric in phases[i].getElementsByTagName("metric"):
-				key = metric.getAttribute("name")
-				value = float(metric.childNodes[0].data.strip())
-				tolerance = float(metric.getAttribute("tolerance"))
-				metrics[key] = Metric(key, value, metric.getAttribute("type"), tolerance)
-
-		print "==== Actual compare ===="
-		print " * Metrics * "
-		metric_results = []
-		for key in old_metrics.keys():
-			metric_results.append(old_metrics[key].compare(new_metrics[key]))
-		for metric in metric_results:
-			for message in metric.messages:
-				print "[%s] %s (%s)" % (metric.result, metric.name, message)
-		print " * Tests * "
-		test_results = old_tests.compare(new_tests)
-		for test in test_results:
-			print "[%s] %s" % (test.result, test.name)
-			for message in test.messages:
-				print "\t - %s" % message
+class Phase:
+	def __init__(self, type, name):
+		self.type = type
+		self.name = name
+		self.tests = TestSet()
+		self.metrics = {}
+		self.complete = False
+
+# Yields (event, element) pairs of iterparse of journal, every element is
+# dropped as soon as it was handed over at its end, so that memory usage
+# does not depend on size of the journal
+def parseJournal(journal):
+	elements = []
+	for event, element in iterparse(journal, events=("start", "end")):
+		if event == "start":
+			elements.append(element)
+			yield event, element
+			continue
+
+		elements.pop()
+		yield event, element
+		# Element is the last child of its parent now, the ones before it are done
+		element.clear()
+		if elements:
+			del elements[-1][:-1]
+
+# Returns (type, name) of all phases of journal in the order they start
+def readPhaseKeys(journal):
+	keys = []
+	for event, element in parseJournal(journal):
+		if event == "start" and element.tag == "phase":
+			keys.append((element.get("type", ""), element.get("name", "")))
+	return keys
+
+# Yields phases of journal in the order they start, with results of all tests
+# and metrics in them, nested phases included. Memory usage depends only on
+# the number of distinct tests in the open phases.
+def readPhases(journal):
+	open_phases = []
+	pending = []
+	for event, element in parseJournal(journal):
+		if event == "start":
+			if element.tag == "phase":
+				phase = Phase(element.get("type", ""), element.get("name", ""))
+				open_phases.append(phase)
+				pending.append(phase)
+		elif element.tag == "test":
+			key = element.get("message", "")
+			result = (element.text or "").strip()
+			for phase in open_phases:
+				phase.tests.addTestResult(key, result)
+		elif element.tag == "metric":
+			key = element.get("name", "")
+			value = float(element.get("value", element.text))
+			tolerance = float(element.get("tolerance"))
+			for phase in open_phases:
+				phase.metrics[key] = Metric(key, value, element.get("type"), tolerance)
+		elif element.tag == "phase":
+			open_phases.pop().complete = True
+			# Outer phase is reported before the nested ones, once it is complete
+			while pending and pending[0].complete:
+				yield pending.pop(0)
+
+# Aligns two sequences of phase keys, returns list of (old index, new index)
+# pairs in order of both sequences, index of a removed or added phase being
+# paired with None. Common head and tail are matched directly, only the part
+# where the journals differ goes through diff, which also copes with phases
+# of the same type and name occurring repeatedly.
+def alignPhases(old_keys, new_keys):
+	head = 0
+	limit = min(len(old_keys), len(new_keys))
+	while head < limit and old_keys[head] == new_keys[head]:
+		head += 1
+	tail = 0
+	while tail < limit - head and old_keys[-1 - tail] == new_keys[-1 - tail]:
+		tail += 1
+
+	pairs = [(i, i) for i in range(head)]
+	old_middle = old_keys[head:len(old_keys) - tail]
+	new_middle = new_keys[head:len(new_keys) - tail]
+	matcher = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+	for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+		if tag == "equal":
+			for offset in range(old_end - old_start):
+				pairs.append((head + old_start + offset, head + new_start + offset))
+			continue
+		for i in range(old_start, old_end):
+			pairs.append((head + i, None))
+		for j in range(new_start, new_end):
+			pairs.append((None, head + j))
+	old_tail = len(old_keys) - tail
+	new_tail = len(new_keys) - tail
+	pairs.extend([(old_tail + i, new_tail + i) for i in range(tail)])
+	return pairs
+
+# Adds values of metrics of phases of journal to series, which is a list of
+# {metric name: [values]} for every phase of reference journal, reference_keys
+# being (type, name) of the phases
+def collectMetrics(series, journal, reference_keys):
+	pairs = alignPhases(reference_keys, readPhaseKeys(journal))
+	phases = readPhases(journal)
+	for reference_index, index in pairs:
+		if index is None:
+			continue
+		phase = next(phases)
+		if reference_index is None:
+			continue
+		for key, metric in phase.metrics.items():
+			series[reference_index].setdefault(key, []).append(metric.value)
+
+# Results of comparison of a phase, status being 'compared', or 'added' or
+# 'removed' for phases found in only one of the journals
+class PhaseResult:
+	def __init__(self, phase, status):
+		self.type = phase.type
+		self.name = phase.name
+		self.status = status
+		self.metrics = []
+		self.tests = []
 
+	def result(self):
+		if self.status != "compared":
+			return "WARN"
+		return worst([result.result for result in self.metrics + self.tests])
+
+def comparePhases(old_phase, new_phase, old_series={}, new_series={}, alpha=0.05):
+	phase_result = PhaseResult(new_phase, "compared")
+	for phase, series in ((old_phase, old_series), (new_phase, new_series)):
+		for key, values in series.items():
+			if key in phase.metrics:
+				phase.metrics[key].values.extend(values)
+	for key in old_phase.metrics.keys():
+		try:
+			phase_result.metrics.append(old_phase.metrics[key].compare(new_phase.metrics[key], alpha))
+		except KeyError:
+			phase_result.metrics.append(missingResult(key, "metric"))
+	phase_result.tests = old_phase.tests.compare(new_phase.tests)
+	return phase_result
+
+# Yields PhaseResult of every phase of the first old and new journals, the
+# other journals only contribute values to series of metrics
+def compareJournals(olds, news, options):
+	old_keys = readPhaseKeys(olds[0])
+	new_keys = readPhaseKeys(news[0])
+	old_series = [{} for key in old_keys]
+	new_series = [{} for key in new_keys]
+	for journal in olds[1:]:
+		collectMetrics(old_series, journal, old_keys)
+	for journal in news[1:]:
+		collectMetrics(new_series, journal, new_keys)
+	if options.store:
+		store = metricstore.MetricStore(options.store)
+		header = metricstore.readHeader(news[0])
+		filters = {"testname": header["testname"], "arch": header["arch"]}
+		for index, (phase_type, phase) in enumerate(old_keys):
+			baseline = store.baseline(phase_type, phase, options.store_runs, filters, olds + news)
+			for key, values in baseline.items():
+				old_series[index].setdefault(key, []).extend(values)
+		store.close()
+
+	# Phases are matched by type and name first, then both journals are read
+	# together, phase by phase
+	pairs = alignPhases(old_keys, new_keys)
+	old_phases = readPhases(olds[0])
+	new_phases = readPhases(news[0])
+	for old_index, new_index in pairs:
+		if new_index is None:
+			yield PhaseResult(next(old_phases), "removed")
+		elif old_index is None:
+			yield PhaseResult(next(new_phases), "added")
+		else:
+			yield comparePhases(next(old_phases), next(new_phases), old_series[old_index], new_series[new_index], options.alpha)
+
+def write(out, text):
+	if isinstance(text, unicode):
+		text = text.encode("utf-8")
+	out.write(text)
+
+def resultDict(result):
+	return {"name": result.name, "result": result.result, "messages": result.messages}
+
+# Writers of the output formats, each of them has methods called in order
+#   start() - once before all pairs
+#   pair(index, old, new) - before phases of a pair
+#   phase(phase_result) - for every phase of the pair
+#   pairEnd(result, error) - after the phases, error is None or a message
+#   end(summary) - once after all pairs, summary being {result: count of pairs}
+class TextWriter:
+	def __init__(self, out, pairs):
+		self.out = out
+		self.pairs = pairs
+
+	def start(self):
+		pass
+
+	def pair(self, index, old, new):
+		if self.pairs > 1:
+			write(self.out, "==== Comparing %s with %s ====\n" % (old, new))
+
+	def phase(self, phase):
+		if phase.status != "compared":
+			write(self.out, "Phase %s of type %s was %s, nothing to compare\n" % (phase.name, phase.type, phase.status))
+			return
+		lines = ["Types match, so we are comparing phase %s of type %s" % (phase.type, phase.type),
+			"==== Actual compare ====", " * Metrics * "]
+		for metric in phase.metrics:
+			if metric.missing:
+				lines.append("[WARN] Could not find corresponding metric for: %s" % metric.name)
+		for metric in phase.metrics:
+			if not metric.missing:
+				for message in metric.messages:
+					lines.append("[%s] %s (%s)" % (metric.result, metric.name, message))
+		lines.append(" * Tests * ")
+		for test in phase.tests:
+			if test.missing:
+				lines.append("[WARN] Could not find corresponding test for: %s" % test.name)
+		for test in phase.tests:
+			if not test.missing:
+				lines.append("[%s] %s" % (test.result, test.name))
+				for message in test.messages:
+					lines.append("\t - %s" % message)
+		write(self.out, "\n".join(lines) + "\n")
+
+	def pairEnd(self, result, error):
+		if error is not None:
+			write(self.out, "[ERROR] %s\n" % error)
+
+	def end(self, summary):
+		if self.pairs > 1:
+			write(self.out, "Compared %d pairs: %s\n" % (self.pairs,
+				", ".join(["%d %s" % (summary[result], result) for result in RESULTS])))
+
+class JSONWriter:
+	def __init__(self, out, pairs):
+		self.out = out
+
+	def start(self):
+		write(self.out, '{"pairs": [')
+
+	def pair(self, index, old, new):
+		if index:
+			write(self.out, ", ")
+		write(self.out, '{"old": %s, "new": %s, "phases": [' % (json.dumps(old), json.dumps(new)))
+		self.phases = 0
+
+	def phase(self, phase):
+		if self.phases:
+			write(self.out, ", ")
+		self.phases += 1
+		write(self.out, json.dumps({"type": phase.type, "name": phase.name, "status": phase.status,
+			"result": phase.result(),
+			"metrics": [resultDict(metric) for metric in phase.metrics],
+			"tests": [resultDict(test) for test in phase.tests]}, sort_keys=True))
+
+	def pairEnd(self, result, error):
+		write(self.out, '], "result": %s, "error": %s}' % (json.dumps(result), json.dumps(error)))
+
+	def end(self, summary):
+		summary = dict(summary)
+		summary["result"] = worst([result for result in RESULTS if summary[result]])
+		write(self.out, '], "summary": %s}\n' % json.dumps(summary, sort_keys=True))
+
+# Every phase is a test suite, its metrics and tests are test cases. JUnit
+# knows no warnings, WARN results pass and have their messages in system-out.
+class JUnitWriter:
+	def __init__(self, out, pairs):
+		self.out = out
+
+	def start(self):
+		write(self.out, '<?xml version="1.0" encoding="UTF-8"?>\n<testsuites name="journal-compare">\n')
+
+	def pair(self, index, old, new):
+		self.old = old
+		self.new = new
+
+	def testcase(self, classname, name, result, messages):
+		text = escape("\n".join(messages))
+		message = quoteattr("; ".join(messages))
+		case = '<testcase classname=%s name=%s>' % (quoteattr(classname), quoteattr(name))
+		if result == "FAIL":
+			case += '<failure message=%s>%s</failure>' % (message, text)
+		elif result == "ERROR":
+			case += '<error message=%s>%s</error>' % (message, text)
+		elif messages:
+			case += '<system-out>%s</system-out>' % text
+		return case + '</testcase>\n'
+
+	def suite(self, name, cases):
+		failures = len([case for case in cases if case[2] == "FAIL"])
+		errors = len([case for case in cases if case[2] == "ERROR"])
+		write(self.out, '<testsuite name=%s tests="%d" failures="%d" errors="%d">\n<properties>'
+			'<property name="old" value=%s/><property name="new" value=%s/></properties>\n'
+			% (quoteattr(name), len(cases), failures, errors, quoteattr(self.old), quoteattr(self.new)))
+		for case in cases:
+			write(self.out, self.testcase(*case))
+		write(self.out, '</testsuite>\n')
+
+	def phase(self, phase):
+		classname = "%s.%s" % (phase.type, phase.name)
+		if phase.status != "compared":
+			cases = [(classname, "phase", "WARN", ["Phase was %s, nothing to compare" % phase.status])]
+		else:
+			cases = [(classname, "metric %s" % metric.name, metric.result, metric.messages) for metric in phase.metrics]
+			cases += [(classname, test.name, test.result, test.messages) for test in phase.tests]
+		self.suite("%s: %s" % (self.new, phase.name), cases)
+
+	def pairEnd(self, result, error):
+		if error is not None:
+			self.suite(self.new, [(self.new, "compare", "ERROR", [error])])
+
+	def end(self, summary):
+		write(self.out, '</testsuites>\n')
+
+WRITERS = {"text": TextWriter, "json": JSONWriter, "junit": JUnitWriter}
+
+# Compares journals of task (index, olds, news, options), writing the output
+# to out with writer, returns the worst result
+def comparePair(task, writer):
+	index, olds, news, options = task
+	writer.pair(index, olds[0], news[0])
+	results = []
+	error = None
+	phases = compareJournals(olds, news, options)
+	while True:
+		# Only failures of reading the journals are errors of the pair
+		try:
+			phase = next(phases)
+		except StopIteration:
+			break
+		except Exception, e:
+			error = "Failed to compare %s with %s: %s" % (olds[0], news[0], e)
+			if options.verbose:
+				error += "\n" + traceback.format_exc().rstrip()
+			results.append("ERROR")
+			break
+		results.append(phase.result())
+		writer.phase(phase)
+	result = worst(results)
+	writer.pairEnd(result, error)
+	return result
+
+# Worker of the process pool, output of the pair is returned as a string
+def comparePairBuffered(task):
+	out = StringIO()
+	options = task[3]
+	result = comparePair(task, WRITERS[options.format](out, options.pair_count))
+	return result, out.getvalue()
+
+# Returns (old, new) pairs of journals listed in file, one pair per line
+def readPairList(path):
+	if path == "-":
+		lines = sys.stdin.readlines()
 	else:
-		print "We are not doing any compare, types dont match"
+		lines = open(path).readlines()
+	pairs = []
+	for line in lines:
+		fields = line.split()
+		if not fields:
+			continue
+		if len(fields) != 2:
+			raise ValueError("%s: expected two journals on line: %s" % (path, line.strip()))
+		pairs.append(fields)
+	return pairs
+
+def main():
+	optparser = OptionParser(usage="%prog [options] OLD NEW\n       %prog [options] --pair OLD NEW [--pair OLD NEW...]")
+	optparser.add_option("-o", "--old", action="append", default=[], metavar="JOURNAL",
+		help="another journal of the old run, metrics are compared statistically over all runs")
+	optparser.add_option("-n", "--new", action="append", default=[], metavar="JOURNAL",
+		help="another journal of the new run, metrics are compared statistically over all runs")
+	optparser.add_option("-s", "--store", metavar="DATABASE",
+		help="add metrics of the latest stored runs of the same test to the old run")
+	optparser.add_option("-r", "--store-runs", type="int", default=10, metavar="RUNS",
+		help="number of stored runs used with --store (default: %default)")
+	optparser.add_option("-a", "--alpha", type="float", default=0.05,
+		help="significance level of metric regression (default: %default)")
+	optparser.add_option("-p", "--pair", action="append", default=[], nargs=2, metavar="OLD NEW",
+		help="compare another pair of journals, can be used repeatedly")
+	optparser.add_option("--pair-list", action="append", default=[], metavar="FILE",
+		help="compare pairs of journals listed in FILE, OLD and NEW on every line, '-' for standard input")
+	optparser.add_option("-j", "--jobs", type="int", default=1, metavar="N",
+		help="compare pairs in N worker processes, 0 uses all CPUs")
+	optparser.add_option("-f", "--format", type="choice", choices=sorted(WRITERS.keys()), default="text",
+		help="output format, 'text' (default), 'json' or 'junit'")
+	optparser.add_option("-v", "--verbose", action="store_true", default=False,
+		help="add traceback to errors of comparison")
+	(options, args) = optparser.parse_args()
+
+	pairs = [list(pair) for pair in options.pair]
+	try:
+		for path in options.pair_list:
+			pairs.extend(readPairList(path))
+	except (IOError, ValueError), e:
+		optparser.error(str(e))
+	if len(args) == 2:
+		pairs.insert(0, args)
+	elif args:
+		optparser.error("exactly one old and one new journal needed, others can be given by options")
+	if pairs and (options.old or options.new) and len(pairs) > 1:
+		optparser.error("--old and --new can be used with a single pair only")
+	if pairs:
+		tasks = [(index, [old], [new], options) for index, (old, new) in enumerate(pairs)]
+		tasks[0][1].extend(options.old)
+		tasks[0][2].extend(options.new)
+	elif options.old and options.new:
+		tasks = [(0, options.old, options.new, options)]
+	elif not options.old and not options.new:
+		tasks = [(0, ["old/rcw-journal"], ["new/rcw-journal"], options)]
+	else:
+		optparser.error("exactly one old and one new journal needed, others can be given by options")
+	options.pair_count = len(tasks)
+	if options.jobs < 1:
+		options.jobs = multiprocessing.cpu_count()
+
+	writer = WRITERS[options.format](sys.stdout, len(tasks))
+	summary = dict([(result, 0) for result in RESULTS])
+	writer.start()
+	if options.jobs > 1 and len(tasks) > 1:
+		# Workers render output of their pairs, which is written in order
+		pool = multiprocessing.Pool(options.jobs)
+		try:
+			for result, output in pool.imap(comparePairBuffered, tasks):
+				summary[result] += 1
+				write(sys.stdout, output)
+		finally:
+			pool.terminate()
+			pool.join()
+	else:
+		for task in tasks:
+			summary[comparePair(task, writer)] += 1
+	writer.end(summary)
+	return RESULTS.index(worst([result for result in RESULTS if summary[result]]))
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import metricstore
+
+USAGE = """%prog [options] ingest JOURNAL|DIRECTORY...
+       %prog [options] trend|percentile|baseline METRIC
+
+Keeps metrics of journals in an SQLite database. Directories are searched
+for journal.xml files, journals stored already are ingested again only when
+they change. Queries are restricted to runs matching the filter options."""
+
+
+# Returns journal files given on command line, directories searched
+def journalFiles(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if "journal.xml" in files:
+                yield os.path.join(root, "journal.xml")
+
+
+def ingest(store, paths):
+    ingested = skipped = failed = metrics = 0
+    for path in journalFiles(paths):
+        try:
+            count = store.ingest(path)
+        except Exception, e:
+            sys.stderr.write("Failed to ingest %s: %s\n" % (path, e))
+            failed += 1
+            continue
+        if count is None:
+            skipped += 1
+        else:
+            ingested += 1
+            metrics += count
+    store.commit()
+    print "Ingested %d journals with %d metrics, %d unchanged skipped, %d failed" % (
+        ingested, metrics, skipped, failed)
+    return failed and 1 or 0
+
+
+def formatTime(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(timestamp))
+
+
+def main():
+    optparser = OptionParser(usage=USAGE)
+    optparser.add_option("-d", "--database", default="journals.sqlite",
+                         help="database file (default: %default)")
+    for field in metricstore.HEADER_FIELDS + ["phase"]:
+        optparser.add_option("--" + field, help="query only runs of given %s" % field)
+    optparser.add_option("-p", "--percentiles", default="50,90,99",
+                         help="comma separated percentiles to print (default: %default)")
+    optparser.add_option("-r", "--runs", type="int", default=10,
+                         help="number of latest runs in baseline (default: %default)")
+    (options, args) = optparser.parse_args()
+
+    if len(args) < 2:
+        optparser.error("command and its arguments needed")
+    command, args = args[0], args[1:]
+    if command != "ingest" and len(args) != 1:
+        optparser.error("%s needs exactly one metric name" % command)
+
+    store = metricstore.MetricStore(options.database)
+    filters = dict([(field, getattr(options, field)) for field in metricstore.HEADER_FIELDS + ["phase"]])
+    retval = 0
+    if command == "ingest":
+        retval = ingest(store, args)
+    elif command == "trend":
+        for starttime, path, phase, value in store.trend(args[0], filters):
+            print "%s\t%s\t%s\t%s" % (formatTime(starttime), phase, value, path)
+    elif command == "percentile":
+        values = store.values(args[0], filters)
+        print "count\t%d" % len(values)
+        for p in options.percentiles.split(","):
+            print "p%s\t%s" % (p, metricstore.percentile(values, float(p)))
+    elif command == "baseline":
+        # Values of the latest runs, oldest first, as the compare tool uses them
+        rows = store.trend(args[0], filters)
+        for starttime, path, phase, value in rows[-options.runs:]:
+            print value
+    else:
+        optparser.error("unknown command %s" % command)
+    store.close()
+    return retval
+
+
+if __name__ == "__main__":
+    sys.exit(main())
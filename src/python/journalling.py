@@ -25,9 +25,33 @@ import sys
 import os
 import time
 import re
+import glob
+import shutil
+import tempfile
+import multiprocessing
+import marshal
+import gc
+import calendar
+import copy
+import json
+import fcntl
+import socket
+import select
+import traceback
+from collections import deque
+from cStringIO import StringIO
 from optparse import OptionParser
 from lxml import etree
 import base64
+from binascii import a2b_base64
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import metafile
 
 # TODO fix xml pretty print
 
@@ -72,24 +96,58 @@ def addStartEndTime(element, starttime, endtime):
     return 0
 
 
-# Find first and last timestamp to fill in starttime and endtime elements of given element
-def getStartEndTime(element):
-    starttime = ""
-    endtime = ""
-    for child in element.iter():
-        if child.get("timestamp"):
-            if starttime == "":
-                starttime = child.get("timestamp")
-            endtime = child.get("timestamp")
+# Metafile lines as written by __INTERNAL_WriteToMetafile:
+#   <indent>[element ]--timestamp="<epoch>"[ --name="<base64>"]...[ -- "<base64>"]
+METAFILE_LINE = re.compile(r'( *)(?:([^\s#-][^\s#]*) )?--timestamp="(\d+)"'
+                           r'((?: --[a-zA-Z0-9]+="[A-Za-z0-9+/=]*")*)'
+                           r'(?: -- "([A-Za-z0-9+/=]*)")?\s*\Z')
+METAFILE_ATTRIBUTE = re.compile(r' --([a-zA-Z0-9]+)="([A-Za-z0-9+/=]*)"')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+# Most of the lines share the timestamp with their neighbours so formatted
+# values are cached, the cache is dropped once it grows over the limit
+TIMESTAMP_CACHE_SIZE = 1024
+timestampCache = {}
 
-    return starttime, endtime
+
+def formatTimestamp(timestamp):
+    try:
+        return timestampCache[timestamp]
+    except KeyError:
+        if len(timestampCache) >= TIMESTAMP_CACHE_SIZE:
+            timestampCache.clear()
+        formatted = time.strftime(TIME_FORMAT, time.localtime(int(timestamp)))
+        timestampCache[timestamp] = formatted
+        return formatted
 
 
 # Parses and decodes lines given to it
 # Returns number of spaces before element, name of the element,
 # its attributes in a dictionary, and content of the element
+# Lines in the canonical format are tokenized by a single precompiled pattern,
+# anything else (comments, empty lines, hand written metafiles) goes through
+# parseGenericLine
 def parseLine(line):
-    TIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+    match = METAFILE_LINE.match(line)
+    if match is None:
+        return parseGenericLine(line)
+    indent, element, timestamp, rest, content = match.groups()
+
+    attributes = {"timestamp": formatTimestamp(timestamp)}
+    if rest:
+        for name, value in METAFILE_ATTRIBUTE.findall(rest):
+            if name == "timestamp":
+                attributes[name] = formatTimestamp(value)
+            else:
+                attributes[name] = a2b_base64(value)
+
+    return len(indent), element or "", attributes, content and a2b_base64(content) or ""
+
+
+# Parses any line, token by token
+# Returns number of spaces before element, name of the element,
+# its attributes in a dictionary, and content of the element
+def parseGenericLine(line):
     CONTENT_FLAG = 0
     attributes = {}
     content = ""
@@ -144,158 +202,1157 @@ def parseLine(line):
     return indent, element, attributes, content
 
 
+# Names of attributes, others are ignored
+ATTRIBUTE_NAME = re.compile(r'[a-zA-Z0-9]+\Z')
+
+
+# Returns the same as parseLine for a record of binary metafile
+def parseRecord(indent, element, fields):
+    attributes = {}
+    content = ""
+    for name, value in fields:
+        if name == "":
+            content = value
+            break
+        if name == "timestamp":
+            attributes[name] = formatTimestamp(value)
+        elif ATTRIBUTE_NAME.match(name):
+            attributes[name] = value
+    return indent, element, attributes, content
+
+
+# Plain ASCII without characters forbidden in XML is used as it is
+XML_SAFE = re.compile(r'[\t\n\r\x20-\x7f]*\Z')
+
+
+def sanitise(text):
+    if XML_SAFE.match(text):
+        return text
+    return unicode(text, 'utf-8', errors='replace').translate(xmlTrans)
+
+
+# Attributes as a list of sanitised (name, value) pairs, keeping their order
+def sanitiseAttributes(attributes):
+    return [(sanitise(key), sanitise(value)) for key, value in attributes.iteritems()]
+
+
 # Returns xml element created with
 # information given as parameters
 def createElement(element, attributes, content):
-    element = unicode(element, 'utf-8', errors='replace').translate(xmlTrans)
+    return buildElement(element, sanitiseAttributes(attributes), sanitise(content))
+
+
+# Creates element out of attributes and content already sanitised by createElement
+# or by a decodeChunk worker
+def buildElement(element, attributes, content):
+    element = sanitise(element)
     try:
         new_el = etree.Element(element)
     except ValueError, e:
         sys.stderr.write('Failed to create element with name %s\nError: %s\nExiting unsuccessfully.\n' % (element, e))
         exit(1)
 
-    content = unicode(content, 'utf-8', errors='replace').translate(xmlTrans)
     new_el.text = content
 
-    for key, value in attributes.iteritems():
-        key = unicode(key, 'utf-8', errors='replace').translate(xmlTrans)
-        value = unicode(value, 'utf-8', errors='replace').translate(xmlTrans)
+    for key, value in attributes:
         new_el.set(key, value)
     return new_el
 
 
-# Main loop of the program
-# Reads metafile or stdin line by line and adds
-# information from them into XML document
+# Closes paired element, filling in its starttime and endtime
+# and updating it with attributes found on its closing line
+def closeElement(journal, element, attributes):
+    # Updating start and end time
+    starttime, endtime = journal.times(element)
+    # If the closing element has a --timestamp, this value will be used as endtime
+    if "timestamp" in attributes:
+        endtime = attributes["timestamp"]
+    # Updating attributes found on closing line
+    for key, value in attributes.iteritems():
+        element.set(key, value)
+    # add start/end time and remove timestamp attribute
+    addStartEndTime(element, starttime, endtime)
+
+
+# Returns start and end tag of element as they appear in serialised journal
+def splitTags(element):
+    closing = ("</%s>" % element.tag).encode('utf-8')
+    shell = etree.Element(element.tag)
+    for key, value in element.items():
+        shell.set(key, value)
+    shell.text = element.text
+    start = etree.tostring(shell, encoding='utf-8')
+    if start.endswith(closing):
+        start = start[:-len(closing)]
+    else:
+        # element without text is serialised as <element/>
+        start = start[:-2] + ">"
+    return start, closing
+
+
+# Common part of journals, goes through parsed lines of metafile
+# and adds information from them into the journal
+# Starttime and endtime of a paired element are its first and last timestamp
+# still present in its subtree (closed paired elements drop theirs). These are
+# tracked for elements on the stack as their children are appended, so closing
+# an element does not need to walk its subtree.
+class Journal:
+    def __init__(self):
+        self.root = etree.Element("BEAKER_TEST")
+        # Indent level of previous line, initialized to -1
+        self.old_indent = -1
+        # Initialize root element
+        self.previous_el = self.root
+        # Stack of elements
+        self.el_stack = Stack()
+        # open element -> [first, last] timestamp of its content
+        self.timestamps = {}
+
+    # Element becomes parent of the elements that follow
+    def open(self, element):
+        if element not in self.timestamps:
+            self.timestamps[element] = [None, None]
+
+    # Element is complete and is appended to its parent
+    def append(self, parent, element):
+        first, last = self.timestamps.pop(element, (None, None))
+        timestamp = element.get("timestamp")
+        parent_timestamps = self.timestamps[parent]
+        parent_timestamps[0] = parent_timestamps[0] or timestamp or first
+        parent_timestamps[1] = last or timestamp or parent_timestamps[1]
+
+    # Returns first and last timestamp in subtree of element
+    def times(self, element):
+        timestamp = element.get("timestamp")
+        first, last = self.timestamps.get(element, (None, None))
+        return timestamp or first or "", last or timestamp or ""
+
+    # Main loop of the program, may be called repeatedly as metafile grows
+    # Records of elements are turned into elements by create, which gets
+    # element name, attributes and content of the record
+    def parse(self, records, create=createElement):
+        el_stack = self.el_stack
+        old_indent = self.old_indent
+        previous_el = self.previous_el
+
+        # Main loop, going through lines of metafile, adding elements
+        for indent, element, attributes, content in records:
+            # Empty line is ignored
+            if element == "" and attributes == {}:
+                continue
+
+            if indent > old_indent:
+                # Creating new element
+                new_el = create(element, attributes, content)
+                # Putting previous element to the top of the stack
+                el_stack.push(previous_el)
+                self.open(previous_el)
+                # New element is now current element
+                previous_el = new_el
+
+            elif indent == old_indent:
+                # Closing element with updates to it with no elements inside it
+                if element == "":
+                    closeElement(self, previous_el, attributes)
+                # New element is on the same level as previous one
+                else:
+                    # Previous element has ended so it is appended to the element 1 level above
+                    self.append(el_stack.peek(), previous_el)
+                    # Creating new element
+                    new_el = create(element, attributes, content)
+                    # New element is now current element
+                    previous_el = new_el
+
+            # New element is on higher level than previous one
+            elif indent < old_indent:
+                # Difference between indent levels = how many paired elements will be closed
+                indent_diff = old_indent - indent
+                for _ in xrange(indent_diff):
+                    self.append(el_stack.peek(), previous_el)
+                    previous_el = el_stack.pop()
+
+                # Closing element with updates to it
+                if element == "" and attributes != {}:
+                    closeElement(self, previous_el, attributes)
+
+                # Ending paired element and creating new one on the same level as the paired one that just ended
+                elif element != "":
+                    closeElement(self, previous_el, {})
+                    # Appending previous element to the element 1 level above
+                    if el_stack.items:
+                        self.append(el_stack.peek(), previous_el)
+
+                    new_el = create(element, attributes, content)
+                    previous_el = new_el
+
+            # Changing indent level to new value
+            old_indent = indent
+
+        self.old_indent = old_indent
+        self.previous_el = previous_el
+
+    # Closes elements still open at the end of metafile
+    def complete(self):
+        el_stack = self.el_stack
+        previous_el = self.previous_el
+
+        # Final appending
+        for _ in el_stack.items:
+            self.append(el_stack.peek(), previous_el)
+            previous_el = el_stack.pop()
+
+        # Updating start and end time of last opened paired element(log)
+        closeElement(self, previous_el, {})
+        if el_stack.items:
+            self.append(el_stack.peek(), previous_el)
+
+
+# Journal kept as a single lxml tree, serialised after the whole metafile is read
+class JournalTree(Journal):
+    def append(self, parent, element):
+        Journal.append(self, parent, element)
+        parent.append(element)
+
+    # Updating start/end time of the whole test
+    def finish(self):
+        starttime, endtime = self.times(self.root)
+        self.root.xpath("starttime")[0].text = starttime
+        self.root.xpath("endtime")[0].text = endtime
+        return self.root
+
+
+# Journal written out while the metafile is being read
+# Only the direct children of BEAKER_TEST are kept in memory. Start tag of
+# a paired element carries attributes known only after it is closed, so the
+# content of every open paired element is spooled to a temporary file and
+# written into its parent once the element is complete. Memory is bounded by
+# nesting depth instead of the size of the metafile.
+# With spoolprefix set, spools are named files which outlive the process, so
+# the state can be saved by checkpoint() and parsing resumed by restore().
+class JournalStream(Journal):
+    def __init__(self, spooldir=None, spoolprefix=None):
+        Journal.__init__(self)
+        self.spooldir = spooldir
+        self.spoolprefix = spoolprefix
+        # named spools referenced by a checkpoint, kept when their content is used
+        self.keep = set()
+        # open element -> spool of its content
+        self.spools = {}
+        # child of BEAKER_TEST -> spool of its content
+        self.children = {}
+
+    def spool(self):
+        if self.spoolprefix is None:
+            return tempfile.TemporaryFile(dir=self.spooldir)
+        fd, path = tempfile.mkstemp(prefix=self.spoolprefix, dir=self.spooldir)
+        os.close(fd)
+        return open(path, 'w+b')
+
+    def open(self, element):
+        Journal.open(self, element)
+        if element is not self.root and element not in self.spools:
+            self.spools[element] = self.spool()
+
+    def append(self, parent, element):
+        Journal.append(self, parent, element)
+        spool = self.spools.pop(element, None)
+        if parent is self.root:
+            # Children of BEAKER_TEST are written out by finish()
+            parent.append(element)
+            if spool is not None:
+                self.children[element] = spool
+        else:
+            self.write(self.spools[parent], element, spool)
+
+    # Writes element together with its spooled content
+    def write(self, output, element, spool):
+        if spool is None:
+            output.write(etree.tostring(element, encoding='utf-8'))
+            return
+        start, closing = splitTags(element)
+        output.write(start)
+        spool.seek(0)
+        shutil.copyfileobj(spool, output)
+        spool.close()
+        if self.spoolprefix is not None and spool.name not in self.keep:
+            os.unlink(spool.name)
+        output.write(closing)
+
+    # Writes the whole journal, the same way etree.tostring(pretty_print=True)
+    # formats JournalTree (only children of BEAKER_TEST are indented)
+    def finish(self, output):
+        starttime, endtime = self.times(self.root)
+        self.root.xpath("starttime")[0].text = starttime
+        self.root.xpath("endtime")[0].text = endtime
+
+        start, closing = splitTags(self.root)
+        output.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        output.write(start + "\n")
+        for element in self.root:
+            output.write("  ")
+            self.write(output, element, self.children.get(element))
+            output.write("\n")
+        output.write(closing + "\n")
+
+    # Returns picklable name and size of spool
+    def saveSpool(self, spool):
+        spool.flush()
+        self.keep.add(spool.name)
+        return spool.name, spool.tell()
+
+    def loadSpool(self, saved):
+        name, size = saved
+        spool = open(name, 'r+b')
+        if os.fstat(spool.fileno()).st_size < size:
+            raise IOError("spool %s is shorter than expected" % name)
+        spool.truncate(size)
+        spool.seek(size)
+        return spool
+
+    # Returns picklable element which is not yet part of the tree
+    def saveElement(self, element):
+        spool = self.spools.get(element)
+        if spool is not None:
+            spool = self.saveSpool(spool)
+        return etree.tostring(element, encoding='utf-8'), spool, self.saveTimestamps(element)
+
+    # Returns copy of timestamps of element, which parsing updates in place
+    def saveTimestamps(self, element):
+        timestamps = self.timestamps.get(element)
+        if timestamps is not None:
+            timestamps = list(timestamps)
+        return timestamps
+
+    def loadElement(self, saved):
+        xml, spool, timestamps = saved
+        element = etree.fromstring(xml)
+        # every element created from metafile has a text, even an empty one
+        if element.text is None:
+            element.text = ""
+        if spool is not None:
+            self.spools[element] = self.loadSpool(spool)
+        if timestamps is not None:
+            self.timestamps[element] = timestamps
+        return element
+
+    # Returns picklable state of parsing, spools referenced by it are
+    # preserved even when the journal is completed and written out
+    def checkpoint(self):
+        children = []
+        for index, element in enumerate(self.root):
+            if element in self.children:
+                children.append((index, self.saveSpool(self.children[element])))
+        previous = None
+        if self.previous_el is not self.root:
+            previous = self.saveElement(self.previous_el)
+        return {
+            'indent': self.old_indent,
+            'root': etree.tostring(self.root, encoding='utf-8'),
+            'root_timestamps': self.saveTimestamps(self.root),
+            'children': children,
+            'stack': [self.saveElement(element) for element in self.el_stack.items[1:]],
+            'stacked_root': bool(self.el_stack.items),
+            'previous': previous,
+        }
+
+    # Continues from the state returned by checkpoint()
+    def restore(self, saved):
+        self.root = etree.fromstring(saved['root'])
+        for element in self.root:
+            if element.text is None:
+                element.text = ""
+        if saved['root_timestamps'] is not None:
+            self.timestamps[self.root] = saved['root_timestamps']
+        for index, spool in saved['children']:
+            self.children[self.root[index]] = self.loadSpool(spool)
+        self.old_indent = saved['indent']
+        if saved['stacked_root']:
+            self.el_stack.push(self.root)
+        for element in saved['stack']:
+            self.el_stack.push(self.loadElement(element))
+        if saved['previous'] is not None:
+            self.previous_el = self.loadElement(saved['previous'])
+        else:
+            self.previous_el = self.root
+
+
+# Yields parsed lines of metafile starting at offset, offset is moved
+# past every complete line, a line still being written is left for later
+class MetafileReader:
+    # Size of metafile parts compared to check it was not rewritten
+    FINGERPRINT = 4096
+
+    def __init__(self, fh, offset=0):
+        self.fh = fh
+        self.offset = offset
+
+    def __iter__(self):
+        self.fh.seek(self.offset)
+        for line in self.fh:
+            if not line.endswith("\n"):
+                break
+            self.offset += len(line)
+            yield parseLine(line)
+
+    # Beginning and end of the already parsed part of metafile
+    def fingerprint(self):
+        self.fh.seek(0)
+        head = self.fh.read(min(self.offset, self.FINGERPRINT))
+        tail_offset = max(0, self.offset - self.FINGERPRINT)
+        self.fh.seek(tail_offset)
+        tail = self.fh.read(self.offset - tail_offset)
+        return head, tail
+
+
+# Yields parsed records of binary metafile starting at offset, like MetafileReader
+class BinaryMetafileReader(MetafileReader):
+    def __iter__(self):
+        self.fh.seek(self.offset)
+        records = metafile.Reader(self.fh, self.offset)
+        for record in records:
+            self.offset = records.offset
+            yield parseRecord(*record)
+
+
+# Returns directory and name prefix of spool files belonging to checkpoint
+def checkpointSpool(checkpoint):
+    spooldir, spoolprefix = os.path.split(os.path.abspath(checkpoint))
+    return spooldir, spoolprefix + ".spool."
+
+
+# Returns journal and reader restored from checkpoint if it is still
+# valid for the metafile, fresh ones starting from the beginning otherwise
+def loadCheckpoint(checkpoint, fh, reader_class=MetafileReader):
+    spooldir, spoolprefix = checkpointSpool(checkpoint)
+    try:
+        cp = open(checkpoint, 'rb')
+        saved = pickle.load(cp)
+        cp.close()
+        reader = reader_class(fh, saved['offset'])
+        if os.fstat(fh.fileno()).st_size < reader.offset:
+            raise ValueError("metafile was truncated")
+        if reader.fingerprint() != saved['fingerprint']:
+            raise ValueError("metafile was rewritten")
+        journal = JournalStream(spooldir, spoolprefix)
+        journal.restore(saved['journal'])
+        return journal, reader
+    except (IOError, OSError, EOFError, ValueError, KeyError, TypeError,
+            pickle.UnpicklingError, etree.LxmlError):
+        # Full rebuild, spools of any previous checkpoint are useless
+        for name in glob.glob(os.path.join(spooldir, spoolprefix + "*")):
+            os.unlink(name)
+        return JournalStream(spooldir, spoolprefix), reader_class(fh)
+
+
+# Serializes runs using the same checkpoint, they modify the same spool
+# files, lock is held until the returned file is closed
+def lockCheckpoint(checkpoint):
+    lock = open(checkpoint + ".lock", 'a')
+    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+    return lock
+
+
+# Saves state of journal as returned by JournalStream.checkpoint()
+def saveCheckpoint(checkpoint, state, reader):
+    saved = {
+        'offset': reader.offset,
+        'fingerprint': reader.fingerprint(),
+        'journal': state,
+    }
+    # Replaced atomically, so an interrupted run leaves the old checkpoint
+    tmp = checkpoint + ".tmp"
+    cp = open(tmp, 'wb')
+    pickle.dump(saved, cp, pickle.HIGHEST_PROTOCOL)
+    cp.close()
+    os.rename(tmp, checkpoint)
+
+
+# Metafiles smaller than this are parsed serially even with --jobs,
+# starting the worker processes would take longer than the parsing itself
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+# Size of metafile part decoded by a worker at once
+CHUNK_SIZE = 1024 * 1024
+
+
+# Splits first size bytes of metafile into (start, end) offsets of chunks ending at line boundaries
+def chunkOffsets(fh, size, chunk_size):
+    start = 0
+    while start < size:
+        fh.seek(start + chunk_size)
+        fh.readline()
+        end = min(fh.tell(), size)
+        yield start, end
+        start = end
+
+
+# Parses and sanitises lines of metafile between start and end offsets, run in worker processes
+# Lines opening elements are returned as records for buildElement, lines closing
+# elements are returned as they are and parsed again by the parent, so their
+# attributes are applied in the same order as in serial parsing
+# Records are marshalled, which is much cheaper to load than a pickle
+def decodeChunk(chunk):
+    metafile, start, end = chunk
+    fh = open(metafile, 'rb')
+    fh.seek(start)
+    data = fh.read(end - start)
+    fh.close()
+
+    records = []
+    for line in StringIO(data):
+        indent, element, attributes, content = parseLine(line)
+        if element != "":
+            records.append((indent, element, sanitiseAttributes(attributes), sanitise(content)))
+        # Empty lines are ignored by Journal.parse anyway
+        elif attributes:
+            records.append(line)
+    return marshal.dumps(records)
+
+
+# Yields records of first size bytes of metafile in order, chunks are decoded by jobs worker processes
+def decodeParallel(metafile, size, jobs):
+    fh = open(metafile, 'rb')
+    chunks = [(metafile, start, end) for start, end in chunkOffsets(fh, size, CHUNK_SIZE)]
+    fh.close()
+
+    pool = multiprocessing.Pool(jobs)
+    pending = deque()
+    chunks = iter(chunks)
+    try:
+        while True:
+            # Only a few chunks are decoded ahead, so that memory usage stays bounded
+            for chunk in chunks:
+                pending.append(pool.apply_async(decodeChunk, (chunk,)))
+                if len(pending) > 2 * jobs:
+                    break
+            if not pending:
+                break
+            data = pending.popleft().get()
+            # Loading creates lots of objects but no reference cycles,
+            # garbage collector would only keep traversing them
+            gc.disable()
+            try:
+                records = marshal.loads(data)
+            finally:
+                gc.enable()
+            for record in records:
+                if isinstance(record, str):
+                    yield parseLine(record)
+                else:
+                    yield record
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Reads metafile or stdin line by line
+# and creates XML journal out of it
 def createJournalXML(options):
     # If --metafile option is used read from it, else read standard input
     if options.metafile:
         try:
             fh = open(options.metafile, 'r+')
         except IOError, e:
-            sys.stderr.write('Failed to open queue file with' + str(e), 'FAIL')
+            sys.stderr.write('Failed to open queue file %s: %s\n' % (options.metafile, str(e)))
             return 1
+    else:
+        fh = sys.stdin
 
-        lines = fh.readlines()
-        fh.close()
+    outputs = journalOutputs(options)
+    spooldir = None
+    if outputs[0][1]:
+        spooldir = os.path.dirname(os.path.abspath(outputs[0][1]))
+
+    if options.checkpoint:
+        # Released when the function returns, after the journal is written
+        lock = lockCheckpoint(options.checkpoint)
+        # Only lines appended since the last run are parsed
+        if options.format == "binary":
+            journal, reader = loadCheckpoint(options.checkpoint, fh, BinaryMetafileReader)
+        else:
+            journal, reader = loadCheckpoint(options.checkpoint, fh)
+        journal.parse(reader)
+        try:
+            saveCheckpoint(options.checkpoint, journal.checkpoint(), reader)
+        except (IOError, OSError), e:
+            sys.stderr.write('Failed to save checkpoint to %s: %s\n' % (options.checkpoint, str(e)))
     else:
-        lines = sys.stdin.readlines()
-
-    # Indent level of previous line, initialized to -1
-    old_indent = -1
-    # Initialize root element
-    previous_el = etree.Element("BEAKER_TEST")
-    journal = previous_el
-    # Stack of elements
-    el_stack = Stack()
-
-    # Main loop, going through lines of metafile, adding elements
-    for line in lines:
-        indent, element, attributes, content = parseLine(line)
-        # Empty line is ignored
-        if element == "" and attributes == {}:
-            continue
+        size = 0
+        if options.metafile:
+            size = os.fstat(fh.fileno()).st_size
+        if options.format == "binary":
+            records = (parseRecord(*record) for record in metafile.Reader(fh))
+            create = createElement
+        elif options.jobs > 1 and size >= PARALLEL_MIN_SIZE:
+            records = decodeParallel(options.metafile, size, options.jobs)
+            create = buildElement
+        else:
+            records = (parseLine(line) for line in fh)
+            create = createElement
+        if options.stream:
+            journal = JournalStream(spooldir)
+        else:
+            journal = JournalTree()
+        journal.parse(records, create)
+    fh.close()
+    journal.complete()
+
+    return writeJournal(journal, outputs, options.stream, spooldir)
+
+
+# Compiled XSLT templates by path, kept for the next journal written
+# by the same process
+xsltCache = {}
+
 
-        if indent > old_indent:
-            # Creating new element
-            new_el = createElement(element, attributes, content)
-            # Putting previous element to the top of the stack
-            el_stack.push(previous_el)
-            # New element is now current element
-            previous_el = new_el
-
-        elif indent == old_indent:
-            # Closing element with updates to it with no elements inside it
-            # TODO refactor
-            if element == "":
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                # If the closing element has a --timestamp, this value will be used as endtime
-                if "timestamp" in attributes:
-                    endtime = attributes["timestamp"]
-                # Updating attributes found on closing line
-                for key, value in attributes.iteritems():
-                    previous_el.set(key, value)
-                # add start/end time and remove timestamp attribute
-                addStartEndTime(previous_el, starttime, endtime)
-            # New element is on the same level as previous one
+# Returns compiled XSLT template, compiling it again only when the file changed
+def compileXSLT(xslt_path):
+    mtime = os.stat(xslt_path).st_mtime
+    cached = xsltCache.get(xslt_path)
+    if cached is None or cached[0] != mtime:
+        cached = mtime, etree.XSLT(etree.parse(xslt_path))
+        xsltCache[xslt_path] = cached
+    return cached[1]
+
+
+# Writes completed journal to every output, a pair of transformation (see
+# transformJournal()) and journal path (None for standard output)
+def writeJournal(journal, outputs, stream, spooldir):
+    transformed = [xslt_path for xslt_path, journal_path in outputs if xslt_path]
+    if stream and not transformed:
+        # Only one untransformed output, the spools are consumed by writing it
+        journal_path = outputs[0][1]
+        try:
+            if journal_path:
+                output = open(journal_path, 'wb')
             else:
-                # Previous element has ended so it is appended to the element 1 level above
-                el_stack.peek().append(previous_el)
-                # Creating new element
-                new_el = createElement(element, attributes, content)
-                # New element is now current element
-                previous_el = new_el
+                output = sys.stdout
+            journal.finish(output)
+            output.close()
+            return 0
+        except IOError, e:
+            sys.stderr.write('Failed to save journal to %s: %s' % (journal_path, str(e)))
+            return 1
 
-        # New element is on higher level than previous one
-        elif indent < old_indent:
-            # Difference between indent levels = how many paired elements will be closed
-            indent_diff = old_indent - indent
-            for _ in xrange(indent_diff):
-                el_stack.peek().append(previous_el)
-                previous_el = el_stack.pop()
-
-            # Closing element with updates to it
-            if element == "" and attributes != {}:
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                # If the closing element has a --timestamp, this value will be used as endtime
-                if "timestamp" in attributes:
-                    endtime = attributes["timestamp"]
-                # Updating attributes found on closing line
-                for key, value in attributes.iteritems():
-                    previous_el.set(key, value)
-                # add start/end time and remove timestamp attribute
-                addStartEndTime(previous_el, starttime, endtime)
-
-            # Ending paired element and creating new one on the same level as the paired one that just ended
-            elif element != "":
-                # Updating start and end time
-                starttime, endtime = getStartEndTime(previous_el)
-                addStartEndTime(previous_el, starttime, endtime)
-                # Appending previous element to the element 1 level above
-                if el_stack.items:
-                    el_stack.peek().append(previous_el)
-
-                new_el = createElement(element, attributes, content)
-                previous_el = new_el
+    result = 0
+    if stream:
+        # Transformation needs the whole document in memory anyway
+        output = tempfile.TemporaryFile(dir=spooldir)
+        journal.finish(output)
+        # Untransformed journal is written as it was streamed
+        for xslt_path, journal_path in outputs:
+            if not xslt_path:
+                output.seek(0)
+                result = copyJournal(output, journal_path) or result
+        outputs = [(xslt_path, journal_path) for xslt_path, journal_path in outputs if xslt_path]
+        output.seek(0)
+        journal = etree.parse(output).getroot()
+        output.close()
+        # Dropping indentation added by serialisation
+        journal.text = None
+        for element in journal:
+            element.tail = None
+    else:
+        journal = journal.finish()
 
-        # Changing indent level to new value
-        old_indent = indent
+    # The tree is built once for all the outputs
+    for xslt_path, journal_path in outputs:
+        result = transformJournal(journal, xslt_path, journal_path) or result
+    return result
 
-    # Final appending
-    for _ in el_stack.items:
-        el_stack.peek().append(previous_el)
-        previous_el = el_stack.pop()
-    if el_stack.items:
-        el_stack.peek().append(previous_el)
 
-    # Updating start and end time of last opened paired element(log)
-    starttime, endtime = getStartEndTime(previous_el)
-    addStartEndTime(previous_el, starttime, endtime)
+def saveText(text, journal_path):
+    try:
+        if journal_path:
+            output = open(journal_path, 'wb')
+            output.write(text.encode('utf-8'))
+            output.close()
+        else:
+            sys.stdout.write(text.encode('utf-8'))
+        return 0
+    except IOError, e:
+        sys.stderr.write('Failed to save journal to %s: %s' % (journal_path, str(e)))
+        return 1
 
-    # Updating start/end time of the whole test
-    starttime, endtime = getStartEndTime(journal)
-    journal.xpath("starttime")[0].text = starttime
-    journal.xpath("endtime")[0].text = endtime
+
+def copyJournal(source, journal_path):
+    try:
+        if journal_path:
+            output = open(journal_path, 'wb')
+            shutil.copyfileobj(source, output)
+            output.close()
+        else:
+            shutil.copyfileobj(source, sys.stdout)
+        return 0
+    except IOError, e:
+        sys.stderr.write('Failed to save journal to %s: %s' % (journal_path, str(e)))
+        return 1
+
+
+# Writes journal transformed by transform, which is None, path
+# to XSLT template or text renderer (see renderText())
+def transformJournal(journal, transform, journal_path):
+    if callable(transform):
+        return saveText(transform(journal), journal_path)
 
     # XSL transformation
     try:
-        if options.xslt:
-            xslt = etree.parse(options.xslt)
-            transform = etree.XSLT(xslt)
-            journal = transform(journal)
-    except etree.LxmlError:
-        sys.stderr.write("\nTransformation template file " + options.xslt +
+        if transform:
+            journal = compileXSLT(transform)(journal)
+    except (etree.LxmlError, IOError, OSError):
+        sys.stderr.write("\nTransformation template file " + transform +
                          " could not be parsed.\nAborting journal creation.")
         return 1
 
-    if options.journal:
+    if journal_path:
         # Save journal to a file and return its exit code
-        return saveJournal(journal, options.journal)
+        return saveJournal(journal, journal_path)
     else:
         # Write the XML on standard output
-        return sys.stdout.write(etree.tostring(journal, xml_declaration=True, encoding='utf-8', pretty_print=True))
+        sys.stdout.write(etree.tostring(journal, xml_declaration=True, encoding='utf-8', pretty_print=True))
+        return 0
+
+
+# Labels of test header lines as printed by __INTERNAL_CreateHeader
+HEADER_LABELS = {
+    'test_id': "Test run ID",
+    'package': "Package",
+    'pkgdetails': "Installed",
+    'beakerlib_rpm': "beakerlib RPM",
+    'beakerlib_redhat_rpm': "bl-redhat RPM",
+    'testversion': "Test version",
+    'starttime': "Test started",
+    'endtime': "Test finished",
+    'testname': "Test name",
+    'release': "Distro",
+    'hostname': "Hostname",
+    'arch': "Architecture",
+    'hw_cpu': "CPUs",
+    'hw_ram': "RAM size",
+    'hw_hdd': "HDD size",
+}
+COLOR_RESET = "\033[00m"
+
+
+# Color of priority used by __INTERNAL_LogText
+def priorityColor(priority):
+    priority = priority.upper()
+    if priority.startswith("DEBUG"):
+        return "\033[0;35m"
+    if priority == "PASS":
+        return "\033[0;32m"
+    if priority in ("FAIL", "FATAL"):
+        return "\033[1;31m"
+    if priority == "LOG":
+        return "\033[0;36m"
+    if priority in ("INFO", "BEGIN"):
+        return "\033[0;34m"
+    if priority.startswith("WARN") or priority.startswith("SKIP"):
+        return "\033[0;33m"
+    return ""
+
+
+# Returns seconds between two journal timestamps, None if they are not valid
+def duration(start, end):
+    try:
+        return (calendar.timegm(time.strptime(end[:19], "%Y-%m-%d %H:%M:%S")) -
+                calendar.timegm(time.strptime(start[:19], "%Y-%m-%d %H:%M:%S")))
+    except (TypeError, ValueError):
+        return None
+
+
+# Renders journal tree in the format of journal.txt, or journal_colored.txt
+# if colored, as written by the shell part of beakerlib
+class TextRenderer:
+    def __init__(self, colored=False):
+        self.colored = colored
+        self.lines = []
+
+    def head(self, title):
+        self.lines.extend(["", ":" * 80, "::   " + title, ":" * 80, ""])
+
+    def log(self, timestamp, priority, message):
+        left = (10 + len(priority)) / 2
+        label = "%*s%*s" % (left, priority, 10 - left, "")
+        if self.colored:
+            label = priorityColor(priority) + label + COLOR_RESET
+        # Short time format of __INTERNAL_LogText is the time part of journal timestamp
+        self.lines.append(":: [ %s ] :: [%s] :: %s" % ((timestamp or "")[11:19], label, message))
+
+    def render(self, journal):
+        self.head("TEST PROTOCOL")
+        starttime = None
+        versions = 0
+        for element in journal:
+            text = element.text or ""
+            if element.tag == "log":
+                self.children(element)
+            elif element.tag == "purpose":
+                self.head("Test description")
+                self.lines.append(text)
+            elif element.tag in HEADER_LABELS:
+                label = HEADER_LABELS[element.tag]
+                # Build time of the test is stored as another version
+                if element.tag == "testversion":
+                    versions += 1
+                    if versions > 1:
+                        label = "Test built"
+                self.lines.append("    %-14s: %s" % (label, text))
+                if element.tag == "starttime":
+                    starttime = text
+                elif element.tag == "endtime":
+                    seconds = duration(starttime, text)
+                    if seconds is None:
+                        seconds = ""
+                    self.lines.append("    %-14s: %s seconds" % ("Test duration", seconds))
+        return u"\n".join(self.lines) + u"\n"
+
+    def children(self, parent):
+        for element in parent:
+            if element.tag == "phase":
+                self.phase(element)
+            elif element.tag == "test":
+                self.log(element.get("timestamp"), element.text or "", element.get("message", ""))
+            elif element.tag == "message":
+                self.log(element.get("timestamp"), element.get("severity", ""), element.text or "")
+
+    def phase(self, phase):
+        name = phase.get("name", "")
+        self.head(name)
+        self.children(phase)
+        # Phase still running has no summary yet
+        result = phase.get("result")
+        if result is None:
+            return
+        endtime = phase.get("endtime")
+        tests = [test.text for test in phase.iterchildren("test")]
+        good = tests.count("PASS")
+        self.lines.append("_" * 80)
+        self.log(endtime, "LOG", "Duration: %ss" % duration(phase.get("starttime"), endtime))
+        self.log(endtime, "LOG", "Assertions: %d good, %d bad" % (good, len(tests) - good))
+        self.log(endtime, result, "RESULT: " + name)
+        self.lines.append("")
+
+
+def renderText(journal):
+    return TextRenderer().render(journal)
+
+
+def renderColored(journal):
+    return TextRenderer(colored=True).render(journal)
+
+
+# Returns (metafile, journal) pairs to convert in batch mode, every path
+# matched by patterns or listed in lists (one per line, '-' is standard
+# input) is a metafile or a directory with journal.meta in it
+def batchEntries(patterns, lists):
+    paths = []
+    for pattern in patterns:
+        # Pattern matching nothing is reported as missing metafile
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    for name in lists:
+        if name == "-":
+            fh = sys.stdin
+        else:
+            fh = open(name)
+        paths.extend([line.strip() for line in fh if line.strip()])
+        fh.close()
+
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            entries.append((os.path.join(path, "journal.meta"), os.path.join(path, "journal.xml")))
+        elif path.endswith(".meta"):
+            entries.append((path, path[:-len(".meta")] + ".xml"))
+        else:
+            entries.append((path, path + ".xml"))
+    return entries
+
+
+# Creates journal of one metafile in batch mode, returns summary of the conversion
+def convertMetafile(task):
+    options, metafile, journal = task
+    summary = {'metafile': metafile, 'journal': journal}
+    start = time.time()
+    try:
+        if os.path.getmtime(journal) >= os.path.getmtime(metafile):
+            summary['result'] = "skipped"
+            summary['time'] = 0.0
+            return summary
+    except OSError:
+        pass
+
+    options = copy.copy(options)
+    options.metafile = metafile
+    options.journal = journal
+    errors = StringIO()
+    stderr = sys.stderr
+    sys.stderr = errors
+    try:
+        try:
+            if not os.path.exists(metafile):
+                sys.stderr.write("Metafile " + metafile + " does not exist.\n")
+                result = 1
+            else:
+                result = createJournalXML(options)
+        except SystemExit, e:
+            # Element creation exits on errors
+            result = e.code
+        except Exception, e:
+            traceback.print_exc()
+            result = 1
+    finally:
+        sys.stderr = stderr
+
+    summary['time'] = round(time.time() - start, 3)
+    if result:
+        summary['result'] = "failed"
+        summary['error'] = errors.getvalue().strip()
+    else:
+        summary['result'] = "converted"
+    return summary
+
+
+# Converts every metafile given by --batch and --batch-list in options.jobs
+# processes, printing summary of every conversion and the totals as lines
+# of JSON, returns 1 if any conversion failed
+def convertBatch(options):
+    entries = batchEntries(options.batch or [], options.batch_lists or [])
+    # Every worker parses its metafile serially
+    jobs = options.jobs
+    options.jobs = 1
+    tasks = [(options, metafile, journal) for metafile, journal in entries]
+
+    start = time.time()
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        summaries = pool.imap(convertMetafile, tasks)
+    else:
+        summaries = (convertMetafile(task) for task in tasks)
+
+    totals = {'converted': 0, 'failed': 0, 'skipped': 0}
+    try:
+        for summary in summaries:
+            totals[summary['result']] += 1
+            sys.stdout.write(json.dumps(summary, sort_keys=True) + "\n")
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    totals['time'] = round(time.time() - start, 3)
+    sys.stdout.write(json.dumps(totals, sort_keys=True) + "\n")
+
+    if totals['failed']:
+        return 1
+    return 0
+
+
+# Keeps the journal parsed in memory, answering requests for writing it out
+# on a UNIX socket, so that rlJournal* functions do not pay for starting
+# the interpreter, importing lxml and loading the checkpoint every time.
+# Request is a NUL separated list of working directory of the client and
+# options (see requestParser()), answer is the exit code on the first line
+# followed by the error messages.
+class JournalServer:
+    # Seconds between looks for lines appended to metafile
+    POLL = 1
+    # Seconds without requests and appended lines after which the server exits
+    IDLE = 3600
+
+    def __init__(self, options):
+        self.checkpoint = options.checkpoint
+        self.spooldir, self.spoolprefix = checkpointSpool(options.checkpoint)
+        self.fh = open(options.metafile, 'r+')
+        if options.format == "binary":
+            self.reader_class = BinaryMetafileReader
+        else:
+            self.reader_class = MetafileReader
+        self.lock = open(options.checkpoint + ".lock", 'a')
+        self.locked(self.load)
+
+    # Identifies the checkpoint file, which is replaced on every save
+    def checkpointStat(self):
+        try:
+            st = os.stat(self.checkpoint)
+            return st.st_ino, st.st_mtime, st.st_size
+        except OSError:
+            return None
+
+    # Calls function with checkpoint locked against command line runs
+    def locked(self, function, *args):
+        fcntl.flock(self.lock.fileno(), fcntl.LOCK_EX)
+        try:
+            return function(*args)
+        finally:
+            fcntl.flock(self.lock.fileno(), fcntl.LOCK_UN)
+
+    def load(self):
+        self.journal, self.reader = loadCheckpoint(self.checkpoint, self.fh, self.reader_class)
+        self.saved = self.checkpointStat()
+
+    # Parses lines appended to metafile, returns True if there were any
+    def update(self):
+        # Checkpoint was saved by journalling run from the command line
+        if self.checkpointStat() != self.saved:
+            self.load()
+        offset = self.reader.offset
+        self.journal.parse(self.reader)
+        return self.reader.offset != offset
+
+    def write(self, outputs):
+        self.update()
+        state = self.journal.checkpoint()
+        try:
+            saveCheckpoint(self.checkpoint, state, self.reader)
+            self.saved = self.checkpointStat()
+        except (IOError, OSError), e:
+            sys.stderr.write('Failed to save checkpoint to %s: %s\n' % (self.checkpoint, str(e)))
+        self.journal.complete()
+        try:
+            return writeJournal(self.journal, outputs, True,
+                                os.path.dirname(os.path.abspath(outputs[0][1])))
+        finally:
+            # Completing the journal closed all its elements, parsing
+            # continues from the state before that
+            self.journal = JournalStream(self.spooldir, self.spoolprefix)
+            try:
+                self.journal.restore(state)
+            except (IOError, OSError, etree.LxmlError):
+                self.load()
+
+    # Answers request on connection, returns True if the server should exit
+    def handle(self, connection):
+        request = ""
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            request += data
+        args = request.split("\0")
+        cwd = args.pop(0)
+
+        stop = False
+        errors = StringIO()
+        stderr = sys.stderr
+        sys.stderr = errors
+        try:
+            try:
+                (options, args) = requestParser().parse_args(args)
+                stop = options.stop
+                result = 0
+                outputs = []
+                for transform, journal_path in journalOutputs(options):
+                    if isinstance(transform, basestring):
+                        transform = os.path.join(cwd, transform)
+                    if journal_path:
+                        journal_path = os.path.join(cwd, journal_path)
+                    outputs.append((transform, journal_path))
+                if options.journal or options.transforms or options.text or options.colored:
+                    if None in [journal_path for transform, journal_path in outputs]:
+                        sys.stderr.write("Server cannot write journal to standard output.\n")
+                        result = 1
+                    else:
+                        result = self.locked(self.write, outputs)
+                elif not stop:
+                    sys.stderr.write("Request without --journal, --transform, --text, --colored or --stop.\n")
+                    result = 1
+            except SystemExit, e:
+                # Option parser and element creation exit on errors
+                result = e.code
+                self.locked(self.load)
+            except Exception, e:
+                traceback.print_exc()
+                result = 1
+                self.locked(self.load)
+        finally:
+            sys.stderr = stderr
+        try:
+            connection.sendall("%d\n%s" % (result or 0, errors.getvalue()))
+        except socket.error:
+            pass
+        connection.close()
+        return stop
+
+    # Listens on socket at path until stopped, idle, or the socket is
+    # removed or taken over by another server
+    def serve(self, path):
+        if os.path.exists(path):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(path)
+                client.close()
+                sys.stderr.write("Journal server is already listening on %s.\n" % path)
+                return 1
+            except socket.error:
+                # Left behind by a server which is not running any more
+                os.unlink(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(8)
+        inode = os.stat(path).st_ino
+        idle = 0
+        try:
+            while True:
+                if select.select([server], [], [], self.POLL)[0]:
+                    idle = 0
+                    if self.handle(server.accept()[0]):
+                        break
+                elif self.locked(self.update):
+                    idle = 0
+                else:
+                    idle += self.POLL
+                    if idle >= self.IDLE:
+                        break
+                try:
+                    if os.stat(path).st_ino != inode:
+                        inode = None
+                        break
+                except OSError:
+                    inode = None
+                    break
+        finally:
+            server.close()
+            if inode is not None:
+                os.unlink(path)
+        return 0
+
+
+# Returns parser of options accepted in JournalServer requests
+def requestParser():
+    optparser = OptionParser(usage="--journal=JOURNAL [--xslt=XSLT] [--transform XSLT OUTPUT]... [--stop]")
+    optparser.add_option("-j", "--journal", default=None, dest="journal", metavar="JOURNAL")
+    optparser.add_option("-x", "--xslt", default=None, dest="xslt", metavar="XSLT")
+    addTransformOption(optparser)
+    optparser.add_option("--stop", default=False, dest="stop", action="store_true",
+                         help="exit the server after answering the request")
+    return optparser
+
+
+# Option shared by the command line and JournalServer requests
+def addTransformOption(optparser):
+    optparser.add_option("-t", "--transform", default=None, dest="transforms", action="append",
+                         nargs=2, metavar="XSLT OUTPUT",
+                         help="also write journal transformed by XSLT to OUTPUT, can be "
+                              "used repeatedly, the journal is built only once for all of them")
+    optparser.add_option("--text", default=None, dest="text", metavar="OUTPUT",
+                         help="also write journal as text, in the format of journal.txt")
+    optparser.add_option("--colored", default=None, dest="colored", metavar="OUTPUT",
+                         help="also write journal as colored text, like journal_colored.txt")
+
+
+# Returns (XSLT, journal) path pairs of outputs requested by options, None
+# stands for no transformation and for standard output respectively
+def journalOutputs(options):
+    outputs = list(options.transforms or [])
+    if options.text:
+        outputs.append((renderText, options.text))
+    if options.colored:
+        outputs.append((renderColored, options.colored))
+    if options.journal or options.xslt or not outputs:
+        outputs.insert(0, (options.xslt, options.journal))
+    return outputs
 
 
 def main():
@@ -306,6 +1363,29 @@ def main():
     optparser.add_option("-j", "--journal", default=None, dest="journal", metavar="JOURNAL")
     optparser.add_option("-m", "--metafile", default=None, dest="metafile", metavar="METAFILE")
     optparser.add_option("-x", "--xslt", default=None, dest="xslt", metavar="XSLT")
+    addTransformOption(optparser)
+    optparser.add_option("-s", "--stream", default=False, dest="stream", action="store_true",
+                         help="write journal out while reading metafile, keeping memory "
+                              "usage independent of metafile size")
+    optparser.add_option("-c", "--checkpoint", default=None, dest="checkpoint", metavar="CHECKPOINT",
+                         help="parse only lines appended to metafile since the last run, "
+                              "keeping state of parsing in CHECKPOINT (implies --stream)")
+    optparser.add_option("-f", "--format", default="text", dest="format", type="choice",
+                         choices=["text", "binary"], metavar="FORMAT",
+                         help="format of metafile, 'text' (default) or 'binary' as written "
+                              "with BEAKERLIB_METAFILE_FORMAT=binary")
+    optparser.add_option("--jobs", default=1, dest="jobs", type="int", metavar="N",
+                         help="decode text metafile in N worker processes, 0 uses all CPUs; "
+                              "small metafiles and --checkpoint are always parsed serially")
+    optparser.add_option("--batch", default=None, dest="batch", action="append", metavar="PATTERN",
+                         help="create journal.xml of every directory with journal.meta or "
+                              "of every metafile matching PATTERN, can be used repeatedly")
+    optparser.add_option("--batch-list", default=None, dest="batch_lists", action="append",
+                         metavar="FILE", help="like --batch for directories and metafiles listed "
+                              "in FILE, one per line, '-' for standard input")
+    optparser.add_option("--server", default=None, dest="server", metavar="SOCKET",
+                         help="keep parsing metafile into checkpoint and answer requests "
+                              "for the journal on UNIX socket SOCKET, see journal-client.py")
 
     (options, args) = optparser.parse_args()
 
@@ -314,6 +1394,30 @@ def main():
         sys.stderr.write("Metafile " + options.metafile + " does not exist.\nExiting unsuccessfully.\n")
         exit(1)
 
+    if options.checkpoint:
+        if not options.metafile:
+            sys.stderr.write("Checkpoint can be used only with --metafile.\nExiting unsuccessfully.\n")
+            exit(1)
+        options.stream = True
+
+    if options.jobs < 1:
+        options.jobs = multiprocessing.cpu_count()
+
+    if options.batch or options.batch_lists:
+        if (options.metafile or options.journal or options.checkpoint or options.server or
+                options.transforms or options.text or options.colored):
+            sys.stderr.write("Batch conversion cannot be used with --metafile, --journal, "
+                             "--checkpoint, --server, --transform, --text or --colored.\n"
+                             "Exiting unsuccessfully.\n")
+            exit(1)
+        return convertBatch(options)
+
+    if options.server:
+        if not options.checkpoint:
+            sys.stderr.write("Server can be used only with --checkpoint.\nExiting unsuccessfully.\n")
+            exit(1)
+        return JournalServer(options).serve(options.server)
+
     # Create journal
     return createJournalXML(options)
 
@@ -0,0 +1,503 @@
+# Description: Memory usage sampler of executed programs
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Resident set size of the program is sampled from /proc/<pid>/status, which
+# is opened once and read again from its start for every sample. Besides the
+# sampled values, peaks tracked by kernel are collected, which are exact:
+# VmHWM of the process while it runs and memory.peak of cgroup v2 the program
+# can be run in. ru_maxrss of the reaped process is reported only, as it
+# includes the memory of the forked sampler before the program is executed.
+# All values are in kB.
+#
+# In tree mode all descendants of the program are sampled, found through
+# /proc/<pid>/task/<tid>/children, or as members of the cgroup of the
+# program. Sampler becomes child subreaper, so descendants orphaned by their
+# parents stay in the tree. Aggregate and per-process values are reported,
+# including proportional set size from /proc/<pid>/smaps_rollup on request.
+#
+# Between samples the sampler waits for exit of the program rather than
+# sleeping, so that it returns as soon as the program ends.
+
+import os
+import time
+import errno
+import fcntl
+import select
+import signal
+import subprocess
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+# Default seconds between samples
+INTERVAL = 0.01
+STATUS_SIZE = 8192
+# pidfd_open system call in the table shared by most architectures, alpha
+# (skipped below) uses the number for another call, on ia64 and mips it is
+# out of their range and fails with ENOSYS, waiting falls back to SIGCHLD
+PIDFD_OPEN = 434
+
+
+# Returns value of field of /proc/<pid>/status data in kB, None when missing
+def statusField(data, name):
+    start = data.find("\n" + name + ":")
+    if start == -1:
+        return None
+    start += len(name) + 2
+    return int(data[start:data.index("kB", start)])
+
+
+class ProcFile:
+    def __init__(self, pid, name="status"):
+        self.fd = os.open("/proc/%d/%s" % (pid, name), os.O_RDONLY)
+
+    # Returns current content, empty once the process is gone
+    def read(self):
+        try:
+            if hasattr(os, "pread"):
+                read = lambda offset: os.pread(self.fd, STATUS_SIZE, offset)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                read = lambda offset: os.read(self.fd, STATUS_SIZE)
+            data = read(0)
+            # Long lists of children do not fit, pread does not move the
+            # offset, so it continues at the end of what was read
+            while len(data) % STATUS_SIZE == 0 and data:
+                more = read(len(data))
+                if not more:
+                    break
+                data += more
+            return data
+        except OSError:
+            return ""
+
+    def close(self):
+        os.close(self.fd)
+
+
+HAS_CHILDREN = os.path.exists("/proc/self/task/%d/children" % os.getpid())
+
+
+# Returns pids of children of process pid, through all its threads
+def readChildren(pid):
+    children = []
+    try:
+        for task in os.listdir("/proc/%d/task" % pid):
+            children.extend(open("/proc/%d/task/%s/children" % (pid, task)).read().split())
+    except (IOError, OSError):
+        pass
+    return [int(child) for child in children]
+
+
+# Returns {ppid: [pids]} of all processes, when children are not available
+def readParents():
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open("/proc/%s/stat" % entry).read()
+        except IOError:
+            continue
+        # Name of the command in parentheses can contain anything
+        ppid = int(stat[stat.rindex(")") + 2:].split(None, 2)[1])
+        parents.setdefault(ppid, []).append(int(entry))
+    return parents
+
+
+def readCgroupProcs(cgroup):
+    try:
+        return [int(pid) for pid in open(os.path.join(cgroup, "cgroup.procs")).read().split()]
+    except IOError:
+        return []
+
+
+# Makes orphaned descendants children of this process instead of init
+def becomeSubreaper():
+    if ctypes is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # PR_SET_CHILD_SUBREAPER
+        return libc.prctl(36, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+# Returns pidfd of process, which becomes readable once the process exits,
+# None when the kernel does not provide pidfds
+def openPidfd(pid):
+    if ctypes is None or os.uname()[4] == "alpha":
+        return None
+    try:
+        fd = ctypes.CDLL(None, use_errno=True).syscall(PIDFD_OPEN, pid, 0)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return fd
+
+
+# Waits for exit of child process pid up to a timeout. Pidfd of the child is
+# polled when the kernel provides it, otherwise SIGCHLD wakes the wait up
+# through a pipe written by Python signal handling, which works in the main
+# thread only. Elsewhere the wait just sleeps.
+class ChildWaiter:
+    def __init__(self, pid):
+        self.pipe = None
+        self.fd = openPidfd(pid)
+        if self.fd is not None:
+            return
+        pipe = os.pipe()
+        for fd in pipe:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        try:
+            self.wakeup = signal.set_wakeup_fd(pipe[1])
+        except ValueError:
+            os.close(pipe[0])
+            os.close(pipe[1])
+            return
+        self.pipe = pipe
+        self.fd = pipe[0]
+        # Handler has to be set for the wakeup, reads of samples must not be
+        # interrupted by it
+        self.handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+
+    # Returns True when woken up before the timeout
+    def wait(self, timeout):
+        timeout = max(timeout, 0)
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return True
+        if ready and self.pipe is not None:
+            try:
+                os.read(self.fd, 4096)
+            except OSError:
+                pass
+        return bool(ready)
+
+    def close(self):
+        if self.pipe is not None:
+            signal.set_wakeup_fd(self.wakeup)
+            signal.signal(signal.SIGCHLD, self.handler)
+            os.close(self.pipe[0])
+            os.close(self.pipe[1])
+        elif self.fd is not None:
+            os.close(self.fd)
+        self.fd = self.pipe = None
+
+
+class ProcessUsage:
+    def __init__(self, pid, name):
+        self.pid = pid
+        self.name = name
+        self.peak = 0
+        self.pss_peak = None
+        self.area = 0.0
+        self.duration = 0.0
+
+    def average(self):
+        if self.duration > 0:
+            return int(self.area / self.duration)
+        return self.peak
+
+
+# Returns value of a field of /proc/<pid>/status data which is not in kB
+def statusNumber(data, name):
+    start = data.find("\n" + name + ":")
+    if start == -1:
+        return None
+    start += len(name) + 2
+    return int(data[start:data.index("\n", start)])
+
+
+# Samples every process of tree rooted at pid, or of cgroup when given.
+# Subreaper samples all its descendants, as orphans adopted by it are not
+# descendants of pid any more. The tree is walked while it is sampled,
+# files of processes are kept open as long as the processes live, a file of
+# a process which exited reads empty even when its pid is reused. Besides
+# status, files given by names are read, when they can be opened.
+class TreeSampler:
+    def __init__(self, pid, cgroup=None, pss=False, subreaper=False, names=()):
+        self.pid = pid
+        self.cgroup = cgroup
+        self.pss = pss
+        self.subreaper = subreaper
+        self.names = list(names)
+        if pss:
+            self.names.append("smaps_rollup")
+        self.files = {}
+        self.processes = {}
+
+    def open(self, pid):
+        files = {}
+        try:
+            files["status"] = ProcFile(pid)
+            if self.cgroup is None and HAS_CHILDREN:
+                files["children"] = ProcFile(pid, "task/%d/children" % pid)
+        except OSError:
+            for file in files.values():
+                file.close()
+            return None
+        for name in self.names:
+            try:
+                files[name] = ProcFile(pid, name)
+            except OSError:
+                pass
+        self.files[pid] = files
+        return files
+
+    # Yields (pid, {file name: data}) of every process of the tree, zombies
+    # included, file names being status and names. Has to be consumed
+    # whole, files of processes not found any more are closed at its end.
+    def walk(self):
+        parents = None
+        if self.cgroup is not None:
+            queue = readCgroupProcs(self.cgroup)
+        elif self.subreaper:
+            queue = readChildren(os.getpid())
+        else:
+            queue = [self.pid]
+        alive = set()
+        index = 0
+        while index < len(queue):
+            pid = queue[index]
+            index += 1
+            if pid in alive:
+                continue
+            files = self.files.get(pid) or self.open(pid)
+            if files is None:
+                continue
+            status = files["status"].read()
+            if not status:
+                continue
+            alive.add(pid)
+            data = {"status": status}
+            for name in self.names:
+                data[name] = name in files and files[name].read() or ""
+            yield pid, data
+
+            # Members of cgroup are all listed already
+            if self.cgroup is not None:
+                continue
+            if not HAS_CHILDREN:
+                if parents is None:
+                    parents = readParents()
+                queue.extend(parents.get(pid, []))
+            elif statusNumber(status, "Threads") > 1:
+                queue.extend(readChildren(pid))
+            else:
+                queue.extend([int(child) for child in files["children"].read().split()])
+        for pid in set(self.files) - alive:
+            for file in self.files.pop(pid).values():
+                file.close()
+
+    # Returns (rss, pss) summed over the tree, pss None unless requested,
+    # interval being time since the previous sample
+    def sample(self, interval):
+        total_rss = 0
+        total_pss = None
+        if self.pss:
+            total_pss = 0
+        for pid, data in self.walk():
+            rss = statusField(data["status"], "VmRSS")
+            if rss is None:
+                continue
+            # Name changes when the process executes another program
+            start = data["status"].find("Name:") + 5
+            name = data["status"][start:data["status"].find("\n", start)].strip()
+            process = self.processes.get(pid)
+            if process is None:
+                process = ProcessUsage(pid, name)
+                self.processes[pid] = process
+            process.name = name
+            process.peak = max(process.peak, rss)
+            process.area += rss * interval
+            process.duration += interval
+            total_rss += rss
+            if self.pss:
+                pss = statusField("\n" + data["smaps_rollup"], "Pss")
+                if pss is not None:
+                    process.pss_peak = max(process.pss_peak, pss)
+                    total_pss += pss
+        return total_rss, total_pss
+
+    def close(self):
+        for files in self.files.values():
+            for file in files.values():
+                file.close()
+        self.files = {}
+
+
+def readCgroupPeak(cgroup):
+    try:
+        return int(open(os.path.join(cgroup, "memory.peak")).read()) / 1024
+    except (IOError, ValueError):
+        return None
+
+
+class MemoryUsage:
+    def __init__(self):
+        self.samples = 0
+        self.sampled_peak = 0
+        # Sum of samples weighted by the time they were valid
+        self.area = 0.0
+        self.duration = 0.0
+        self.hwm = None
+        self.maxrss = None
+        self.cgroup_peak = None
+        self.returncode = None
+        # Sums over process tree, in tree mode only
+        self.pss_peak = None
+        self.pss_area = 0.0
+        self.processes = None
+
+    def add(self, rss, interval, pss=None):
+        self.samples += 1
+        self.sampled_peak = max(self.sampled_peak, rss)
+        self.area += rss * interval
+        self.duration += interval
+        if pss is not None:
+            self.pss_peak = max(self.pss_peak, pss)
+            self.pss_area += pss * interval
+
+    # Exact peak when kernel tracked it, the sampled one otherwise
+    def peak(self):
+        return max([self.sampled_peak] + [value for value in (self.hwm, self.cgroup_peak) if value is not None])
+
+    def average(self):
+        if self.duration > 0:
+            return int(self.area / self.duration)
+        return self.sampled_peak
+
+    # Returns list of (name, value) of all collected values
+    def report(self):
+        values = [("peak", self.peak()), ("average", self.average()), ("samples", self.samples),
+                  ("sampled_peak", self.sampled_peak)]
+        for name in ("hwm", "maxrss", "cgroup_peak"):
+            if getattr(self, name) is not None:
+                values.append((name, getattr(self, name)))
+        if self.pss_peak is not None:
+            values.append(("pss_peak", self.pss_peak))
+            values.append(("pss_average", self.duration > 0 and int(self.pss_area / self.duration) or self.pss_peak))
+        if self.processes is not None:
+            values.append(("processes", len(self.processes)))
+        return values
+
+    # Returns ProcessUsage of every sampled process of the tree, by pid
+    def breakdown(self):
+        return [self.processes[pid] for pid in sorted(self.processes)]
+
+
+# Runs command and returns its MemoryUsage, sampled every interval seconds.
+# When cgroup is given, the command is moved to that cgroup v2 directory
+# before it is executed, the cgroup should be created for the command. With
+# tree, all descendants of the command are sampled, or all processes of the
+# cgroup when given, pss adds their proportional set sizes.
+def measure(command, interval=INTERVAL, cgroup=None, tree=False, pss=False):
+    preexec = None
+    if cgroup is not None:
+        procs = os.path.join(cgroup, "cgroup.procs")
+
+        def preexec():
+            open(procs, "w").write("0\n")
+    subreaper = tree and cgroup is None and becomeSubreaper()
+    task = subprocess.Popen(command, preexec_fn=preexec)
+    usage = MemoryUsage()
+    if tree:
+        sampler = TreeSampler(task.pid, cgroup, pss, subreaper)
+    else:
+        status = ProcFile(task.pid)
+    waiter = ChildWaiter(task.pid)
+    rusage = None
+    try:
+        last = time.time()
+        while rusage is None:
+            if tree:
+                now = time.time()
+                rss, pss_total = sampler.sample(now - last)
+                usage.add(rss, now - last, pss_total)
+            else:
+                data = status.read()
+                now = time.time()
+                rss = statusField(data, "VmRSS")
+                if rss is not None:
+                    usage.add(rss, now - last)
+                    usage.hwm = statusField(data, "VmHWM")
+            last = now
+            returncode, rusage = reap(task.pid, subreaper)
+            if rusage is None:
+                waiter.wait(last + interval - time.time())
+    finally:
+        waiter.close()
+        if tree:
+            sampler.close()
+            usage.processes = sampler.processes
+        else:
+            status.close()
+    usage.maxrss = rusage.ru_maxrss
+    usage.returncode = returncode
+    # Popen must not try to reap the process again
+    task.returncode = returncode
+    if cgroup is not None:
+        usage.cgroup_peak = readCgroupPeak(cgroup)
+    return usage
+
+
+# Returns (status, rusage) of process pid when it exited, (None, None) when
+# it still runs. As a subreaper, adopted orphans which exited are reaped too.
+def reap(pid, subreaper=False):
+    if not subreaper:
+        reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        if reaped:
+            return status, rusage
+        return None, None
+    result = (None, None)
+    while True:
+        try:
+            reaped, status, rusage = os.wait4(-1, os.WNOHANG)
+        except OSError, e:
+            if e.errno == errno.ECHILD:
+                return result
+            raise
+        if not reaped:
+            return result
+        if reaped == pid:
+            result = (status, rusage)
+
+
+def addOptions(optparser):
+    optparser.disable_interspersed_args()
+    optparser.add_option("-i", "--interval", default=INTERVAL, type="float", metavar="SECONDS",
+                         help="time between samples (default: %default)")
+    optparser.add_option("-c", "--cgroup", default=None, metavar="DIR",
+                         help="run command in cgroup v2 DIR and report its memory.peak")
+    optparser.add_option("-t", "--tree", default=False, action="store_true",
+                         help="sum memory of all descendants of command, or of all processes "
+                              "of the cgroup given by --cgroup")
+    optparser.add_option("-p", "--pss", default=False, action="store_true",
+                         help="with --tree, sample proportional set size too")
+    optparser.add_option("-a", "--all", default=False, action="store_true",
+                         help="print all collected values as 'name value' lines, with --tree "
+                              "followed by 'process pid name peak average' lines")
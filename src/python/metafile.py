@@ -0,0 +1,120 @@
+# Description: Reader and writer of binary Beakerlib metafile
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Binary metafile carries the same information as the text one, but values
+# are stored as they are instead of being base64 encoded, so that the shell
+# can append records without running any external command.
+#
+# Every record is
+#     <length>:<payload>\n
+# where <length> is decimal number of bytes of <payload>. Payload is
+# a sequence of fields, each of them being <length>:<bytes> again:
+#     indent, element name, and pairs of attribute name and value
+# Element name is empty on lines closing paired elements, time of the record
+# is attribute 'timestamp' holding seconds since the epoch and content of
+# the element is stored as attribute with empty name, always the last one.
+# Payload starting with '#' is a comment.
+#
+# E.g. text metafile line
+#      test --timestamp="1500000000" --message="VGVzdA==" -- "UEFTUw=="
+# with indent of one space is record
+#     56:1:14:test9:timestamp10:15000000007:message4:Test0:4:PASS\n
+
+
+def field(data):
+    return "%d:%s" % (len(data), data)
+
+
+# Returns serialized record, attributes is list of (name, value) pairs
+def formatRecord(indent, element, attributes, content=None):
+    fields = [str(indent), element]
+    for name, value in attributes:
+        fields.append(name)
+        fields.append(value)
+    if content is not None:
+        fields.append("")
+        fields.append(content)
+    return field("".join([field(data) for data in fields])) + "\n"
+
+
+def formatComment(text):
+    return field("#" + text) + "\n"
+
+
+# Splits payload of record into list of its fields
+def splitFields(payload):
+    fields = []
+    start = 0
+    while start < len(payload):
+        colon = payload.index(":", start)
+        end = colon + 1 + int(payload[start:colon])
+        if end > len(payload):
+            raise ValueError("field overflows its record")
+        fields.append(payload[colon + 1:end])
+        start = end
+    return fields
+
+
+class Writer:
+    def __init__(self, fh):
+        self.fh = fh
+
+    def write(self, indent, element, attributes, content=None):
+        self.fh.write(formatRecord(indent, element, attributes, content))
+
+    def comment(self, text):
+        self.fh.write(formatComment(text))
+
+
+# Yields (indent, element, attributes) of records read from fh, which is
+# positioned at offset, attributes being list of (name, value) pairs.
+# Offset is moved past every complete record, a record still being
+# written is left for later. Comments are skipped.
+class Reader:
+    BLOCK = 64 * 1024
+
+    def __init__(self, fh, offset=0):
+        self.fh = fh
+        self.offset = offset
+
+    def __iter__(self):
+        buf = ""
+        start = 0
+        while True:
+            colon = buf.find(":", start)
+            end = -1
+            if colon != -1:
+                end = colon + 1 + int(buf[start:colon])
+            # Record, including the newline after it, is not read whole yet
+            if end == -1 or end >= len(buf):
+                data = self.fh.read(max(self.BLOCK, end + 1 - len(buf)))
+                if not data:
+                    break
+                buf = buf[start:] + data
+                start = 0
+                continue
+            if buf[end] != "\n":
+                raise ValueError("corrupted record at offset %d" % self.offset)
+
+            payload = buf[colon + 1:end]
+            self.offset += end + 1 - start
+            start = end + 1
+            if payload.startswith("#"):
+                continue
+            fields = splitFields(payload)
+            if len(fields) < 2 or len(fields) % 2:
+                raise ValueError("incomplete record at offset %d" % self.offset)
+            yield int(fields[0]), fields[1], zip(fields[2::2], fields[3::2])
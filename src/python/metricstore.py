@@ -0,0 +1,224 @@
+# Description: SQLite store of metrics of Beakerlib journals
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Metrics of journals are ingested once, together with the header fields
+# identifying the run, so that history of a metric can be queried without
+# parsing the journals again. Journal is identified by its path, it is
+# ingested again only when its size or modification time changes.
+
+import os
+import time
+import calendar
+import sqlite3
+try:
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.cElementTree import iterparse
+from perfstats import percentile
+
+# Header fields of journal kept in the store, all of them can filter queries
+HEADER_FIELDS = ["package", "testname", "hostname", "arch"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journals (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL,
+    size INTEGER,
+    starttime INTEGER,
+    package TEXT,
+    testname TEXT,
+    hostname TEXT,
+    arch TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    journal INTEGER NOT NULL,
+    phase_type TEXT,
+    phase TEXT,
+    name TEXT NOT NULL,
+    type TEXT,
+    value REAL,
+    tolerance REAL
+);
+CREATE INDEX IF NOT EXISTS journals_starttime ON journals (starttime);
+CREATE INDEX IF NOT EXISTS journals_package ON journals (package);
+CREATE INDEX IF NOT EXISTS journals_testname ON journals (testname);
+CREATE INDEX IF NOT EXISTS journals_hostname ON journals (hostname);
+CREATE INDEX IF NOT EXISTS journals_arch ON journals (arch);
+CREATE INDEX IF NOT EXISTS metrics_journal ON metrics (journal);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, value);
+CREATE INDEX IF NOT EXISTS metrics_phase ON metrics (phase, name);
+"""
+
+
+def parseTime(text):
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%d %H:%M:%S %Z"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Returns header of journal, a dictionary of HEADER_FIELDS and 'starttime',
+# reading the journal only up to its log
+def readHeader(path):
+    header = dict([(field, None) for field in HEADER_FIELDS + ["starttime"]])
+    depth = 0
+    for event, element in iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if element.tag == "log":
+                break
+        else:
+            depth -= 1
+            if depth == 1 and element.tag in header and header[element.tag] is None:
+                header[element.tag] = (element.text or "").strip()
+    header["starttime"] = parseTime(header["starttime"])
+    return header
+
+
+# Returns (header, metrics) of journal, header being dictionary of
+# HEADER_FIELDS and 'starttime', metrics list of (phase type, phase name,
+# metric name, type, value, tolerance) of the innermost phase of every
+# metric. Journal is parsed as a stream, elements are dropped once read.
+def readJournal(path):
+    header = dict([(field, None) for field in HEADER_FIELDS + ["starttime"]])
+    metrics = []
+    elements = []
+    phases = []
+    for event, element in iterparse(path, events=("start", "end")):
+        if event == "start":
+            elements.append(element)
+            if element.tag == "phase":
+                phases.append((element.get("type", ""), element.get("name", "")))
+            continue
+
+        elements.pop()
+        if len(elements) == 1 and element.tag in header and header[element.tag] is None:
+            header[element.tag] = (element.text or "").strip()
+        elif element.tag == "metric" and phases:
+            value = element.get("value", element.text)
+            tolerance = element.get("tolerance")
+            metrics.append(phases[-1] + (element.get("name", ""), element.get("type"),
+                                         float(value), tolerance and float(tolerance)))
+        elif element.tag == "phase":
+            phases.pop()
+
+        element.clear()
+        if elements:
+            del elements[-1][:-1]
+
+    header["starttime"] = parseTime(header["starttime"])
+    return header, metrics
+
+
+class MetricStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    # Stores metrics of journal, returns their number or None when the
+    # journal is stored already and did not change since
+    def ingest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute("SELECT id, mtime, size FROM journals WHERE path = ?",
+                              (path,)).fetchone()
+        if row and row[1] == stat.st_mtime and row[2] == stat.st_size:
+            return None
+
+        header, metrics = readJournal(path)
+        if row:
+            self.db.execute("DELETE FROM metrics WHERE journal = ?", (row[0],))
+            self.db.execute("DELETE FROM journals WHERE id = ?", (row[0],))
+        starttime = header["starttime"]
+        if starttime is None:
+            starttime = int(stat.st_mtime)
+        cursor = self.db.execute(
+            "INSERT INTO journals (path, mtime, size, starttime, %s) VALUES (?, ?, ?, ?, %s)"
+            % (", ".join(HEADER_FIELDS), ", ".join(["?"] * len(HEADER_FIELDS))),
+            [path, stat.st_mtime, stat.st_size, starttime] + [header[field] for field in HEADER_FIELDS])
+        self.db.executemany(
+            "INSERT INTO metrics (journal, phase_type, phase, name, type, value, tolerance)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(cursor.lastrowid,) + metric for metric in metrics])
+        return len(metrics)
+
+    # Returns SQL condition and its parameters selecting metrics by filters,
+    # a dictionary of HEADER_FIELDS and 'phase' to their values
+    def condition(self, filters):
+        conditions = []
+        parameters = []
+        for field, value in sorted(filters.items()):
+            if value is None:
+                continue
+            if field == "phase":
+                conditions.append("metrics.phase = ?")
+            elif field in HEADER_FIELDS:
+                conditions.append("journals.%s = ?" % field)
+            else:
+                raise ValueError("unknown filter %s" % field)
+            parameters.append(value)
+        return "".join([" AND " + condition for condition in conditions]), parameters
+
+    # Returns (starttime, path, phase, value) of metric in all stored runs
+    # matching filters, oldest first
+    def trend(self, name, filters={}):
+        condition, parameters = self.condition(filters)
+        return self.db.execute(
+            "SELECT journals.starttime, journals.path, metrics.phase, metrics.value"
+            " FROM metrics JOIN journals ON metrics.journal = journals.id"
+            " WHERE metrics.name = ?" + condition +
+            " ORDER BY journals.starttime, journals.id", [name] + parameters).fetchall()
+
+    # Returns sorted values of metric in all stored runs matching filters
+    def values(self, name, filters={}):
+        condition, parameters = self.condition(filters)
+        return [row[0] for row in self.db.execute(
+            "SELECT metrics.value FROM metrics JOIN journals ON metrics.journal = journals.id"
+            " WHERE metrics.name = ?" + condition +
+            " ORDER BY metrics.value", [name] + parameters)]
+
+    # Returns {metric name: [values]} of phase in the last `runs` stored runs
+    # matching filters which contain the phase, oldest first. Journals in
+    # `exclude` are left out, so that a stored journal is not compared with
+    # itself.
+    def baseline(self, phase_type, phase, runs, filters={}, exclude=[]):
+        condition, parameters = self.condition(filters)
+        exclude = [os.path.abspath(path) for path in exclude]
+        journals = [row[0] for row in self.db.execute(
+            "SELECT DISTINCT journals.id, journals.starttime"
+            " FROM metrics JOIN journals ON metrics.journal = journals.id"
+            " WHERE metrics.phase_type = ? AND metrics.phase = ?" + condition +
+            " AND journals.path NOT IN (%s)" % ", ".join(["?"] * len(exclude)) +
+            " ORDER BY journals.starttime DESC, journals.id DESC LIMIT ?",
+            [phase_type, phase] + parameters + exclude + [runs])]
+        journals.reverse()
+
+        series = {}
+        for journal in journals:
+            for name, value in self.db.execute(
+                    "SELECT name, value FROM metrics"
+                    " WHERE journal = ? AND phase_type = ? AND phase = ?",
+                    (journal, phase_type, phase)):
+                series.setdefault(name, []).append(value)
+        return series
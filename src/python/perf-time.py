@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+# Description: Measures time of repeated runs of a command
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Every run is forked, executed directly and reaped by wait4, which gives CPU
+# time of the run with microsecond resolution, wall clock time is read from
+# the monotonic clock around it. Nothing else runs between the runs, so the
+# measuring adds only the fork and exec to every run.
+
+import os
+import sys
+import time
+import errno
+from optparse import OptionParser
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import perfstats
+
+USAGE = """%prog [options] command [args...]
+
+Runs command repeatedly and writes statistics of the runs as 'name value'
+lines. By default the command runs --runs times and CPU time (user + system)
+of the runs is described. With --precision, runs continue until the 95%
+confidence interval of the mean is within the given fraction of the mean.
+With --duration, runs completed within the duration are counted instead,
+in every of --runs rounds. Exits with 1 when any of the measured runs
+failed."""
+
+CLOCK_MONOTONIC = 1
+METRICS = ["cpu", "wall", "user", "system"]
+
+
+# Returns function reading the monotonic clock, time.time when
+# clock_gettime cannot be called
+def monotonicClock():
+    if ctypes is None:
+        return time.time
+
+    class Timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    try:
+        library = ctypes.util.find_library("rt") or ctypes.util.find_library("c")
+        clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    timespec = Timespec()
+
+    def monotonic():
+        clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = monotonicClock()
+
+
+class Run:
+    def __init__(self, wall, rusage, status):
+        self.wall = wall
+        self.user = rusage.ru_utime
+        self.system = rusage.ru_stime
+        self.cpu = self.user + self.system
+        self.status = status
+
+
+# Runs command once, returns its Run
+def runOnce(command):
+    start = monotonic()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.execvp(command[0], command)
+        except OSError, e:
+            os.write(2, "Failed to run %s: %s\n" % (command[0], e.strerror))
+        os._exit(127)
+    while True:
+        try:
+            pid, status, rusage = os.wait4(pid, 0)
+            break
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+    return Run(monotonic() - start, rusage, status)
+
+
+# Returns list of Runs of command, `runs` of them, or more up to max_runs
+# until mean of metric is known with given relative precision
+def measure(command, metric, runs, precision=None, max_runs=1000, outliers=1.5):
+    measured = []
+    while True:
+        measured.append(runOnce(command))
+        if len(measured) < runs:
+            continue
+        if precision is None or len(measured) >= max_runs:
+            return measured
+        values, rejected = perfstats.rejectOutliers([getattr(run, metric) for run in measured], outliers)
+        low, high = perfstats.confidenceInterval(values)
+        average = perfstats.mean(values)
+        if len(values) > 1 and average > 0 and (high - low) / 2 <= precision * average:
+            return measured
+
+
+# Returns list of numbers of runs of command completed within duration
+# seconds, one for each round, and number of the counted runs which
+# failed. Run in progress at the end of a round is waited for and not
+# counted.
+def countRuns(command, duration, rounds):
+    counts = []
+    failed = 0
+    for round in range(rounds):
+        count = 0
+        end = monotonic() + duration
+        while True:
+            run = runOnce(command)
+            if monotonic() > end:
+                break
+            count += 1
+            if run.status:
+                failed += 1
+        counts.append(count)
+    return counts, failed
+
+
+# Returns list of (name, value) describing values of metric of runs
+def describe(runs, metric, outliers):
+    values, rejected = perfstats.rejectOutliers([getattr(run, metric) for run in runs], outliers)
+    ordered = sorted(values)
+    low, high = perfstats.confidenceInterval(values)
+    return [("runs", len(runs)),
+            ("failed", len([run for run in runs if run.status])),
+            ("outliers", len(rejected)),
+            ("min", ordered[0]),
+            ("median", perfstats.median(values)),
+            ("mean", perfstats.mean(values)),
+            ("p95", perfstats.percentile(ordered, 95)),
+            ("max", ordered[-1]),
+            ("stddev", perfstats.stddev(values)),
+            ("ci_low", low),
+            ("ci_high", high)]
+
+
+def main():
+    optparser = OptionParser(usage=USAGE)
+    optparser.disable_interspersed_args()
+    optparser.add_option("-r", "--runs", default=3, type="int",
+                         help="number of measured runs, minimal one with --precision, or number of"
+                         " rounds with --duration (default: %default)")
+    optparser.add_option("-w", "--warmup", default=0, type="int",
+                         help="number of runs done before measuring (default: %default)")
+    optparser.add_option("-m", "--metric", default="cpu", type="choice", choices=METRICS,
+                         help="measured time, one of %s (default: %%default)" % ", ".join(METRICS))
+    optparser.add_option("-p", "--precision", default=None, type="float", metavar="FRACTION",
+                         help="run until 95% confidence interval of mean is within FRACTION of it")
+    optparser.add_option("-M", "--max-runs", default=1000, type="int",
+                         help="maximal number of runs with --precision (default: %default)")
+    optparser.add_option("-o", "--outliers", default=1.5, type="float", metavar="K",
+                         help="leave out runs further than K interquartile ranges from the"
+                         " quartiles, 0 keeps all (default: %default)")
+    optparser.add_option("-d", "--duration", default=None, type="float", metavar="SECONDS",
+                         help="count runs completed in SECONDS instead of timing them")
+    optparser.add_option("-s", "--summary", default="-", metavar="FILE",
+                         help="write statistics to FILE (default: stdout)")
+    (options, args) = optparser.parse_args()
+    if not args:
+        optparser.error("command needed")
+    if options.runs < 1:
+        optparser.error("at least one run needed")
+
+    for i in range(options.warmup):
+        runOnce(args)
+
+    if options.duration is not None:
+        counts, failed = countRuns(args, options.duration, options.runs)
+        report = [("rounds", len(counts)),
+                  ("failed", failed),
+                  ("min", min(counts)),
+                  ("mean", perfstats.mean(counts)),
+                  ("max", max(counts)),
+                  ("rate", sum(counts) / (options.duration * len(counts)))]
+    else:
+        runs = measure(args, options.metric, options.runs, options.precision,
+                       max(options.max_runs, options.runs), options.outliers)
+        report = describe(runs, options.metric, options.outliers)
+
+    out = sys.stdout
+    if options.summary != "-":
+        out = open(options.summary, "w")
+    for name, value in report:
+        if isinstance(value, float):
+            out.write("%s %.6f\n" % (name, value))
+        else:
+            out.write("%s %d\n" % (name, value))
+    out.close()
+    # Times or counts of failing runs say nothing about the command
+    if dict(report)["failed"]:
+        sys.stderr.write("%d of the measured runs failed\n" % dict(report)["failed"])
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
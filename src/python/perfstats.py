@@ -0,0 +1,80 @@
+# Description: Descriptive statistics of performance measurements
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import math
+
+# Two-sided 95% quantiles of Student's t distribution for 1 to 30 degrees of
+# freedom, normal distribution quantile is used for more
+T_QUANTILES = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+               2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+               2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def mean(values):
+    return sum(values) / float(len(values))
+
+
+def stddev(values):
+    if len(values) < 2:
+        return 0.0
+    average = mean(values)
+    return math.sqrt(sum([(value - average) ** 2 for value in values]) / (len(values) - 1))
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) / 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+# Returns p-th percentile of sorted values, interpolating between the closest
+# ranks
+def percentile(values, p):
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+# Returns 95% confidence interval of mean of values
+def confidenceInterval(values):
+    average = mean(values)
+    if len(values) < 2:
+        return average, average
+    quantile = 1.96
+    if len(values) - 1 <= len(T_QUANTILES):
+        quantile = T_QUANTILES[len(values) - 2]
+    delta = quantile * stddev(values) / math.sqrt(len(values))
+    return average - delta, average + delta
+
+
+# Returns (kept, outliers) of values, outliers lying further than k times
+# the interquartile range below the first or above the third quartile
+def rejectOutliers(values, k=1.5):
+    ordered = sorted(values)
+    if k <= 0 or len(ordered) < 4:
+        return list(values), []
+    first = percentile(ordered, 25)
+    third = percentile(ordered, 75)
+    low = first - k * (third - first)
+    high = third + k * (third - first)
+    kept = [value for value in values if low <= value <= high]
+    outliers = [value for value in values if value < low or value > high]
+    return kept, outliers
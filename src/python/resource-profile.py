@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+# Description: Records time series of resource usage of an executed program
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Every sample reads /proc/<pid>/stat, status and io of every process of the
+# tree of the program and sums them, files kept open while the processes
+# live. CPU time and I/O of a process include its reaped children, so the
+# sums do not jump when a process exits; context switches of exited
+# processes are lost from the series. Samples are kept in an array of
+# doubles, written to the time series file whenever the buffer fills up.
+# Summary is computed as samples come, totals are taken from rusage of the
+# reaped program, which is exact. Peak of the resident set is the sampled
+# one, or VmHWM of the program when higher; ru_maxrss is not used, as it
+# includes the memory of the forked profiler before the program is executed.
+
+import os
+import sys
+import time
+import array
+import struct
+import subprocess
+from optparse import OptionParser
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import memsampler
+
+COLUMNS = ["time", "cpu_user", "cpu_system", "rss", "threads", "read_bytes", "write_bytes",
+           "voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"]
+# Rows buffered before they are written out
+BUFFER_ROWS = 4096
+TICKS = float(os.sysconf("SC_CLK_TCK"))
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") / 1024
+BINARY_MAGIC = "beakerlib-resource-profile 1"
+
+
+# Returns row of COLUMNS from stat, status and io data, None when the process
+# is gone. Time is left for the caller.
+def parseSample(stat, status, io):
+    if not stat:
+        return None
+    # Name of the command in parentheses can contain anything
+    fields = stat[stat.rindex(")") + 2:].split()
+    io = "\n" + io
+    row = [0.0,
+           (int(fields[11]) + int(fields[13])) / TICKS,
+           (int(fields[12]) + int(fields[14])) / TICKS,
+           int(fields[21]) * PAGE_KB,
+           int(fields[17])]
+    for name in ("read_bytes", "write_bytes"):
+        row.append(memsampler.statusNumber(io, name) or 0)
+    for name in ("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"):
+        row.append(memsampler.statusNumber(status, name) or 0)
+    return row
+
+
+class CSVWriter:
+    def __init__(self, fh):
+        self.fh = fh
+        fh.write(",".join(COLUMNS) + "\n")
+
+    def write(self, buf):
+        width = len(COLUMNS)
+        for start in range(0, len(buf), width):
+            self.fh.write("%.6f,%.3f,%.3f,%d,%d,%d,%d,%d,%d\n" % tuple(buf[start:start + width]))
+
+
+# Header line with the magic and comma separated column names is followed
+# by rows of little endian doubles
+class BinaryWriter:
+    def __init__(self, fh):
+        self.fh = fh
+        fh.write("%s %s\n" % (BINARY_MAGIC, ",".join(COLUMNS)))
+
+    def write(self, buf):
+        if sys.byteorder != "little":
+            buf = array.array("d", buf)
+            buf.byteswap()
+        buf.tofile(self.fh)
+
+
+# Summary of the samples, updated with every row
+class Summary:
+    def __init__(self):
+        self.samples = 0
+        self.previous = None
+        self.rss_peak = 0
+        # VmHWM of the program last read
+        self.hwm = 0
+        self.rss_area = 0.0
+        self.cpu_peak = 0.0
+        self.read_peak = 0.0
+        self.write_peak = 0.0
+        self.last = None
+
+    def add(self, row, hwm=None):
+        self.samples += 1
+        self.rss_peak = max(self.rss_peak, row[3])
+        if hwm is not None:
+            self.hwm = hwm
+        if self.previous is not None:
+            interval = row[0] - self.previous[0]
+            self.rss_area += self.previous[3] * interval
+            if interval > 0:
+                cpu = row[1] + row[2] - self.previous[1] - self.previous[2]
+                self.cpu_peak = max(self.cpu_peak, 100 * cpu / interval)
+                self.read_peak = max(self.read_peak, (row[5] - self.previous[5]) / interval)
+                self.write_peak = max(self.write_peak, (row[6] - self.previous[6]) / interval)
+        self.previous = row
+        self.last = row
+
+    # Returns list of (name, value), totals taken from rusage of the program
+    def report(self, duration, rusage, returncode):
+        last = self.last or [0] * len(COLUMNS)
+        rss_average = self.rss_peak
+        if self.previous is not None and self.previous[0] > 0:
+            rss_average = self.rss_area / self.previous[0]
+        return [("duration", duration),
+                ("cpu_user", rusage.ru_utime),
+                ("cpu_system", rusage.ru_stime),
+                ("cpu_peak_percent", self.cpu_peak),
+                ("rss_peak", max(self.rss_peak, self.hwm)),
+                ("rss_average", rss_average),
+                ("read_bytes", last[5]),
+                ("write_bytes", last[6]),
+                ("read_peak_bytes_per_second", self.read_peak),
+                ("write_peak_bytes_per_second", self.write_peak),
+                ("voluntary_ctxt_switches", rusage.ru_nvcsw),
+                ("nonvoluntary_ctxt_switches", rusage.ru_nivcsw),
+                ("samples", self.samples),
+                ("exit_status", returncode)]
+
+
+# Returns (row, hwm), row of COLUMNS summed over all processes sampler finds,
+# None when there is none, and VmHWM of the program, None when it is gone.
+# Time is left for the caller.
+def sampleTree(sampler):
+    total = None
+    hwm = None
+    for pid, data in sampler.walk():
+        row = parseSample(data["stat"], data["status"], data["io"])
+        if row is None:
+            continue
+        if pid == sampler.pid:
+            hwm = memsampler.statusField(data["status"], "VmHWM")
+        if total is None:
+            total = row
+        else:
+            total = [a + b for a, b in zip(total, row)]
+    return total, hwm
+
+
+# Runs command, sampling its process tree every interval seconds into
+# writer, returns (summary, duration, rusage, exit status)
+def profile(command, interval, writer):
+    summary = Summary()
+    buf = array.array("d")
+    subreaper = memsampler.becomeSubreaper()
+    start = time.time()
+    task = subprocess.Popen(command)
+    sampler = memsampler.TreeSampler(task.pid, subreaper=subreaper, names=("stat", "io"))
+    waiter = memsampler.ChildWaiter(task.pid)
+    rusage = None
+    try:
+        while rusage is None:
+            row, hwm = sampleTree(sampler)
+            now = time.time()
+            if row:
+                row[0] = now - start
+                summary.add(row, hwm)
+                buf.extend(row)
+                if len(buf) >= BUFFER_ROWS * len(COLUMNS) and writer is not None:
+                    writer.write(buf)
+                    buf = array.array("d")
+            status, rusage = memsampler.reap(task.pid, subreaper)
+            if rusage is None:
+                waiter.wait(now + interval - time.time())
+    finally:
+        waiter.close()
+        sampler.close()
+    duration = time.time() - start
+    # Popen must not try to reap the process again
+    task.returncode = status
+    if writer is not None and buf:
+        writer.write(buf)
+    if os.WIFEXITED(status):
+        status = os.WEXITSTATUS(status)
+    else:
+        status = 128 + os.WTERMSIG(status)
+    return summary, duration, rusage, status
+
+
+def main():
+    optparser = OptionParser(usage="%prog [options] command [args...]")
+    optparser.disable_interspersed_args()
+    optparser.add_option("-i", "--interval", default=0.1, type="float", metavar="SECONDS",
+                         help="time between samples (default: %default)")
+    optparser.add_option("-o", "--output", default=None, metavar="FILE",
+                         help="write time series to FILE")
+    optparser.add_option("-f", "--format", default="csv", type="choice", choices=["csv", "binary"],
+                         help="format of time series, 'csv' (default) or 'binary'")
+    optparser.add_option("-s", "--summary", default="-", metavar="FILE",
+                         help="write summary as 'name value' lines to FILE (default: stdout)")
+    (options, args) = optparser.parse_args()
+    if not args:
+        optparser.error("command needed")
+
+    writer = None
+    if options.output is not None:
+        output = open(options.output, "wb")
+        writer = {"csv": CSVWriter, "binary": BinaryWriter}[options.format](output)
+    try:
+        summary, duration, rusage, status = profile(args, options.interval, writer)
+    except OSError, e:
+        sys.stderr.write("Failed to run %s: %s\n" % (args[0], e))
+        return 127
+    if writer is not None:
+        output.close()
+
+    out = sys.stdout
+    if options.summary != "-":
+        out = open(options.summary, "w")
+    for name, value in summary.report(duration, rusage, status):
+        if isinstance(value, float):
+            out.write("%s %.3f\n" % (name, value))
+        else:
+            out.write("%s %d\n" % (name, value))
+    out.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,45 +18,29 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
-import sys, time, re
+import os
+import sys
+from optparse import OptionParser
 
-use_sub   = False
-use_popen = False
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import memsampler
 
-try:
-  import subprocess
-  use_sub = True
-except ImportError:
-  import popen2
-  use_popen = True
+optparser = OptionParser(usage="%prog [options] <command>")
+memsampler.addOptions(optparser)
+(options, args) = optparser.parse_args()
 
-if len(sys.argv) < 2:
+if len(args) < 1:
   print 'syntax: rlMemAvg <command>'
   sys.exit(1)
 
-proglist = sys.argv[1:]
+usage = memsampler.measure(args, options.interval, options.cgroup, options.tree, options.pss)
 
-if use_sub:
-  task = subprocess.Popen(proglist)
-elif use_popen:
-  task = popen2.Popen3(" ".join(proglist))
-
-memsum = 0
-tick = 0
-fn = '/proc/%d/status' % task.pid
-mre = re.compile(r'VmRSS:[ \t]+(?P<mem>\d+)')
-
-while True:
-  for line in open(fn, 'r').readlines():
-    m = mre.search(line)
-    if m:
-      mem = int(m.group('mem'))
-      memsum += mem
-      tick += 1
-      break
-  time.sleep(0.1)
-  finish = task.poll()
-  if (use_sub and finish != None) or (use_popen and finish != -1):
-    break
-
-print "%d" % (memsum/tick)
+if options.all:
+  for name, value in usage.report():
+    print "%s %d" % (name, value)
+  if options.tree:
+    for process in usage.breakdown():
+      print "process %d %s %d %d" % (process.pid, process.name, process.peak, process.average())
+else:
+  print "%d" % (usage.average())
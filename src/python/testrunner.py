@@ -0,0 +1,369 @@
+#!/usr/bin/python
+
+# Description: Runs beakerlib tests in parallel, each under the test watcher
+#
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted
+# material is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Every test runs under its own beakerlib-testwatcher, in the directory of
+# the test, with BEAKERLIB_DIR and TESTID of its own, the watcher providing
+# the cleanup file. Watchdog budget of a test is enforced the way Beaker
+# does it: when the budget runs out, the watcher gets SIGHUP, kills the test
+# and runs its cleanup, which gets TESTWATCHER_EWD_SECS more to finish.
+#
+# Tests are started longest expected first, expected duration being the one
+# of its journal from the previous run into the same output directory, tests
+# never run before are started first of all. Exit of a watcher and expiring
+# budgets wake up the single loop of the runner, no test is polled.
+
+import os
+import re
+import sys
+import errno
+import fcntl
+import select
+import signal
+import shutil
+import multiprocessing
+from optparse import OptionParser
+try:
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.cElementTree import iterparse
+
+# Installed script is not next to the modules it uses
+sys.path.insert(1, os.path.join(os.environ.get("BEAKERLIB", "/usr/share/beakerlib"), "python"))
+import metricstore
+
+USAGE = """%prog [options] TEST [TEST...]
+       %prog [options] --list FILE
+
+Runs beakerlib tests concurrently. TEST is a test directory, whose runtest.sh
+is run, or an executable. Lines of the list file are TEST, optionally
+followed by its watchdog budget. Results of every test (journal, output and
+metrics of the watcher) are kept in its subdirectory of the output
+directory, summary of all of them in summary.txt there."""
+
+# Phase results from the best to the worst
+RESULTS = ["PASS", "WARN", "FAIL"]
+UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+# seconds since an arbitrary point, not affected by changes of system time
+def monotonic():
+    return os.times()[4]
+
+
+def debug(msg):
+    print "TESTRUNNER: " + msg
+    sys.stdout.flush()
+
+
+# Returns seconds of duration like '90', '5m' or '2h', None when not valid
+def parseDuration(text):
+    match = re.match(r"^\s*(\d+)\s*([smhd]?)\s*$", text)
+    if not match:
+        return None
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+# Returns TestTime of Makefile of Beaker test in directory, None without it
+def readTestTime(directory):
+    try:
+        makefile = open(os.path.join(directory, "Makefile")).read()
+    except IOError:
+        return None
+    match = re.search(r"TestTime:\s*(\d+\s*[smhd]?)", makefile)
+    return match and parseDuration(match.group(1))
+
+
+# Returns (duration in seconds, worst phase result) of journal, None for
+# either when the journal or the information is missing
+def readJournal(path):
+    times = {}
+    result = None
+    try:
+        for event, element in iterparse(path):
+            if element.tag in ("starttime", "endtime") and element.tag not in times:
+                times[element.tag] = metricstore.parseTime((element.text or "").strip())
+            elif element.tag == "phase":
+                phase = element.get("result")
+                if phase in RESULTS and (result is None or RESULTS.index(phase) > RESULTS.index(result)):
+                    result = phase
+                element.clear()
+    except (IOError, SyntaxError):
+        return None, None
+    duration = None
+    if times.get("starttime") is not None and times.get("endtime") is not None:
+        duration = times["endtime"] - times["starttime"]
+    return duration, result
+
+
+# Returns {name: value} of 'name value' lines of file
+def readMetrics(path):
+    metrics = {}
+    try:
+        for line in open(path):
+            fields = line.split()
+            if len(fields) == 2:
+                metrics[fields[0]] = int(fields[1])
+    except (IOError, ValueError):
+        pass
+    return metrics
+
+
+class Test:
+    def __init__(self, index, path, budget=None):
+        self.index = index
+        self.path = path
+        if os.path.isdir(path):
+            self.directory = path
+            self.command = ["./runtest.sh"]
+        else:
+            self.directory = os.path.dirname(path) or "."
+            self.command = ["./" + os.path.basename(path)]
+        if budget is None:
+            budget = readTestTime(self.directory)
+        self.budget = budget
+        self.name = re.sub(r"[^\w.-]+", "_", os.path.normpath(path).strip("./")) or "test"
+        self.output = None
+        self.expected = None
+        self.pid = None
+        self.started = None
+        self.deadline = None
+        self.duration = None
+        self.status = None
+        self.result = None
+
+    def journal(self):
+        return os.path.join(self.output, "journal.xml")
+
+    def start(self, watcher, testid):
+        # Journal of the previous run must not get into this one
+        if os.path.isdir(self.output):
+            shutil.rmtree(self.output)
+        os.makedirs(self.output)
+        env = dict(os.environ)
+        env["BEAKERLIB_DIR"] = self.output
+        env["TESTID"] = testid
+        env["TEST"] = self.path
+        env["TESTWATCHER_METRICS"] = os.path.join(self.output, "watcher.metrics")
+        log = os.open(os.path.join(self.output, "output.log"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+
+        self.started = monotonic()
+        if self.budget is not None:
+            self.deadline = self.started + self.budget
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                signal.set_wakeup_fd(-1)
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+                    signal.signal(signum, signal.SIG_DFL)
+                # Interrupt from terminal is forwarded by the runner, only once
+                os.setpgrp()
+                os.chdir(self.directory)
+                os.dup2(log, 1)
+                os.dup2(log, 2)
+                os.execvpe(watcher[0], watcher + self.command, env)
+            except OSError, e:
+                os.write(2, "TESTRUNNER: cannot run %s: %s\n" % (self.path, e.strerror))
+            os._exit(127)
+        os.close(log)
+
+    def finish(self, status):
+        self.duration = monotonic() - self.started
+        metrics = readMetrics(os.path.join(self.output, "watcher.metrics"))
+        if "test.exit_status" in metrics:
+            self.status = metrics["test.exit_status"]
+        elif os.WIFSIGNALED(status):
+            # Watcher did not get to store the exit status of the test
+            self.status = 128 + os.WTERMSIG(status)
+        else:
+            self.status = os.WEXITSTATUS(status)
+        self.result = readJournal(self.journal())[1]
+
+    def passed(self):
+        return self.status == 0 and self.result in ("PASS", None)
+
+
+class Runner:
+    def __init__(self, tests, jobs, watcher, testid):
+        self.pending = tests
+        self.jobs = jobs
+        self.watcher = watcher
+        self.testid = testid
+        self.running = {}
+        self.queued = []
+        self.interrupted = False
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        signal.set_wakeup_fd(self.pipe[1])
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+            signal.signal(signum, self.queue)
+            signal.siginterrupt(signum, False)
+
+    def queue(self, signum, frame):
+        self.queued.append(signum)
+
+    def wait(self):
+        deadlines = [test.deadline for test in self.running.values() if test.deadline is not None]
+        timeout = None
+        if deadlines:
+            timeout = max(0, min(deadlines) - monotonic())
+        try:
+            select.select([self.pipe[0]], [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+        try:
+            while os.read(self.pipe[0], 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def reap(self):
+        while self.running:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.ECHILD:
+                    raise
+                return
+            if not pid:
+                return
+            test = self.running.pop(pid, None)
+            if test is not None:
+                test.finish(status)
+                debug("finished %s, exit status %d, result %s, %.1f s" % (
+                      test.path, test.status, test.result, test.duration))
+
+    def run(self):
+        while self.pending or self.running:
+            while self.pending and len(self.running) < self.jobs and not self.interrupted:
+                test = self.pending.pop(0)
+                test.start(self.watcher, "%s-%d" % (self.testid, test.index))
+                self.running[test.pid] = test
+                debug("started %s" % test.path)
+            if not self.running:
+                break
+            self.wait()
+            while self.queued:
+                signum = self.queued.pop(0)
+                if signum in (signal.SIGINT, signal.SIGTERM) and not self.interrupted:
+                    debug("interrupted, stopping running tests")
+                    self.interrupted = True
+                    for pid in self.running:
+                        os.kill(pid, signal.SIGINT)
+            self.reap()
+            now = monotonic()
+            for test in self.running.values():
+                if test.deadline is not None and test.deadline <= now:
+                    debug("watchdog budget of %s expired" % test.path)
+                    os.kill(test.pid, signal.SIGHUP)
+                    test.deadline = None
+
+
+# Orders tests longest expected first, never run tests before all
+def schedule(tests):
+    def key(test):
+        if test.expected is None:
+            return (0, 0, test.index)
+        return (1, -test.expected, test.index)
+    return sorted(tests, key=key)
+
+
+def writeSummary(out, tests):
+    for test in tests:
+        if test.started is None:
+            out.write("%-6s %6s %9s  %s\n" % ("-", "-", "not run", test.path))
+            continue
+        out.write("%-6s %6d %8.1fs  %s  %s\n" % (test.result or "-", test.status, test.duration,
+                                                test.path, test.journal()))
+
+
+def main():
+    optparser = OptionParser(usage=USAGE)
+    optparser.add_option("-l", "--list", default=None, metavar="FILE",
+                         help="read tests from FILE, one per line")
+    optparser.add_option("-j", "--jobs", default=multiprocessing.cpu_count(), type="int",
+                         help="number of tests run at once (default: %default)")
+    optparser.add_option("-o", "--output", default="testrunner-results", metavar="DIR",
+                         help="directory of results (default: %default)")
+    optparser.add_option("-t", "--timeout", default=None, metavar="DURATION",
+                         help="watchdog budget of tests without their own, like 30m"
+                         " (default: TestTime of Makefile of the test, or none)")
+    optparser.add_option("-w", "--watcher", default="beakerlib-testwatcher", metavar="COMMAND",
+                         help="test watcher to run tests with (default: %default)")
+    (options, args) = optparser.parse_args()
+
+    specs = [(arg, None) for arg in args]
+    if options.list is not None:
+        for line in open(options.list):
+            fields = line.split("#", 1)[0].split()
+            if fields:
+                specs.append((fields[0], " ".join(fields[1:]) or None))
+    if not specs:
+        optparser.error("no tests given")
+    if options.jobs < 1:
+        optparser.error("at least one job needed")
+    default = None
+    if options.timeout is not None:
+        default = parseDuration(options.timeout)
+        if default is None:
+            optparser.error("invalid timeout %s" % options.timeout)
+
+    output = os.path.abspath(options.output)
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    tests = []
+    names = set()
+    for index, (path, budget) in enumerate(specs):
+        if budget is not None:
+            seconds = parseDuration(budget)
+            if seconds is None:
+                optparser.error("invalid watchdog budget %s of %s" % (budget, path))
+            test = Test(index, path, seconds)
+        else:
+            test = Test(index, path)
+        if test.budget is None:
+            test.budget = default
+        if test.name in names:
+            test.name = "%s-%d" % (test.name, index)
+        names.add(test.name)
+        test.output = os.path.join(output, test.name)
+        test.expected = readJournal(test.journal())[0]
+        tests.append(test)
+
+    # Watcher is run in the directory of the test
+    watcher = options.watcher.split()
+    if os.sep in watcher[0]:
+        watcher[0] = os.path.abspath(watcher[0])
+    runner = Runner(schedule(tests), options.jobs, watcher,
+                    os.environ.get("TESTID", "testrunner-%d" % os.getpid()))
+    runner.run()
+
+    writeSummary(sys.stdout, tests)
+    summary = open(os.path.join(output, "summary.txt"), "w")
+    writeSummary(summary, tests)
+    summary.close()
+    if [test for test in tests if not test.passed()]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
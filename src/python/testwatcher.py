@@ -31,20 +31,48 @@
 #     until the watcher process exits
 # - set up SIGHUP handling, which
 #   - sends SIGKILL to test if running
-#   - sets up SIGALRM handler for EWD and schedules alarm(2)
-#     - EWD handler SIGKILLs cleanup (if running)
+#   - schedules EWD timer
+#     - EWD timer SIGKILLs cleanup (if running)
 # - run test
-#   - if it finishes in time, do nothing (unset pid)
-#   - if INT is received while it is running, SIGKILL the test, unset pid
+#   - if it finishes in time, do nothing
+#   - if INT is received while it is running, SIGKILL the test
 # - execute possible cleanup
-#   - if it still finishes in time (no HUP so far), do nothing (unset pid)
-#   - if INT is received while it is running, SIGKILL cleanup, unset pid
+#   - if it still finishes in time (no HUP so far), do nothing
+#   - if INT is received while it is running, SIGKILL cleanup
 # - exit cleanly
 #
+# All of this happens in a single event loop: signal handlers only queue the
+# signal and wake the loop up through a pipe (signal.set_wakeup_fd), exit of
+# a child is noticed on its pidfd (or on SIGCHLD when the kernel has no
+# pidfds) and the EWD deadline is the timeout of the poll. Kill decisions are
+# thus made in the loop, in order, as soon as the event arrives, and only
+# children not reaped yet are killed. The loop can supervise any number of
+# children at once.
+#
+# With TESTWATCHER_CGROUP set to a (delegated) cgroup v2 directory, test and
+# cleanup are each run in a cgroup of their own created in it, joined before
+# exec, so everything they start stays there, daemons calling setsid
+# included. Killing the test or cleanup then freezes and kills its whole
+# cgroup (cgroup.kill), and once it ends its cpu.stat, memory.peak and
+# io.stat are reported.
+#
+# Exit status of test and cleanup (and their cgroup accounting) are written
+# to the TESTWATCHER_METRICS file if set, the watcher itself exits with 0.
+#
+# With TESTWATCHER_STREAM set to a path, progress of the test is streamed
+# to any number of clients connected to a UNIX socket created there, as
+# newline delimited JSON objects, one for each record of the metafile
+# (phase start and end, test results, metrics, messages, ...) plus one with
+# exit status of test and cleanup. The metafile is followed by inotify on
+# BEAKERLIB_DIR (exported by the watcher when not set), read only when it
+# changes and every record is decoded once for all clients. A client
+# connecting later gets the events streamed so far first, the stream ends
+# when the watcher finishes.
+#
 # Some considerations taken into account / tested:
 #
 # - SIGHUP is received while running cleanup (TestTime expired after test exit)
-#   - testpid is already 0, only SIGALRM (cleanup kill) is scheduled, giving
+#   - test is reaped already, only EWD (cleanup kill) is scheduled, giving
 #     the cleanup another ewd_maxsecs seconds to finish
 # - SIGTERM is received at any time
 #   - the only reasonable case is system reboot/poweroff, which we cannot
@@ -57,10 +85,21 @@
 import os
 import sys
 import signal
-import time
 import errno
 import fcntl
+import json
+import select
+import socket
+import stat
+import struct
+import re
 import tempfile
+from collections import deque
+from binascii import a2b_base64
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
 
 
 ### CONFIG
@@ -84,6 +123,33 @@ lwd_guard_file = '/usr/share/rhts/hooks/watchdog/testwatcher-cleanup-guard'
 clfd, clpath = tempfile.mkstemp(prefix='testwatcher-', dir='/var/tmp') # no-reboot
 # env var containing the path, so the test can write to it
 os.environ['TESTWATCHER_CLPATH'] = clpath
+
+# cgroup v2 directory to create cgroups of test and cleanup in, optional
+cgroup_parent = os.environ.get('TESTWATCHER_CGROUP')
+# file exit status and cgroup accounting of test and cleanup is appended to
+# as 'name value' lines, optional
+metrics_file = os.environ.get('TESTWATCHER_METRICS')
+
+# UNIX socket to stream progress of the test on, optional
+stream_path = os.environ.get('TESTWATCHER_STREAM')
+
+# pidfd_open system call in the table shared by most architectures, alpha
+# (skipped below) uses the number for another call, on ia64 and mips it is
+# out of their range and fails with ENOSYS, children are waited for on
+# SIGCHLD then
+PIDFD_OPEN = 434
+
+# inotify events telling the metafile was written or (re)created
+IN_MODIFY = 0x2
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+# metafile is checked this often when inotify is not available
+stream_poll_secs = 1
+# number of events a client connecting later gets first
+stream_history = 10000
+# client not reading its events is disconnected when this much is pending
+stream_max_pending = 4 * 1024 * 1024
 #
 ###
 
@@ -93,6 +159,8 @@ selfname = os.path.basename(__file__)
 
 testpid = 0
 cleanuppid = 0
+testcgroup = None
+cleanupcgroup = None
 
 if os.environ.get('TASKID'):
     beah = True
@@ -127,6 +195,585 @@ def sigpgkill_safe(pid):
 def beah_warn(part):
     # python "subprocess" not on RHEL4
     os.system('rhts-report-result "TESTWATCHER ('+part+')" WARN /dev/null')
+
+
+# makes fd non-blocking and not inherited by executed children
+def set_nonblock_cloexec(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+
+# seconds since an arbitrary point, not affected by changes of system time
+def monotonic():
+    return os.times()[4]
+
+
+# returns pidfd of the process, readable once it exits, or None when the
+# kernel does not provide pidfds (the watcher is standalone, so this does
+# not come from the beakerlib python modules)
+def pidfd_open(pid):
+    if ctypes is None or os.uname()[4] == 'alpha':
+        return None
+    try:
+        fd = ctypes.CDLL(None, use_errno=True).syscall(PIDFD_OPEN, pid, 0)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return fd
+
+
+# returns inotify fd watching path for the events, non-blocking, or None
+# when inotify is not available
+def inotify_watch(path, mask):
+    if ctypes is None:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, path, mask) < 0:
+        os.close(fd)
+        return None
+    set_nonblock_cloexec(fd)
+    return fd
+#
+###
+
+### CGROUP CONTAINMENT
+#
+def cgroup_write(path, name, value):
+    try:
+        f = open(os.path.join(path, name), 'w')
+        f.write(value)
+        f.close()
+    except IOError:
+        return False
+    return True
+
+
+def cgroup_read(path, name):
+    try:
+        return open(os.path.join(path, name)).read()
+    except IOError:
+        return ''
+
+
+def cgroup_create(part):
+    # memory and io accounting needs the controllers enabled for children,
+    # which is not possible (and not fatal) everywhere
+    for controller in ('memory', 'io'):
+        cgroup_write(cgroup_parent, 'cgroup.subtree_control', '+'+controller)
+    path = os.path.join(cgroup_parent, 'testwatcher-%d-%s' % (os.getpid(), part))
+    try:
+        os.mkdir(path)
+    except OSError, e:
+        fatal('cannot create cgroup '+path+': '+e.strerror)
+    return path
+
+
+# kills all processes of the cgroup at once, frozen so that they cannot
+# fork while being killed one by one on kernels without cgroup.kill
+def cgroup_kill(path):
+    cgroup_write(path, 'cgroup.freeze', '1')
+    if not cgroup_write(path, 'cgroup.kill', '1'):
+        for pid in cgroup_read(path, 'cgroup.procs').split():
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except OSError:
+                pass
+    cgroup_write(path, 'cgroup.freeze', '0')
+
+
+# returns list of (name, value) of cpu.stat, memory.peak and io.stat,
+# io.stat summed over devices, files missing are skipped
+def cgroup_stats(path):
+    stats = []
+    for line in cgroup_read(path, 'cpu.stat').splitlines():
+        key, value = line.split()
+        stats.append(('cpu.'+key, int(value)))
+    peak = cgroup_read(path, 'memory.peak').strip()
+    if peak:
+        stats.append(('memory.peak', int(peak)))
+    io = {}
+    keys = []
+    for line in cgroup_read(path, 'io.stat').splitlines():
+        for field in line.split()[1:]:
+            key, value = field.split('=')
+            if key not in io:
+                keys.append(key)
+                io[key] = 0
+            io[key] += int(value)
+    for key in keys:
+        stats.append(('io.'+key, io[key]))
+    return stats
+
+
+def cgroup_remove(path):
+    try:
+        os.rmdir(path)
+    except OSError, e:
+        if e.errno != errno.EBUSY:
+            raise
+        debug('cgroup '+path+' still has processes, leaving it')
+#
+###
+
+### METRICS
+#
+# reports exit status of test or cleanup and accounting of its cgroup
+def report(part, pid, cgroup):
+    status = watcher.statuses.get(pid, 0)
+    if os.WIFSIGNALED(status):
+        status = 128 + os.WTERMSIG(status)
+    else:
+        status = os.WEXITSTATUS(status)
+    stats = [('exit_status', status)]
+    if cgroup:
+        stats.extend(cgroup_stats(cgroup))
+    for key, value in stats:
+        debug('%s metric %s %d' % (part, key, value))
+    if stream:
+        # records written by the part come first
+        stream.follow()
+        event = dict(stats)
+        event['event'] = 'testwatcher'
+        event['part'] = part
+        stream.publish(event)
+    if metrics_file:
+        f = open(metrics_file, 'a')
+        for key, value in stats:
+            f.write('%s.%s %d\n' % (part, key, value))
+        f.close()
+#
+###
+
+### EVENT LOOP
+#
+# supervises children, each a process group leader, until all of them exit,
+# dispatching queued signals and expired timers to their handlers
+class Watcher:
+    def __init__(self):
+        self.children = {}
+        self.statuses = {}
+        self.cgroups = {}
+        self.pidfds = {}
+        self.readers = {}
+        self.timers = []
+        self.queued = []
+        self.handlers = {}
+        self.poll = select.poll()
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            set_nonblock_cloexec(fd)
+        self.poll.register(self.pipe[0], select.POLLIN)
+        signal.set_wakeup_fd(self.pipe[1])
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self.queue)
+            signal.siginterrupt(signum, False)
+
+    # the only thing done in signal handler context
+    def queue(self, signum, frame):
+        self.queued.append(signum)
+
+    # sets function called with the signal number, None ignores the signal
+    def handle(self, signum, handler):
+        self.handlers[signum] = handler
+
+    # calls handler after given number of seconds, if the loop runs then
+    def schedule(self, seconds, handler):
+        self.timers.append((monotonic() + seconds, handler))
+        self.timers.sort()
+
+    # sets function called with fd and poll events when any of the events
+    # happens on the fd, called again changes the events
+    def watch(self, fd, handler, events=select.POLLIN):
+        self.readers[fd] = handler
+        self.poll.register(fd, events)
+
+    def unwatch(self, fd):
+        if fd in self.readers:
+            del self.readers[fd]
+            self.poll.unregister(fd)
+
+    # starts a child, in the cgroup when given
+    def spawn(self, argv, msg, cgroup=None):
+        pid = os.fork()
+        if pid == 0:
+            signal.set_wakeup_fd(-1)
+            for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(signum, signal.SIG_DFL)
+            # become process group leader, so we can kill all related
+            # processes (from the parent) when interrupted
+            os.setpgrp()
+            if cgroup and not cgroup_write(cgroup, 'cgroup.procs', '0'):
+                print >> sys.stderr, 'TESTWATCHER: cannot join cgroup '+cgroup
+            debug(msg)
+            try:
+                os.execvp(argv[0], argv)
+            except OSError, e:
+                print >> sys.stderr, 'TESTWATCHER: cannot execute %s: %s' % (argv[0], e.strerror)
+            os._exit(127)
+        fd = pidfd_open(pid)
+        if fd is not None:
+            self.pidfds[fd] = pid
+            self.poll.register(fd, select.POLLIN)
+        self.children[pid] = fd
+        if cgroup:
+            self.cgroups[pid] = cgroup
+        return pid
+
+    # kills process group and cgroup of a child which was not reaped yet
+    def kill(self, pid):
+        if pid in self.children:
+            if pid in self.cgroups:
+                cgroup_kill(self.cgroups[pid])
+            sigpgkill_safe(pid)
+
+    # returns True when the child was reaped (or is gone), its wait status
+    # is kept in statuses
+    def reap(self, pid):
+        try:
+            reaped, status = os.waitpid(pid, os.WNOHANG)
+        except OSError, e:
+            if e.errno != errno.ECHILD:
+                raise
+            reaped, status = pid, 0
+        if not reaped:
+            return False
+        self.statuses[pid] = status
+        fd = self.children.pop(pid)
+        if fd is not None:
+            self.poll.unregister(fd)
+            del self.pidfds[fd]
+            os.close(fd)
+        return True
+
+    def wait(self):
+        timeout = -1
+        if self.timers:
+            timeout = max(0, int((self.timers[0][0] - monotonic()) * 1000) + 1)
+        try:
+            events = self.poll.poll(timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+        try:
+            while os.read(self.pipe[0], 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        return [(fd, event) for fd, event in events if fd != self.pipe[0]]
+
+    def run(self):
+        while self.children:
+            ready = self.wait()
+            while self.queued:
+                signum = self.queued.pop(0)
+                if signum == signal.SIGCHLD:
+                    # without pidfds, or in case one was missed
+                    for pid in self.children.keys():
+                        self.reap(pid)
+                elif self.handlers.get(signum):
+                    self.handlers[signum](signum)
+            for fd, event in ready:
+                if fd in self.pidfds:
+                    self.reap(self.pidfds[fd])
+                elif fd in self.readers:
+                    self.readers[fd](fd, event)
+            while self.timers and self.timers[0][0] <= monotonic():
+                deadline, handler = self.timers.pop(0)
+                handler()
+
+watcher = Watcher()
+#
+###
+
+### PROGRESS STREAM
+#
+# metafile records, as written by journal.sh in the text format
+#   <indent>[element ]--timestamp="<epoch>"[ --name="<base64>"]...[ -- "<base64>"]
+# or in the binary one, <length>:<payload> with payload made of such fields
+# (see python/metafile.py, the watcher is standalone, so it is decoded here)
+METAFILE_LINE = re.compile(r'( *)(?:([^\s#-][^\s#]*) )?--timestamp="(\d+)"'
+                           r'((?: --[a-zA-Z0-9]+="[A-Za-z0-9+/=]*")*)'
+                           r'(?: -- "([A-Za-z0-9+/=]*)")?\s*\Z')
+METAFILE_ATTRIBUTE = re.compile(r' --([a-zA-Z0-9]+)="([A-Za-z0-9+/=]*)"')
+
+
+# returns list of (indent, element, attributes, content) of complete
+# records in buf, attributes being list of (name, value) pairs, content
+# None when there is none, and the rest of buf
+def metafile_text(buf):
+    records = []
+    lines = buf.split('\n')
+    for line in lines[:-1]:
+        match = METAFILE_LINE.match(line)
+        # comment
+        if match is None:
+            continue
+        indent, element, timestamp, rest, content = match.groups()
+        attributes = [('timestamp', timestamp)]
+        for name, value in METAFILE_ATTRIBUTE.findall(rest):
+            attributes.append((name, a2b_base64(value)))
+        if content is not None:
+            content = a2b_base64(content)
+        records.append((len(indent), element or '', attributes, content))
+    return records, lines[-1]
+
+
+def metafile_binary(buf):
+    records = []
+    start = 0
+    while True:
+        colon = buf.find(':', start)
+        if colon == -1:
+            break
+        end = colon + 1 + int(buf[start:colon])
+        if end >= len(buf):
+            break
+        payload = buf[colon+1:end]
+        start = end + 1
+        if payload.startswith('#'):
+            continue
+        fields = []
+        pos = 0
+        while pos < len(payload):
+            colon = payload.index(':', pos)
+            pos = colon + 1 + int(payload[pos:colon])
+            fields.append(payload[colon+1:pos])
+        attributes = zip(fields[2::2], fields[3::2])
+        content = None
+        if attributes and attributes[-1][0] == '':
+            content = attributes.pop()[1]
+        records.append((int(fields[0]), fields[1], attributes, content))
+    return records, buf[start:]
+
+
+def text(value):
+    return unicode(value, 'utf-8', 'replace')
+
+
+# follows the metafile and streams its records to clients of UNIX socket
+class Stream:
+    def __init__(self, path, metafile):
+        self.path = path
+        self.metafile = metafile
+        self.clients = {}
+        self.history = deque(maxlen=stream_history)
+        self.closed = False
+        self.fd = None
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except OSError:
+            pass
+        self.sock.bind(path)
+        self.sock.listen(16)
+        set_nonblock_cloexec(self.sock.fileno())
+        watcher.watch(self.sock.fileno(), self.accept)
+
+        self.inotify = inotify_watch(os.path.dirname(metafile),
+                                     IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+        if self.inotify is not None:
+            watcher.watch(self.inotify, self.notified)
+        else:
+            debug('inotify not available, checking metafile every %d s' % stream_poll_secs)
+            watcher.schedule(stream_poll_secs, self.tick)
+
+    def notified(self, fd, event):
+        changed = False
+        try:
+            while True:
+                data = os.read(fd, 4096)
+                pos = 0
+                while pos < len(data):
+                    wd, mask, cookie, length = struct.unpack('iIII', data[pos:pos+16])
+                    name = data[pos+16:pos+16+length].rstrip('\0')
+                    pos += 16 + length
+                    if mask & IN_Q_OVERFLOW or name == os.path.basename(self.metafile):
+                        changed = True
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+        if changed:
+            self.follow()
+
+    def tick(self):
+        if not self.closed:
+            self.follow()
+            watcher.schedule(stream_poll_secs, self.tick)
+
+    # reads what was appended to the metafile since the last time, from
+    # the beginning when it was recreated or truncated
+    def follow(self):
+        try:
+            st = os.stat(self.metafile)
+        except OSError:
+            return
+        if self.fd is None or st.st_ino != self.inode or st.st_size < self.offset:
+            if self.fd is not None:
+                os.close(self.fd)
+            try:
+                self.fd = os.open(self.metafile, os.O_RDONLY)
+            except OSError:
+                self.fd = None
+                return
+            set_nonblock_cloexec(self.fd)
+            self.inode = os.fstat(self.fd).st_ino
+            self.offset = 0
+            self.buf = ''
+            self.decode = None
+            self.opened = {}
+        while True:
+            data = os.read(self.fd, 65536)
+            if not data:
+                break
+            self.offset += len(data)
+            self.buf += data
+        if not self.buf:
+            return
+        if self.decode is None:
+            if self.buf[0].isdigit():
+                self.decode = metafile_binary
+            else:
+                self.decode = metafile_text
+        try:
+            records, self.buf = self.decode(self.buf)
+        except (ValueError, TypeError, struct.error), e:
+            debug('cannot decode metafile, not following it any more: '+str(e))
+            self.buf = ''
+            self.decode = lambda buf: ([], '')
+            return
+        for record in records:
+            self.publish(self.event(*record))
+
+    # returns record as a dictionary, end of paired element (phase) is
+    # <element>_end with attributes of the start and of the end
+    def event(self, indent, element, attributes, content):
+        event = {}
+        if element:
+            self.opened[indent] = (element, attributes)
+            name = element
+        else:
+            name, started = self.opened.pop(indent, ('', []))
+            name += '_end'
+            for key, value in started:
+                event[key] = text(value)
+        for key, value in attributes:
+            event[key] = text(value)
+        if 'timestamp' in event:
+            event['timestamp'] = int(event['timestamp'])
+        if content is not None:
+            event['content'] = text(content)
+        event['event'] = name
+        return event
+
+    def publish(self, event):
+        line = json.dumps(event, sort_keys=True) + '\n'
+        self.history.append(line)
+        for fd in self.clients.keys():
+            self.clients[fd][1] += line
+            if len(self.clients[fd][1]) > stream_max_pending:
+                debug('stream client not reading, disconnecting it')
+                self.drop(fd)
+            else:
+                self.flush(fd)
+
+    def accept(self, fd, event):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+            set_nonblock_cloexec(conn.fileno())
+            conn.setblocking(0)
+            self.clients[conn.fileno()] = [conn, ''.join(self.history)]
+            self.flush(conn.fileno())
+
+    # sends what is pending, the rest once the client can take it
+    def flush(self, fd):
+        conn, pending = self.clients[fd]
+        try:
+            sent = conn.send(pending)
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                self.drop(fd)
+                return
+            sent = 0
+        self.clients[fd][1] = pending[sent:]
+        if self.clients[fd][1]:
+            watcher.watch(fd, self.ready, select.POLLIN | select.POLLOUT)
+        else:
+            watcher.watch(fd, self.ready, select.POLLIN)
+
+    # client can take more, has gone or sent something, which is ignored
+    def ready(self, fd, event):
+        if event & select.POLLOUT:
+            self.flush(fd)
+        if fd in self.clients and event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+            try:
+                if not self.clients[fd][0].recv(4096):
+                    self.drop(fd)
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                    self.drop(fd)
+
+    def drop(self, fd):
+        watcher.unwatch(fd)
+        self.clients.pop(fd)[0].close()
+
+    # streams the rest of the metafile and ends the stream, giving clients
+    # a while to take what is pending
+    def close(self):
+        self.follow()
+        self.accept(self.sock.fileno(), select.POLLIN)
+        self.closed = True
+        for fd in self.clients.keys():
+            conn, pending = self.clients[fd]
+            try:
+                conn.settimeout(1)
+                conn.sendall(pending)
+            except socket.error:
+                pass
+            self.drop(fd)
+        watcher.unwatch(self.sock.fileno())
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        if self.inotify is not None:
+            watcher.unwatch(self.inotify)
+            os.close(self.inotify)
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+# returns path of the metafile of the test, making sure the directory it
+# is created in exists, as rlJournalStart would choose it
+def stream_metafile():
+    if os.environ.get('BEAKERLIB_DIR'):
+        directory = os.environ['BEAKERLIB_DIR']
+    elif os.environ.get('TESTID'):
+        directory = '/var/tmp/beakerlib-'+os.environ['TESTID']
+    else:
+        directory = tempfile.mkdtemp(prefix='beakerlib-', dir='/var/tmp') # no-reboot
+    os.environ['BEAKERLIB_DIR'] = directory
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, 'journal.meta')
+
+stream = None
 #
 ###
 
@@ -163,25 +810,20 @@ def beah_lwd_hook():
 
 
 # called when EWD (external watchdog) is about to expire
-def beah_ewd_action(signum, frame):
+def beah_ewd_action():
     debug('beah EWD is about to strike')
-    global cleanuppid
     if cleanuppid != 0:
-        sigpgkill_safe(cleanuppid)
+        watcher.kill(cleanuppid)
     if beah:
         beah_warn('external watchdog')
 
 
 # called when LWD expires
-def beah_lwd_action(signum, frame):
+def beah_lwd_action(signum):
     debug('beah LWD expired')
-    global testpid
-    signal.signal(signal.SIGHUP, signal.SIG_IGN)
-    if testpid != 0:
-        sigpgkill_safe(testpid)
-        testpid = 0
-    signal.signal(signal.SIGALRM, beah_ewd_action)
-    signal.alarm(ewd_maxsecs)
+    watcher.handle(signal.SIGHUP, None)
+    watcher.kill(testpid)
+    watcher.schedule(ewd_maxsecs, beah_ewd_action)
     if beah:
         beah_warn('local watchdog')
 #
@@ -191,14 +833,13 @@ def beah_lwd_action(signum, frame):
 ### CLEANUP WATCHER
 #
 # executed by INT sent to the test watcher process
-def cleanup_interrupt(signum, frame):
+def cleanup_interrupt(signum):
     debug('cleanup interrupted')
-    global cleanuppid
 
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    watcher.handle(signal.SIGINT, None)
 
     if cleanuppid != 0:
-        sigpgkill_safe(cleanuppid)
+        watcher.kill(cleanuppid)
 
     if beah:
         beah_warn('cleanup interrupt')
@@ -221,24 +862,15 @@ def exec_cleanup():
         debug('cleanup file not found / not executable, skipping')
         return
 
-    signal.signal(signal.SIGINT, cleanup_interrupt)
+    watcher.handle(signal.SIGINT, cleanup_interrupt)
 
-    cleanuppid = os.fork()
-    if cleanuppid == 0:
-        os.setpgrp()
-        debug('executing cleanup at '+filename)
-        os.execvp(filename, [filename])
-    else:
-        debug('parent waiting for cleanup '+str(cleanuppid))
-        while cleanuppid != 0:
-            try:
-                os.waitpid(cleanuppid, 0)
-                cleanuppid = 0
-            except OSError, e:
-                if e.errno == errno.EINTR:
-                    pass
-                if e.errno == errno.ECHILD:
-                    cleanuppid = 0
+    global cleanupcgroup
+    if cgroup_parent:
+        cleanupcgroup = cgroup_create('cleanup')
+    cleanuppid = watcher.spawn([filename], 'executing cleanup at '+filename,
+                               cleanupcgroup)
+    debug('parent waiting for cleanup '+str(cleanuppid))
+    watcher.run()
 #
 ###
 
@@ -246,16 +878,14 @@ def exec_cleanup():
 ### TEST WATCHER
 #
 # executed by INT sent to the test watcher process
-def test_interrupt(signum, frame):
+def test_interrupt(signum):
     debug('test interrupted')
-    global testpid
 
     # ignore future INT
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    watcher.handle(signal.SIGINT, None)
 
     # kill frozen test + its process group
-    if testpid != 0:
-        sigpgkill_safe(testpid)
+    watcher.kill(testpid)
 
     # log warn
     if beah:
@@ -263,41 +893,22 @@ def test_interrupt(signum, frame):
 
 
 def exec_test():
-    # NOTE: signal handling can be set up before fork, it won't make it
-    # past execve/execvp and it's safer this way
-    # (the child can be killed via SIGINT received right after pid is available
-    #  to the parent, ie. right after fork)
+    # NOTE: signals are only queued until the loop runs, so one received
+    # right after fork is still handled, with the test pid known
 
     # beaker LWD
-    signal.signal(signal.SIGHUP, beah_lwd_action)
+    watcher.handle(signal.SIGHUP, beah_lwd_action)
     # user interrupt
-    signal.signal(signal.SIGINT, test_interrupt)
-
-    # fork and exec the test, wait for it in the parent process
-    global testpid
-    testpid = os.fork()
-    if testpid == 0:
-        # become process group leader, so we can kill all related
-        # processes (from the parent) when interrupted
-        os.setpgrp()
-
-        debug('executing test at '+' '.join(sys.argv[1:]))
-        os.execvp(sys.argv[1], sys.argv[1:])
-
-    else:
-        debug('parent waiting for test '+str(testpid))
-        while testpid != 0:
-            try:
-                # wait for entire process group
-                os.waitpid(testpid, 0)
-                testpid = 0
-            except OSError, e:
-                # no traceback if interrupted by a signal
-                if e.errno == errno.EINTR:
-                    pass
-                # safety measure, shouldn't happen
-                if e.errno == errno.ECHILD:
-                    testpid = 0
+    watcher.handle(signal.SIGINT, test_interrupt)
+
+    # fork and exec the test, wait for it in the event loop
+    global testpid, testcgroup
+    if cgroup_parent:
+        testcgroup = cgroup_create('test')
+    testpid = watcher.spawn(sys.argv[1:], 'executing test at '+' '.join(sys.argv[1:]),
+                            testcgroup)
+    debug('parent waiting for test '+str(testpid))
+    watcher.run()
 #
 ###
 
@@ -311,11 +922,29 @@ if len(sys.argv) < 2:
 if beah:
     beah_lwd_hook()
 
+if stream_path:
+    try:
+        stream = Stream(stream_path, stream_metafile())
+    except (socket.error, OSError), e:
+        debug('cannot stream progress to '+stream_path+': '+str(e))
+    else:
+        debug('streaming progress to '+stream_path)
+
 exec_test()
 debug('parent done waiting for test')
+report('test', testpid, testcgroup)
 
 exec_cleanup()
 debug('parent done waiting for cleanup')
+if cleanuppid != 0:
+    report('cleanup', cleanuppid, cleanupcgroup)
+
+if stream:
+    stream.close()
+
+for cgroup in (testcgroup, cleanupcgroup):
+    if cgroup:
+        cgroup_remove(cgroup)
 
 # remove temporary (mkstemp'ed) file # no-reboot
 os.unlink(clpath)
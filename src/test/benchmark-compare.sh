@@ -0,0 +1,40 @@
+#!/usr/bin/bash
+# Journal comparison on large journals: generates a pair of journals of $1 MB
+# each (500 by default) and prints time and peak memory of journal-compare.py
+BEAKERLIB="${BEAKERLIB:-$PWD/..}"
+SIZE=${1:-500}
+OLD=$( mktemp ) # no-reboot
+NEW=$( mktemp ) # no-reboot
+
+for JOURNAL in $OLD:PASS $NEW:FAIL; do
+  awk -v size=$(( SIZE * 1024 * 1024 )) -v result=${JOURNAL#*:} 'BEGIN {
+    print "<?xml version=\"1.0\"?>"
+    print "<BEAKER_TEST><header/><log>"
+    written = 0
+    for (phase = 0; written < size; phase++) {
+      printf "<phase name=\"Test %d\" type=\"FAIL\" result=\"PASS\" score=\"0\">\n", phase
+      for (test = 0; test < 1000; test++) {
+        line = sprintf("<test message=\"File /etc/passwd should exist %d\">%s</test>", test, test % 100 ? "PASS" : result)
+        print line
+        written += length(line) + 1
+      }
+      printf "<metric type=\"low\" name=\"time\" value=\"%d.5\" tolerance=\"0.2\"></metric>\n", 10 + phase % 3
+      print "</phase>"
+    }
+    print "</log></BEAKER_TEST>"
+  }' > ${JOURNAL%:*}
+done
+
+python - $BEAKERLIB/python/journal-compare.py $OLD $NEW <<'EOF'
+import resource
+import subprocess
+import sys
+import time
+
+start = time.time()
+subprocess.call(["python"] + sys.argv[1:], stdout=open("/dev/null", "w"))
+elapsed = time.time() - start
+peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+print "journal-compare: %6.2f s, peak memory %d MB" % (elapsed, peak / 1024)
+EOF
+rm -f $OLD $NEW
@@ -0,0 +1,22 @@
+#!/usr/bin/bash
+# Overhead of the memory measuring wrappers: prints wall time of /bin/true
+# run directly, through the bare interpreter and through every wrapper, the
+# median of $1 runs (30 by default). Wrapper should add little more than
+# the interpreter start, not a sampling interval, after the command exits.
+BEAKERLIB="${BEAKERLIB:-$PWD/..}"
+RUNS=${1:-30}
+PYTHON=${PYTHON:-python}
+
+measure() {
+  local median=$( $PYTHON $BEAKERLIB/python/perf-time.py --metric wall --runs $RUNS --warmup 2 "$@" \
+    | awk '$1 == "median" { print $2 * 1000 }' )
+  local label="$*"
+  printf "%-50s %8.2f ms\n" "${label//$BEAKERLIB\/python\//}" $median
+}
+
+measure /bin/true
+measure $PYTHON -c pass
+measure $PYTHON $BEAKERLIB/python/rlMemPeak.py /bin/true
+measure $PYTHON $BEAKERLIB/python/rlMemPeak.py -t /bin/true
+measure $PYTHON $BEAKERLIB/python/rlMemAvg.py /bin/true
+measure $PYTHON $BEAKERLIB/python/resource-profile.py -s /dev/null /bin/true
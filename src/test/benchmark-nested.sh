@@ -0,0 +1,28 @@
+# Deep and wide journal: $1 tests on each level of nested phases,
+# time of journal creation should grow linearly with $1
+JOURNALIST="${__INTERNAL_JOURNALIST:-$BEAKERLIB/python/journalling.py}"
+DEPTH=30
+METAFILE=$( mktemp ) # no-reboot
+
+{
+  echo 'starttime --timestamp="1500000000"'
+  echo 'endtime --timestamp="1500000000"'
+  echo 'log --timestamp="1500000000"'
+  for level in $( seq $DEPTH )
+  do
+    printf -v indent '%*s' $level
+    echo "${indent}phase --timestamp=\"1500000000\" --name=\"TmVzdGVk\" --type=\"RkFJTA==\""
+    for test in $( seq $1 )
+    do
+      echo "${indent} test --timestamp=\"$(( 1500000000 + test ))\" --message=\"VGVzdA==\" -- \"UEFTUw==\""
+    done
+  done
+  for level in $( seq $DEPTH -1 1 )
+  do
+    printf -v indent '%*s' $level
+    echo "${indent}--timestamp=\"1600000000\" --result=\"UEFTUw==\" --score=\"MA==\""
+  done
+} > $METAFILE
+
+$JOURNALIST --metafile $METAFILE > /dev/null
+rm -f $METAFILE
@@ -0,0 +1,41 @@
+#!/usr/bin/bash
+# Metafile parser throughput: generates a metafile of $1 lines (1000000 by
+# default) and prints lines per second of the generic token parser and of the
+# fast path used for lines in the format written by __INTERNAL_WriteToMetafile
+BEAKERLIB="${BEAKERLIB:-$PWD/..}"
+LINES=${1:-1000000}
+METAFILE=$( mktemp ) # no-reboot
+
+awk -v lines=$LINES 'BEGIN {
+  print "test_id --timestamp=\"1500000000\" -- \"MTIzNDU2\""
+  print "starttime --timestamp=\"1500000000\""
+  print "log --timestamp=\"1500000000\""
+  for (line = 3; line < lines; line++) {
+    timestamp = 1500000000 + int(line / 100)
+    if (line % 50 == 3)
+      printf "  phase --timestamp=\"%d\" --name=\"U2V0dXA=\" --type=\"RkFJTA==\"\n", timestamp
+    else if (line % 50 == 2)
+      printf "  --timestamp=\"%d\" --result=\"UEFTUw==\" --score=\"MA==\"\n", timestamp
+    else if (line % 5 == 0)
+      printf "   metric --timestamp=\"%d\" --name=\"dGltZQ==\" --type=\"bG93\" --tolerance=\"MC4y\" -- \"MTIuNQ==\"\n", timestamp
+    else
+      printf "   test --timestamp=\"%d\" --message=\"RmlsZSAvZXRjL3Bhc3N3ZCBzaG91bGQgZXhpc3Q=\" -- \"UEFTUw==\"\n", timestamp
+  }
+}' > $METAFILE
+
+python - $BEAKERLIB/python $METAFILE <<'EOF'
+import sys
+import time
+sys.path.insert(0, sys.argv[1])
+import journalling
+
+lines = open(sys.argv[2]).readlines()
+for name in ("parseGenericLine", "parseLine"):
+    parse = getattr(journalling, name)
+    start = time.time()
+    for line in lines:
+        parse(line)
+    elapsed = time.time() - start
+    print "%-17s %8d lines in %6.2f s: %9d lines/s" % (name + ":", len(lines), elapsed, len(lines) / elapsed)
+EOF
+rm -f $METAFILE
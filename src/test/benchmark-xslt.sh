@@ -0,0 +1,57 @@
+#!/usr/bin/bash
+# XSLT transformation cost: creates journal of a metafile of $1 lines (200000
+# by default) together with its xunit form, first by two separate runs and then
+# by one run with --transform, and prints how long compiling the template takes
+# compared to transforming with the already compiled one
+BEAKERLIB="${BEAKERLIB:-$PWD/..}"
+JOURNALIST="${__INTERNAL_JOURNALIST:-$BEAKERLIB/python/journalling.py}"
+XSLT="$BEAKERLIB/xslt-templates/xunit.xsl"
+LINES=${1:-200000}
+DIR=$( mktemp -d ) # no-reboot
+
+awk -v lines=$LINES 'BEGIN {
+  print "test_id --timestamp=\"1500000000\" -- \"MTIzNDU2\""
+  print "testname --timestamp=\"1500000000\" -- \"YmVuY2htYXJr\""
+  print "starttime --timestamp=\"1500000000\""
+  print "endtime --timestamp=\"1500000000\""
+  print "log --timestamp=\"1500000000\""
+  for (line = 5; line < lines; line++) {
+    timestamp = 1500000000 + int(line / 100)
+    if (line % 50 == 5)
+      printf " phase --timestamp=\"%d\" --name=\"U2V0dXA=\" --type=\"RkFJTA==\"\n", timestamp
+    else if (line % 50 == 4)
+      printf " --timestamp=\"%d\" --result=\"UEFTUw==\" --score=\"MA==\"\n", timestamp
+    else
+      printf "  test --timestamp=\"%d\" --message=\"RmlsZSAvZXRjL3Bhc3N3ZCBzaG91bGQgZXhpc3Q=\" -- \"UEFTUw==\"\n", timestamp
+  }
+  if (line % 50 != 5)
+    printf " --timestamp=\"%d\" --result=\"UEFTUw==\" --score=\"MA==\"\n", timestamp
+}' > $DIR/journal.meta
+
+echo "separate runs:"
+time {
+  $JOURNALIST --metafile $DIR/journal.meta --journal $DIR/journal.xml
+  $JOURNALIST --metafile $DIR/journal.meta --xslt $XSLT --journal $DIR/xunit.xml
+}
+echo "one run with --transform:"
+time $JOURNALIST --metafile $DIR/journal.meta --journal $DIR/journal.xml --transform $XSLT $DIR/xunit.xml
+
+python - $BEAKERLIB/python $XSLT $DIR/journal.xml <<'PYEOF'
+import sys
+import time
+sys.path.insert(0, sys.argv[1])
+import journalling
+from lxml import etree
+
+journal = etree.parse(sys.argv[3])
+start = time.time()
+transform = journalling.compileXSLT(sys.argv[2])
+compiled = time.time()
+transform(journal)
+transformed = time.time()
+journalling.compileXSLT(sys.argv[2])(journal)
+cached = time.time()
+print "compile: %.4f s, transform: %.3f s, cached compile and transform: %.3f s" % (
+    compiled - start, transformed - compiled, cached - transformed)
+PYEOF
+rm -rf $DIR
@@ -357,3 +357,351 @@ test_packageLoggingGuess() {
   assertTrue "rlJournalStart survives garbage in TEST" "rlJournalStart"
   assertFalse "No <pkgdetails> tag when TEST is garbage" "rlJournalPrint | grep -q '<pkgdetails>'"
 }
+
+test_journalStream() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartSetup'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlPhaseStartTest nested'
+  silentIfNotDebug 'rlAssert0 "failed <&>" 1'
+  silentIfNotDebug 'rlLogMetricLow metric 1.5'
+  silentIfNotDebug 'rlPhaseEnd'
+  silentIfNotDebug 'rlPhaseEnd'
+  silentIfNotDebug 'rlLog "loginek"'
+  local tree="$BEAKERLIB_DIR/tree.xml"
+  local stream="$BEAKERLIB_DIR/stream.xml"
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  $__INTERNAL_JOURNALIST --stream --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$stream"
+  assertTrue "streamed journal of an open test is the same as the built one" "cmp $tree $stream"
+  silentIfNotDebug 'rlJournalEnd'
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  $__INTERNAL_JOURNALIST --stream --metafile "$__INTERNAL_BEAKERLIB_METAFILE" > "$stream"
+  assertTrue "streamed journal of a finished test is the same as the built one" "cmp $tree $stream"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCheckpoint() {
+  journalReset
+  local tree="$BEAKERLIB_DIR/tree.xml"
+  silentIfNotDebug 'rlPhaseStartSetup'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  __INTERNAL_JournalXMLCreate
+  assertTrue "checkpoint is created with the journal" "[ -f $__INTERNAL_BEAKERLIB_CHECKPOINT ]"
+  silentIfNotDebug 'rlAssert0 "failed" 1'
+  silentIfNotDebug 'rlPhaseEnd'
+  __INTERNAL_JournalXMLCreate
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  assertTrue "journal continued from checkpoint is the same as the built one" \
+      "cmp $tree $__INTERNAL_BEAKERLIB_JOURNAL"
+
+  local meta="$(head -n -3 $__INTERNAL_BEAKERLIB_METAFILE)"
+  echo "$meta" > $__INTERNAL_BEAKERLIB_METAFILE
+  __INTERNAL_JournalXMLCreate
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  assertTrue "journal is rebuilt when metafile was truncated" \
+      "cmp $tree $__INTERNAL_BEAKERLIB_JOURNAL"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalParser() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartSetup'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlLogMetricLow metric 1.5'
+  silentIfNotDebug 'rlPhaseEnd'
+  local tree="$BEAKERLIB_DIR/tree.xml"
+  local meta="$BEAKERLIB_DIR/handwritten.meta"
+  sed -e 's/ --/\t--/g' -e 's/$/  # comment/' $__INTERNAL_BEAKERLIB_METAFILE > $meta
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  $__INTERNAL_JOURNALIST --metafile "$meta" --journal "$BEAKERLIB_DIR/handwritten.xml"
+  assertTrue "metafile with tabs and comments gives the same journal" \
+      "cmp $tree $BEAKERLIB_DIR/handwritten.xml"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalJobs() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest'
+  silentIfNotDebug 'rlAssert0 "passed <&>" 0'
+  silentIfNotDebug 'rlLogMetricLow metric 1.5'
+  silentIfNotDebug 'rlPhaseEnd'
+  local tree="$BEAKERLIB_DIR/tree.xml"
+  local parallel="$BEAKERLIB_DIR/parallel.xml"
+  # metafile has to be big enough not to be parsed serially anyway
+  local meta="$(awk '/^ +test /{ for (i = 0; i < 100000; i++) print } { print }' $__INTERNAL_BEAKERLIB_METAFILE)"
+  echo "$meta" > $__INTERNAL_BEAKERLIB_METAFILE
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$tree"
+  $__INTERNAL_JOURNALIST --jobs 3 --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$parallel"
+  assertTrue "journal decoded in parallel is the same as the serial one" "cmp $tree $parallel"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalBinaryMetafile() {
+  journalReset
+  local dir="$BEAKERLIB_DIR"
+  local format
+  for format in text binary; do
+    (
+      __INTERNAL_SET_TIMESTAMP() { __INTERNAL_TIMESTAMP=1500000000; }
+      export BEAKERLIB_DIR="$dir/$format" BEAKERLIB_METAFILE_FORMAT=$format
+      rlJournalStart
+      rlPhaseStartSetup "phase -n"
+      rlAssert0 $'multi\nline "<&>" \xc4\x8d' 0
+      rlLogMetricLow metric 1.5
+      rlLog $'bad \x01 char'
+      rlPhaseEnd
+      __INTERNAL_JournalXMLCreate
+      rlPhaseStartTest
+      rlAssert0 "failed" 1
+      rlPhaseEnd
+      __INTERNAL_JournalXMLCreate
+    ) &> /dev/null
+  done
+  assertTrue "binary metafile gives the same journal as the text one" \
+      "cmp $dir/text/journal.xml $dir/binary/journal.xml"
+  assertFalse "binary metafile does not use base64" "grep -q 'bXVsdGkK' $dir/binary/journal.meta"
+  rm -rf $dir
+}
+
+test_journalServer() {
+  journalReset
+  local dir="$BEAKERLIB_DIR"
+  local server
+  for server in 0 1; do
+    (
+      __INTERNAL_SET_TIMESTAMP() { __INTERNAL_TIMESTAMP=1500000000; }
+      export BEAKERLIB_DIR="$dir/$server" BEAKERLIB_JOURNAL_SERVER=$server
+      rlJournalStart
+      for i in $(seq 50); do
+        [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]] && break
+        sleep 0.1
+      done
+      rlPhaseStartSetup
+      rlAssert0 "passed" 0
+      rlPhaseEnd
+      [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]] && touch "$BEAKERLIB_DIR/listening"
+      __INTERNAL_JournalXMLCreate
+      cp "$__INTERNAL_BEAKERLIB_JOURNAL" "$BEAKERLIB_DIR/first.xml"
+      __INTERNAL_JournalServerStop
+      rlPhaseStartTest
+      rlAssert0 "failed" 1
+      rlPhaseEnd
+      __INTERNAL_JournalXMLCreate
+    ) &> /dev/null
+  done
+  assertTrue "journal server is started" "[ -f $dir/1/listening ]"
+  assertTrue "journal from server is the same as the built one" "cmp $dir/0/first.xml $dir/1/first.xml"
+  assertTrue "journal is created without server after it is stopped" \
+      "cmp $dir/0/journal.xml $dir/1/journal.xml"
+  assertFalse "server removes its socket" "[ -e $dir/1/journal.socket ]"
+  rm -rf $dir
+}
+
+test_journalServerSpaces() {
+  journalReset
+  local dir="$BEAKERLIB_DIR/with space"
+  (
+    export BEAKERLIB_DIR="$dir" BEAKERLIB_JOURNAL_SERVER=1
+    rlJournalStart
+    for i in $(seq 50); do
+      [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]] && break
+      sleep 0.1
+    done
+    [[ -S "$__INTERNAL_BEAKERLIB_JOURNAL_SOCKET" ]] && touch "$BEAKERLIB_DIR/listening"
+    __INTERNAL_JournalServerStop
+  ) &> /dev/null
+  assertTrue "journal server is started in a directory with space" "[ -f '$dir/listening' ]"
+  rm -rf "${dir%/*}"
+}
+
+test_journalTransform() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlPhaseEnd'
+  local xslt="$BEAKERLIB/xslt-templates/xunit.xsl"
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$BEAKERLIB_DIR/tree.xml"
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$BEAKERLIB_DIR/xunit.xml" \
+      --xslt "$xslt"
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$BEAKERLIB_DIR/both.xml" \
+      --transform "$xslt" "$BEAKERLIB_DIR/both-xunit.xml" --stream
+  assertTrue "journal is written together with transformed one" "cmp $BEAKERLIB_DIR/tree.xml $BEAKERLIB_DIR/both.xml"
+  assertTrue "transformed journal is the same as with --xslt" \
+      "cmp $BEAKERLIB_DIR/xunit.xml $BEAKERLIB_DIR/both-xunit.xml"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalBatch() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlPhaseEnd'
+  local dir="$BEAKERLIB_DIR/batch"
+  mkdir -p $dir/first $dir/second $dir/broken
+  cp $__INTERNAL_BEAKERLIB_METAFILE $dir/first/journal.meta
+  cp $__INTERNAL_BEAKERLIB_METAFILE $dir/second/journal.meta
+  cp $__INTERNAL_BEAKERLIB_METAFILE $dir/listed.meta
+  echo ' phase --timestamp="1" --name="bad"' > $dir/broken/journal.meta
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$BEAKERLIB_DIR/tree.xml"
+
+  echo "$dir/listed.meta" | $__INTERNAL_JOURNALIST --batch "$dir/*/" --batch-list - --jobs 2 > $dir/summary
+  assertFalse "batch with a broken metafile fails" "[ $? -eq 0 ]"
+  assertTrue "journals are created in batch" \
+      "cmp $BEAKERLIB_DIR/tree.xml $dir/first/journal.xml && cmp $BEAKERLIB_DIR/tree.xml $dir/listed.xml"
+  assertTrue "summary counts conversions" \
+      "tail -n 1 $dir/summary | grep -q '\"converted\": 3, \"failed\": 1, \"skipped\": 0'"
+  assertTrue "summary reports failed metafile" \
+      "grep '\"result\": \"failed\"' $dir/summary | grep -q broken/journal.meta"
+
+  rm -rf $dir/broken
+  $__INTERNAL_JOURNALIST --batch "$dir/*/" > $dir/summary
+  assertTrue "journals newer than metafiles are skipped" \
+      "tail -n 1 $dir/summary | grep -q '\"converted\": 0, \"failed\": 0, \"skipped\": 2'"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalTextHeader() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlPhaseEnd'
+  local size=$(stat -c %s $__INTERNAL_BEAKERLIB_JOURNAL_TXT)
+  __INTERNAL_SET_TIMESTAMP
+  __INTERNAL_update_journal_txt
+  assertTrue "test duration is filled in" \
+      "grep -q '^    Test duration : [0-9]* seconds *\$' $__INTERNAL_BEAKERLIB_JOURNAL_TXT"
+  assertTrue "text journal header is updated in place" \
+      "[ $size -eq $(stat -c %s $__INTERNAL_BEAKERLIB_JOURNAL_TXT) ]"
+  assertTrue "colored journal header is updated" \
+      "grep -q '^    Test finished : .*(still running)' $__INTERNAL_BEAKERLIB_JOURNAL_COLORED"
+
+  sed -i 's/^\(    Test duration : \).*/\1/' $__INTERNAL_BEAKERLIB_JOURNAL_TXT
+  __INTERNAL_update_journal_txt
+  assertTrue "header without reserved space is updated too" \
+      "grep -q '^    Test duration : [0-9]* seconds\$' $__INTERNAL_BEAKERLIB_JOURNAL_TXT"
+
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --text "$BEAKERLIB_DIR/rendered.txt"
+  assertTrue "text journal is rendered from metafile" \
+      "grep -q ':: \[   PASS   \] :: passed' $BEAKERLIB_DIR/rendered.txt"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalStore() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest "perf"'
+  silentIfNotDebug 'rlLogMetricLow metric 1.5'
+  silentIfNotDebug 'rlPhaseEnd'
+  local store="$BEAKERLIB/python/journal-store.py -d $BEAKERLIB_DIR/store.sqlite"
+  mkdir -p $BEAKERLIB_DIR/runs/first $BEAKERLIB_DIR/runs/second
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$BEAKERLIB_DIR/runs/first/journal.xml"
+  sed 's/value="1.5"/value="2.5"/' $BEAKERLIB_DIR/runs/first/journal.xml > $BEAKERLIB_DIR/runs/second/journal.xml
+
+  assertTrue "journals are ingested" \
+      "$store ingest $BEAKERLIB_DIR/runs | grep -q 'Ingested 2 journals with 2 metrics'"
+  assertTrue "unchanged journals are skipped" \
+      "$store ingest $BEAKERLIB_DIR/runs | grep -q 'Ingested 0 journals.*2 unchanged skipped'"
+  assertTrue "trend lists metric of all runs" \
+      "[ \"\$($store trend metric --phase perf | cut -f 3 | sort | xargs)\" == '1.5 2.5' ]"
+  assertTrue "percentile is computed from stored values" \
+      "$store percentile metric -p 50 | grep -q '^p50.2.0$'"
+  assertTrue "compare takes baseline from store" \
+      "$BEAKERLIB/python/journal-compare.py -s $BEAKERLIB_DIR/store.sqlite $BEAKERLIB_DIR/runs/first/journal.xml $BEAKERLIB_DIR/runs/first/journal.xml | grep -q 'Old mean 2, .* 2 runs'"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompareFormats() {
+  journalReset
+  silentIfNotDebug 'rlPhaseStartTest "compared"'
+  silentIfNotDebug 'rlAssert0 "passed" 0'
+  silentIfNotDebug 'rlPhaseEnd'
+  local compare="$BEAKERLIB/python/journal-compare.py"
+  local old="$BEAKERLIB_DIR/old.xml" new="$BEAKERLIB_DIR/new.xml"
+  $__INTERNAL_JOURNALIST --metafile "$__INTERNAL_BEAKERLIB_METAFILE" --journal "$old"
+  sed 's/>PASS</>FAIL</' $old > $new
+
+  $compare $old $old > /dev/null
+  assertTrue "identical journals pass" "[ $? -eq 0 ]"
+  $compare -f json $old $new > $BEAKERLIB_DIR/report.json
+  assertTrue "exit code reflects failed test" "[ $? -eq 2 ]"
+  assertTrue "json report is valid" \
+      "$PYTHON -c 'import json, sys; json.load(open(sys.argv[1]))' $BEAKERLIB_DIR/report.json"
+  assertTrue "json report has summary" \
+      "grep -q '\"summary\": {\"ERROR\": 0, \"FAIL\": 1, \"PASS\": 0, \"WARN\": 0, \"result\": \"FAIL\"}' $BEAKERLIB_DIR/report.json"
+  echo "$old $BEAKERLIB_DIR/missing.xml" | $compare -f junit --pair $old $old --pair-list - --jobs 2 > $BEAKERLIB_DIR/report.xml
+  assertTrue "worst result of pairs is returned" "[ $? -eq 3 ]"
+  assertTrue "junit report has error of missing journal" \
+      "grep -q '<error message=\"Failed to compare' $BEAKERLIB_DIR/report.xml"
+  rm -rf $BEAKERLIB_DIR
+}
+
+test_journalCompareStatistics() {
+  local compare="$BEAKERLIB/python/journal-compare.py"
+  local load="import imp; compare = imp.load_source('compare', '$compare')"
+  assertTrue "orderings of values are counted by U" \
+      "[ \"\$($PYTHON -c \"$load; print(compare.uCounts(3, 3))\")\" == '[1, 1, 2, 3, 3, 3, 3, 2, 1, 1]' ]"
+  assertTrue "exact p-value of small samples without ties" \
+      "[ \"\$($PYTHON -c \"$load; print('%.6f %.6f' % (compare.mannWhitney([1, 2, 3], [4, 5, 6]), compare.mannWhitney([1, 2, 3], [2.5, 4, 5])))\")\" == '0.050000 0.100000' ]"
+  # U = 14, tie corrected variance 16/12 * (9 - 72/56), continuity correction
+  assertTrue "normal approximation with ties" \
+      "[ \"\$($PYTHON -c \"$load; print('%.6f' % compare.mannWhitney([1, 1, 2, 2], [2, 2, 3, 3]))\")\" == '0.043179' ]"
+}
+
+# Writes journal with phases named by the arguments, each with a test and
+# metric m of value $2
+compareJournal() {
+  local journal="$1" value="$2" phase
+  shift 2
+  {
+    echo "<BEAKER_TEST><log>"
+    for phase in "$@"; do
+      echo "<phase name=\"$phase\" type=\"FAIL\"><test message=\"t\">PASS</test>"
+      echo "<metric name=\"m\" type=\"low\" tolerance=\"0.3\">$value</metric></phase>"
+    done
+    echo "</log></BEAKER_TEST>"
+  } > "$journal"
+}
+
+test_journalCompareRuns() {
+  journalReset
+  mkdir -p $BEAKERLIB_DIR
+  local compare="$BEAKERLIB/python/journal-compare.py"
+  local dir="$BEAKERLIB_DIR" runs value index
+  for index in 1 2 3 4 5; do
+    compareJournal $dir/old$index $((index + 9)) "phase"
+    compareJournal $dir/same$index $((index + 9)).5 "phase"
+    compareJournal $dir/slower$index $((index + 11)).5 "phase"
+    compareJournal $dir/slowest$index $((index + 19)) "phase"
+  done
+  runs() {
+    local kind="$1" index
+    for index in 1 2 3 4 5; do echo "-o $dir/old$index -n $dir/$kind$index"; done
+  }
+  # old 10..14, slower 12.5..16.5 has p-value 0.028, median 14.5 within
+  # tolerance of old median 12, slowest 20..24 has p-value 1/252
+  $compare $(runs same) > /dev/null
+  assertTrue "runs not significantly different pass" "[ $? -eq 0 ]"
+  $compare $(runs slower) > $dir/report
+  assertTrue "significant regression within tolerance warns" "[ $? -eq 1 ]"
+  assertTrue "p-value is reported" "grep -q 'p-value 0.0278' $dir/report"
+  $compare --alpha 0.01 $(runs slower) > /dev/null
+  assertTrue "regression not significant at lower alpha passes" "[ $? -eq 0 ]"
+  $compare --alpha 0.01 $(runs slowest) > /dev/null
+  assertTrue "significant regression over tolerance fails" "[ $? -eq 2 ]"
+  rm -rf $dir
+}
+
+test_journalComparePhases() {
+  journalReset
+  mkdir -p $BEAKERLIB_DIR
+  local compare="$BEAKERLIB/python/journal-compare.py"
+  local dir="$BEAKERLIB_DIR"
+  local statuses="import json, sys; print(' '.join(['%s:%s' % (phase['name'], phase['status']) for phase in json.load(sys.stdin)['pairs'][0]['phases']]))"
+  compareJournal $dir/old 1 A B C B
+  compareJournal $dir/inserted 1 A X B C B
+  compareJournal $dir/renamed 1 A Y C B
+  assertTrue "inserted phase is added, the others compared" \
+      "[ \"\$($compare -f json $dir/old $dir/inserted | $PYTHON -c \"$statuses\")\" == 'A:compared X:added B:compared C:compared B:compared' ]"
+  assertTrue "renamed phase is removed and added, the others compared" \
+      "[ \"\$($compare -f json $dir/old $dir/renamed | $PYTHON -c \"$statuses\")\" == 'A:compared B:removed Y:added C:compared B:compared' ]"
+  rm -rf $dir
+}
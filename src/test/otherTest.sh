@@ -28,3 +28,49 @@ test_allFunctionsHighlight() {
       perl -e 'map { s/.*(obsolete|deprecate|^rlj).*//s; s/ .*/\n/s; print } \
       (join \"\", <>) =~ m/^rl.*?^}/msg;'");
 }
+
+test_daemonizeBatch() {
+    local dir="$(mktemp -d)" # no-reboot
+    cat > $dir/spec <<EOS
+# two daemons and a background job
+--pidfile $dir/one.pid "sleep 30"
+
+--pidfile $dir/two.pid --ioredir /dev/null,$dir/two.out,$dir/two.err "sleep 30"
+--background --pidfile $dir/three.pid "sleep 30"
+EOS
+    assertTrue "daemons of a batch file are started" "$__INTERNAL_DAEMONIZE --batch $dir/spec"
+    local name
+    for name in one two three; do
+        assertTrue "$name has its pidfile written" "kill -0 \$(cat $dir/$name.pid)"
+    done
+    assertTrue "daemon runs in a session of its own" \
+        "[ \$(ps -o sid= -p \$(cat $dir/one.pid)) -ne \$(ps -o sid= -p $$) ]"
+    assertTrue "background job stays in the session" \
+        "[ \$(ps -o sid= -p \$(cat $dir/three.pid)) -eq \$(ps -o sid= -p $$) ]"
+    kill $(cat $dir/*.pid) 2>/dev/null
+    rm -rf $dir
+}
+
+test_daemonizeBatchError() {
+    local dir="$(mktemp -d)" # no-reboot
+    cat > $dir/spec <<EOS
+--pidfile $dir/one.pid "sleep 30"
+--su nobody "sleep 30"
+EOS
+    assertRun "$__INTERNAL_DAEMONIZE --batch $dir/spec 2> $dir/err" 1 "bad line fails the batch"
+    assertTrue "error names the file and line" "grep -q '^error: $dir/spec:2: ' $dir/err"
+    assertFalse "nothing is started before the error" "[ -e $dir/one.pid ]"
+    rm -rf $dir
+}
+
+test_daemonizeFds() {
+    local dir="$(mktemp -d)" # no-reboot
+    exec 7> $dir/seven 9> $dir/nine
+    $__INTERNAL_DAEMONIZE --pidfile $dir/pid "sleep 30"
+    exec 7>&- 9>&-
+    sleep 0.5
+    assertTrue "daemon keeps only fds 0-2" \
+        "[ \"\$(ls /proc/\$(cat $dir/pid)/fd | sort | xargs)\" == '0 1 2' ]"
+    kill $(cat $dir/pid)
+    rm -rf $dir
+}
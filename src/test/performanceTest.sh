@@ -0,0 +1,73 @@
+# Copyright (c) 2018 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+test_rlPerfTime_RunsInTime() {
+    local result
+    result="$(rlPerfTime_RunsInTime "sleep 0.1" 0.5 2 2>/dev/null)"
+    assertTrue "runs are counted" "[[ '$result' =~ ^[1-5]$ ]]"
+
+    local file="$BEAKERLIB_DIR/runs"
+    __INTERNAL_countRun() { echo run >> "$1"; }
+    result="$(rlPerfTime_RunsInTime '__INTERNAL_countRun "$file" | cat; true' 0.2 2 2>/dev/null)"
+    assertTrue "functions, variables and shell syntax can be used" \
+        "[[ '$result' =~ ^[0-9]+$ ]] && [ \$(wc -l < '$file') -ge 2 ]"
+    unset -f __INTERNAL_countRun
+
+    assertRun "rlPerfTime_RunsInTime 'false' 0.2 1" 1 \
+        "failing runs make rlPerfTime_RunsInTime fail"
+    result="$(rlPerfTime_RunsInTime false 0.2 1 2>/dev/null)"
+    assertTrue "count of failing runs is not printed" "[ -z '$result' ]"
+}
+
+test_rlPerfTime_AvgFromRuns() {
+    local result
+    result="$(rlPerfTime_AvgFromRuns -m wall "sleep 0.1" 2>/dev/null)"
+    assertTrue "average wall time is printed" "[[ '$result' =~ ^0\.1[0-9]{4}$ ]]"
+    assertTrue "runs given are made" "grep -q 'runs: 3$' $__INTERNAL_BEAKERLIB_JOURNAL_TXT"
+
+    journalReset
+    silentIfNotDebug 'rlJournalStart'
+    silentIfNotDebug 'rlPerfTime_AvgFromRuns -p 0.2 -m wall "sleep 0.05" 3 nowarmup'
+    local runs="$(sed -n 's/.*runs: \([0-9]*\)$/\1/p' $__INTERNAL_BEAKERLIB_JOURNAL_TXT)"
+    assertTrue "runs with precision stop once it is reached" "[ '$runs' -eq 3 ]"
+
+    journalReset
+    silentIfNotDebug 'rlJournalStart'
+    silentIfNotDebug 'rlPerfTime_AvgFromRuns -p 0.000001 -m wall true 3 nowarmup'
+    runs="$(sed -n 's/.*runs: \([0-9]*\)$/\1/p' $__INTERNAL_BEAKERLIB_JOURNAL_TXT)"
+    assertTrue "runs with precision continue until it is reached" "[ '$runs' -gt 3 ]"
+
+    assertRun "rlPerfTime_AvgFromRuns false" 1 \
+        "failing runs make rlPerfTime_AvgFromRuns fail"
+}
+
+test_rlResourceProfile() {
+    local csv="$BEAKERLIB_DIR/profile.csv"
+    assertRun "rlResourceProfile true" 0 "exit status of the command is returned"
+    assertRun "rlResourceProfile 'exit 3'" 3 "failing command fails rlResourceProfile"
+
+    silentIfNotDebug "rlResourceProfile -o $csv -i 0.05 'sleep 0.3'"
+    assertTrue "csv starts with the columns" \
+        "head -n 1 $csv | grep -qx 'time,cpu_user,cpu_system,rss,threads,read_bytes,write_bytes,.*'"
+    assertTrue "csv has the samples" "[ \$(tail -n +2 $csv | grep -c '^[0-9.]*,') -ge 3 ]"
+
+    journalReset
+    silentIfNotDebug 'rlJournalStart'
+    silentIfNotDebug 'rlPhaseStartTest'
+    silentIfNotDebug "rlResourceProfile -m prof 'sleep 0.2'"
+    silentIfNotDebug 'rlPhaseEnd'
+    assertTrue "summary is stored as metrics" \
+        "rlJournalPrint | grep -q '<metric [^>]*name=\"prof.rss_peak\"'"
+    assertFalse "exit status is not a metric" \
+        "rlJournalPrint | grep -q 'name=\"prof.exit_status\"'"
+}
@@ -275,6 +275,12 @@ export TESTID='123456'
 export TEST='beakerlib-unit-tests'
 . ../beakerlib.sh
 export __INTERNAL_JOURNALIST="$BEAKERLIB/python/journalling.py"
+export __INTERNAL_JOURNAL_CLIENT="$BEAKERLIB/python/journal-client.py"
+export __INTERNAL_DAEMONIZE="$BEAKERLIB/python/daemonize.py"
+export __INTERNAL_PERF_TIME="$BEAKERLIB/python/perf-time.py"
+export __INTERNAL_RESOURCE_PROFILER="$BEAKERLIB/python/resource-profile.py"
+# Interpreter of the installed python scripts, for tests using their modules
+export PYTHON=${PYTHON:-/usr/bin/python}
 export OUTPUTFILE=$(mktemp) # no-reboot
 export SCOREFILE=$(mktemp) # no-reboot
 rlJournalStart
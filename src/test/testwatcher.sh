@@ -86,9 +86,12 @@ watcherloc="../python/testwatcher.py"
 [ -f "$watcherloc" ] || watcherloc="python/testwatcher.py"
 [ -f "$watcherloc" ] || error "could not find testwatcher.py"
 cp "$watcherloc" "$tmpdir/."
+# runner imports beakerlib python modules
+cp "${watcherloc%/*}/testrunner.py" "$tmpdir/."
+export BEAKERLIB="${BEAKERLIB:-$(cd "${watcherloc%/*}/.." && pwd)}"
 cd "$tmpdir"
 
-chmod +x testwatcher.py
+chmod +x testwatcher.py testrunner.py
 
 set +e
 
@@ -268,6 +271,89 @@ wait
 + grep 'end' cleanup.log && fail
 rm -f test.sh test.log cleanup.sh cleanup.log
 
+#
+# runner of several tests (testrunner.py):
+# - tests run concurrently, each with its BEAKERLIB_DIR and watchdog budget
+########
+testcase "runner: tests run at once, budget expired, summary written"
+mkdir one two
+mktest one/runtest.sh 'echo "$BEAKERLIB_DIR" > one.log; sleep 2'
+mktest two/runtest.sh 'echo ./cleanup.sh > "$TESTWATCHER_CLPATH"' \
+                      'echo start > two.log; sleep 10; echo end >> two.log'
+mktest two/cleanup.sh 'echo end > cleanup.log'
+start=$(date +%s)
++ ./testrunner.py -j 2 -t 3 -o results -w ./testwatcher.py one two
++ [ $(( $(date +%s) - start )) -lt 6 ] || fail  # run at once, two killed after 3s
++ grep 'results/one$' one/one.log || fail
++ grep 'start' two/two.log || fail
++ grep 'end' two/two.log && fail
++ grep 'end' two/cleanup.log || fail
++ grep -E ' 0 .* one ' results/summary.txt || fail
++ grep -E ' 137 .* two ' results/summary.txt || fail
+rm -rf one two results
+
+########
+testcase "runner: exit status of a watcher which did not store the test's one"
+mkdir one two
+mktest one/runtest.sh 'true'
+mktest two/runtest.sh 'true'
+mktest watcher.sh 'case "$PWD" in' \
+                  '  */one) exit 3 ;;' \
+                  '  *) kill -TERM $$ ;;' \
+                  'esac'
++ ./testrunner.py -o results -w ./watcher.sh one two
++ grep -E ' 3 .* one ' results/summary.txt || fail
++ grep -E ' 143 .* two ' results/summary.txt || fail
+rm -rf one two results watcher.sh
+
+#
+# progress streaming (TESTWATCHER_STREAM):
+# - metafile records written by the test decoded and sent to clients
+########
+testcase "stream: records of metafile streamed as they are written"
+mktest test.sh 'echo "  phase --timestamp=\"1\" --name=\"$(echo -n Setup | base64)\"" >> "$BEAKERLIB_DIR/journal.meta"' \
+               'sleep 2' \
+               'echo "  --timestamp=\"2\" --result=\"$(echo -n PASS | base64)\"" >> "$BEAKERLIB_DIR/journal.meta"'
+cat > client.py <<'EOF'
+import socket, sys, time
+for attempt in range(50):
+    s = socket.socket(socket.AF_UNIX)
+    try:
+        s.connect(sys.argv[1])
+        break
+    except socket.error:
+        s.close()
+        time.sleep(0.1)
+sys.stdout.write(s.makefile().read())
+EOF
+BEAKERLIB_DIR="$tmpdir/bl" TESTWATCHER_STREAM=stream.sock ./testwatcher.py ./test.sh &
++ python client.py stream.sock > stream.log
+wait
++ grep '"event": "phase", "name": "Setup", "timestamp": 1' stream.log || fail
++ grep '"event": "phase_end", "name": "Setup", "result": "PASS"' stream.log || fail
++ grep '"event": "testwatcher", "exit_status": 0, "part": "test"' stream.log || fail
++ [ -e stream.sock ] && fail
+rm -rf test.sh client.py stream.log bl
+
+#
+# cgroup v2 containment, only when TESTWATCHER_CGROUP is given:
+# - test interrupted, daemon it started in a new session killed with it
+########
+if [ -n "$TESTWATCHER_CGROUP" ]; then
+testcase "cgroup(SIGINT): test interrupted, its daemon killed"
+mktest test.sh 'setsid sleep 1234 </dev/null >/dev/null 2>&1 &' \
+               'echo start > test.log; sleep 10; echo end >> test.log'
+TESTWATCHER_METRICS=metrics.log + ./testwatcher.py ./test.sh &
+sleep 1
++ pkill -INT -P $! testwatcher.py
+wait
++ grep 'start' test.log || fail
++ grep 'end' test.log && fail
++ pgrep -f 'sleep 1234' && fail  # daemon is supposed to be killed too
++ grep '^test.cpu.usage_usec' metrics.log || fail
+rm -f test.sh test.log metrics.log
+fi
+
 
 
 ################################################################################
@@ -21,7 +21,7 @@ syn keyword blrpmKeyword rlCheckRpm rlAssertRpm rlAssertNotRpm rlAssertBinaryOri
 syn keyword blMountKeyword rlMount rlCheckMount rlAssertMount rlAnyMounted rlHash rlUnhash
 syn keyword blInfoKeyword rlShowPackageVersion rlGetArch rlGetDistroRelease rlGetDistroVariant rlShowRunningKernel rlGetPrimaryArch rlGetSecondaryArch
 syn keyword blMetricKeyword rlLogMetricLow rlLogMetricHigh
-syn keyword blTimeKeyword rlPerfTime_RunsInTime rlPerfTime_AvgFromRuns
+syn keyword blTimeKeyword rlPerfTime_RunsInTime rlPerfTime_AvgFromRuns rlResourceProfile
 syn keyword blXserverKeyword rlVirtualXStart rlVirtualXGetDisplay rlVirtualXStop rlVirtXGetCorrectID rlVirtXGetPid rlVirtXStartDisplay
 syn keyword blCleanupKeyword rlCleanupAppend rlCleanupPrepend
 syn keyword blAnalyzeKeyword rlDejaSum rlImport